@@ -10,13 +10,17 @@
 from __future__ import print_function, division
 import struct
 import re
+import sqlite3
 import os
 import os.path
 import sys
 import hashlib
 import datetime
+import mmap
 import time
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from contextlib import closing
+from multiprocessing import Pool, cpu_count
 from binascii import hexlify, unhexlify
 
 settings = {}
@@ -26,52 +30,134 @@ def hex_switchEndian(s):
     pairList = [s[i:i+2].encode() for i in range(0, len(s), 2)]
     return b''.join(pairList[::-1]).decode()
 
-def uint32(x):
-    return x & 0xffffffff
-
-def bytereverse(x):
-    return uint32(( ((x) << 24) | (((x) << 8) & 0x00ff0000) |
-               (((x) >> 8) & 0x0000ff00) | ((x) >> 24) ))
+def deser_compact_size(buf, pos):
+    """Decode a CompactSize at buf[pos:], returning (value, new position)."""
+    nit = buf[pos]
+    if not isinstance(nit, int):  # Python 2 str slices
+        nit = ord(nit)
+    if nit < 253:
+        return nit, pos + 1
+    if nit == 253:
+        return struct.unpack_from("<H", buf, pos + 1)[0], pos + 3
+    if nit == 254:
+        return struct.unpack_from("<I", buf, pos + 1)[0], pos + 5
+    return struct.unpack_from("<Q", buf, pos + 1)[0], pos + 9
+
+def parse_blk_hdr(buf, pos, height_in_header, signed_blocks):
+    """Parse the serialized block header starting at buf[pos:].
+
+    Elements headers are variable-length: block_height follows nTime when the
+    chain runs with -con_blockheightinheader, and signed blocks carry a CProof
+    (challenge and solution scripts) instead of nBits/nNonce. The block hash
+    commits to the challenge but not to the solution, see CProof.
+
+    Returns (hash, nTime, end of header), with hash in internal byte order."""
+    nTime = struct.unpack_from("<I", buf, pos + 68)[0]
+    hash_end = pos + 72
+    if height_in_header:
+        hash_end += 4
+    if signed_blocks:
+        challenge_len, hash_end = deser_compact_size(buf, hash_end)
+        hash_end += challenge_len
+        solution_len, hdr_end = deser_compact_size(buf, hash_end)
+        hdr_end += solution_len
+    else:
+        hash_end += 8
+        hdr_end = hash_end
+    if hdr_end > len(buf):
+        raise ValueError("Truncated block header")
+    return calc_hdr_hash(buf[pos:hash_end]), nTime, hdr_end
 
-def bufreverse(in_buf):
-    out_words = []
-    for i in range(0, len(in_buf), 4):
-        word = struct.unpack('@I', in_buf[i:i+4])[0]
-        out_words.append(struct.pack('@I', bytereverse(word)))
-    return b''.join(out_words)
+def calc_hdr_hash(blk_hdr):
+    return hashlib.sha256(hashlib.sha256(blk_hdr).digest()).digest()
 
-def wordreverse(in_buf):
-    out_words = []
-    for i in range(0, len(in_buf), 4):
-        out_words.append(in_buf[i:i+4])
-    out_words.reverse()
-    return b''.join(out_words)
+def calc_hash_str(blk_hash):
+    return hexlify(blk_hash[::-1]).decode('utf-8')
 
-def calc_hdr_hash(blk_hdr):
-    hash1 = hashlib.sha256()
-    hash1.update(blk_hdr)
-    hash1_o = hash1.digest()
-
-    hash2 = hashlib.sha256()
-    hash2.update(hash1_o)
-    hash2_o = hash2.digest()
-
-    return hash2_o
-
-def calc_hash_str(blk_hdr):
-    hash = calc_hdr_hash(blk_hdr)
-    hash = bufreverse(hash)
-    hash = wordreverse(hash)
-    hash_str = hexlify(hash).decode('utf-8')
-    return hash_str
-
-def get_blk_dt(blk_hdr):
-    members = struct.unpack("<I", blk_hdr[68:68+4])
-    nTime = members[0]
+def get_blk_dt(nTime):
     dt = datetime.datetime.fromtimestamp(nTime)
     dt_ym = datetime.datetime(dt.year, dt.month, 1)
     return (dt_ym, nTime)
 
+def scan_block_file(job):
+    """Index the blocks stored in one blkNNNNN.dat, from a given offset.
+
+    Runs in a worker process. Returns a list of (hash, offset, size, nTime)
+    extents, where offset/size cover the whole on-disk record (magic, length
+    and block) so that it can be copied out with a single slice, the offset
+    the scan stopped at, and an error message if it had to stop early."""
+    fname, start, netmagic, height_in_header, signed_blocks = job
+    extents = []
+    pos = start
+    with open(fname, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return extents, pos, None
+        with closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as buf:
+            end = len(buf)
+            # Block files are preallocated, so the data ends at the first
+            # record that isn't fully there or at the zeroed tail.
+            while pos + 8 <= end:
+                inMagic = buf[pos:pos + 4]
+                if inMagic == b"\0\0\0\0":
+                    break
+                if inMagic != netmagic:
+                    return extents, pos, "Invalid magic: %s at %s:%i" % (hexlify(inMagic).decode('utf-8'), fname, pos)
+                inLen = struct.unpack_from("<I", buf, pos + 4)[0]
+                if pos + 8 + inLen > end:
+                    break
+                try:
+                    blk_hash, nTime, _ = parse_blk_hdr(buf, pos + 8, height_in_header, signed_blocks)
+                except (ValueError, struct.error, IndexError):
+                    return extents, pos, "Invalid block header at %s:%i" % (fname, pos)
+                extents.append((blk_hash, pos, 8 + inLen, nTime))
+                pos += 8 + inLen
+    return extents, pos, None
+
+class BlockIndex:
+    """Sidecar index of the block extents found in the input files.
+
+    For each input file, the offset up to which it has been scanned is kept
+    along with the blocks found so far, so that later runs only need to scan
+    data appended since. Heights aren't stored: they are looked up in the
+    current hash list, which makes the index independent of reorgs."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (fn INTEGER PRIMARY KEY, scanned_to INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS blocks (hash BLOB PRIMARY KEY, fn INTEGER NOT NULL, "
+                        "offset INTEGER NOT NULL, size INTEGER NOT NULL, ntime INTEGER NOT NULL)")
+        self.db.commit()
+
+    def resumeOffset(self, fn, fname):
+        """Offset to resume scanning fname at, or None if there is no new data."""
+        row = self.db.execute("SELECT scanned_to FROM files WHERE fn = ?", (fn,)).fetchone()
+        if row is None:
+            return 0
+        scanned_to = row[0]
+        if os.path.getsize(fname) < scanned_to:
+            # Shorter than what was indexed: not the same file anymore
+            self.db.execute("DELETE FROM blocks WHERE fn = ?", (fn,))
+            return 0
+        with open(fname, "rb") as f:
+            f.seek(scanned_to)
+            inMagic = f.read(4)
+        if len(inMagic) < 4 or inMagic == b"\0\0\0\0":
+            return None
+        return scanned_to
+
+    def update(self, fn, scanned_to, extents):
+        self.db.executemany("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?)",
+                            [(blk_hash, fn, offset, size, nTime) for blk_hash, offset, size, nTime in extents])
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (fn, scanned_to))
+        # Commit file by file so that an interrupted scan keeps its progress
+        self.db.commit()
+
+    def extents(self):
+        return self.db.execute("SELECT fn, hash, offset, size, ntime FROM blocks ORDER BY fn, offset")
+
+    def close(self):
+        self.db.close()
+
 # When getting the list of block hashes, undo any byte reversals.
 def get_block_hashes(settings):
     blkindex = []
@@ -93,17 +179,20 @@ def mkblockmap(blkindex):
         blkmap[hash] = height
     return blkmap
 
-# Block header and extent on disk
-BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'inhdr', 'blkhdr', 'size'])
+# Block extent on disk: the whole record, including magic and length
+BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'size', 'nTime'])
 
 class BlockDataCopier:
+    # Input files kept mapped at once during the copy phase
+    MAX_OPEN_INPUTS = 16
+    # Upper bound for a single coalesced write
+    MAX_WRITE_SZ = 64 * 1024 * 1024
+
     def __init__(self, settings, blkindex, blkmap):
         self.settings = settings
         self.blkindex = blkindex
         self.blkmap = blkmap
 
-        self.inFn = 0
-        self.inF = None
         self.outFn = 0
         self.outsz = 0
         self.outF = None
@@ -123,34 +212,113 @@ class BlockDataCopier:
             self.setFileTime = True
         if settings['split_timestamp'] != 0:
             self.timestampSplit = True
-        # Extents and cache for out-of-order blocks
+        # Extents of the blocks to copy, by height
         self.blockExtents = {}
-        self.outOfOrderData = {}
-        self.outOfOrderSize = 0 # running total size for items in outOfOrderData
-
-    def writeBlock(self, inhdr, blk_hdr, rawblock):
-        blockSizeOnDisk = len(inhdr) + len(blk_hdr) + len(rawblock)
-        if not self.fileOutput and ((self.outsz + blockSizeOnDisk) > self.maxOutSz):
-            self.outF.close()
-            if self.setFileTime:
-                os.utime(self.outFname, (int(time.time()), self.highTS))
-            self.outF = None
-            self.outFname = None
-            self.outFn = self.outFn + 1
-            self.outsz = 0
-
-        (blkDate, blkTS) = get_blk_dt(blk_hdr)
+        # Mapped input files, least recently used first
+        self.inputs = OrderedDict()
+        # Pending run of contiguous input data: (fn, start, end)
+        self.pending = None
+
+    def inFileName(self, fn):
+        return os.path.join(self.settings['input'], "blk%05d.dat" % fn)
+
+    def inFileCount(self):
+        fn = 0
+        while os.path.exists(self.inFileName(fn)):
+            fn += 1
+        return fn
+
+    def addExtent(self, fn, blk_hash, offset, size, nTime):
+        hash_str = calc_hash_str(bytes(blk_hash))
+        if hash_str not in self.blkmap:
+            # Because blocks can be written to files out-of-order as of 0.10, the script
+            # may encounter blocks it doesn't know about. Treat as debug output.
+            if self.settings['debug_output'] == 'true':
+                print("Skipping unknown block " + hash_str)
+            return
+        self.blockExtents[self.blkmap[hash_str]] = BlockExtent(fn, offset, size, nTime)
+        self.blkCountIn += 1
+
+    def scan(self):
+        """Build the block extent index, one input file per worker process.
+
+        With an index file, only the data added since the previous run is
+        scanned and the rest of the extents are read back from the index."""
+        index = None
+        if 'index_file' in self.settings:
+            index = BlockIndex(self.settings['index_file'])
+        try:
+            jobs = []
+            for fn in range(self.inFileCount()):
+                fname = self.inFileName(fn)
+                start = index.resumeOffset(fn, fname) if index else 0
+                if start is not None:
+                    jobs.append((fn, (fname, start, self.settings['netmagic'], self.settings['con_blockheightinheader'],
+                                      self.settings['con_signed_blocks'])))
+            if index:
+                print("%i input files to scan" % len(jobs))
+
+            pool = Pool(min(self.settings['scan_processes'], max(len(jobs), 1)))
+            try:
+                # imap keeps file order, so duplicates resolve as in a sequential scan
+                results = pool.imap(scan_block_file, [job for _, job in jobs])
+                for (fn, job), (extents, scanned_to, error) in zip(jobs, results):
+                    print("Input file " + job[0])
+                    if error:
+                        print(error)
+                    if index:
+                        index.update(fn, scanned_to, extents)
+                    else:
+                        for extent in extents:
+                            self.addExtent(fn, *extent)
+            finally:
+                pool.close()
+                pool.join()
+
+            if index:
+                for row in index.extents():
+                    self.addExtent(*row)
+        finally:
+            if index:
+                index.close()
+        print("%i blocks scanned" % self.blkCountIn)
+
+    def inputData(self, fn):
+        buf = self.inputs.pop(fn, None)
+        if buf is None:
+            if len(self.inputs) >= self.MAX_OPEN_INPUTS:
+                self.inputs.popitem(last=False)[1].close()
+            with open(self.inFileName(fn), "rb") as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.inputs[fn] = buf
+        return buf
+
+    def flush(self):
+        if self.pending:
+            fn, start, end = self.pending
+            self.outF.write(self.inputData(fn)[start:end])
+            self.pending = None
+
+    def closeOutput(self):
+        self.flush()
+        self.outF.close()
+        if self.setFileTime:
+            os.utime(self.outFname, (int(time.time()), self.highTS))
+        self.outF = None
+        self.outFname = None
+        self.outFn = self.outFn + 1
+        self.outsz = 0
+
+    def writeBlock(self, extent):
+        if not self.fileOutput and ((self.outsz + extent.size) > self.maxOutSz):
+            self.closeOutput()
+
+        (blkDate, blkTS) = get_blk_dt(extent.nTime)
         if self.timestampSplit and (blkDate > self.lastDate):
-            print("New month " + blkDate.strftime("%Y-%m") + " @ " + self.hash_str)
+            print("New month " + blkDate.strftime("%Y-%m") + " @ " + self.blkindex[self.blkCountOut])
             self.lastDate = blkDate
             if self.outF:
-                self.outF.close()
-                if self.setFileTime:
-                    os.utime(self.outFname, (int(time.time()), self.highTS))
-                self.outF = None
-                self.outFname = None
-                self.outFn = self.outFn + 1
-                self.outsz = 0
+                self.closeOutput()
 
         if not self.outF:
             if self.fileOutput:
@@ -160,99 +328,42 @@ class BlockDataCopier:
             print("Output file " + self.outFname)
             self.outF = open(self.outFname, "wb")
 
-        self.outF.write(inhdr)
-        self.outF.write(blk_hdr)
-        self.outF.write(rawblock)
-        self.outsz = self.outsz + len(inhdr) + len(blk_hdr) + len(rawblock)
+        # Blocks that follow each other in the input are written out together
+        start = extent.offset
+        end = extent.offset + extent.size
+        if self.pending and self.pending[0] == extent.fn and self.pending[2] == start and \
+                end - self.pending[1] <= self.MAX_WRITE_SZ:
+            self.pending = (extent.fn, self.pending[1], end)
+        else:
+            self.flush()
+            self.pending = (extent.fn, start, end)
+        self.outsz = self.outsz + extent.size
 
         self.blkCountOut = self.blkCountOut + 1
         if blkTS > self.highTS:
             self.highTS = blkTS
 
         if (self.blkCountOut % 1000) == 0:
-            print('%i blocks scanned, %i blocks written (of %i, %.1f%% complete)' %
-                    (self.blkCountIn, self.blkCountOut, len(self.blkindex), 100.0 * self.blkCountOut / len(self.blkindex)))
-
-    def inFileName(self, fn):
-        return os.path.join(self.settings['input'], "blk%05d.dat" % fn)
-
-    def fetchBlock(self, extent):
-        '''Fetch block contents from disk given extents'''
-        with open(self.inFileName(extent.fn), "rb") as f:
-            f.seek(extent.offset)
-            return f.read(extent.size)
-
-    def copyOneBlock(self):
-        '''Find the next block to be written in the input, and copy it to the output.'''
-        extent = self.blockExtents.pop(self.blkCountOut)
-        if self.blkCountOut in self.outOfOrderData:
-            # If the data is cached, use it from memory and remove from the cache
-            rawblock = self.outOfOrderData.pop(self.blkCountOut)
-            self.outOfOrderSize -= len(rawblock)
-        else: # Otherwise look up data on disk
-            rawblock = self.fetchBlock(extent)
-
-        self.writeBlock(extent.inhdr, extent.blkhdr, rawblock)
+            print('%i blocks written (of %i, %.1f%% complete)' %
+                    (self.blkCountOut, len(self.blkindex), 100.0 * self.blkCountOut / len(self.blkindex)))
 
     def run(self):
-        while self.blkCountOut < len(self.blkindex):
-            if not self.inF:
-                fname = self.inFileName(self.inFn)
-                print("Input file " + fname)
-                try:
-                    self.inF = open(fname, "rb")
-                except IOError:
+        self.scan()
+        try:
+            while self.blkCountOut < len(self.blkindex):
+                if self.blkCountOut not in self.blockExtents:
                     print("Premature end of block data")
-                    return
-
-            inhdr = self.inF.read(8)
-            if (not inhdr or (inhdr[0] == "\0")):
-                self.inF.close()
-                self.inF = None
-                self.inFn = self.inFn + 1
-                continue
-
-            inMagic = inhdr[:4]
-            if (inMagic != self.settings['netmagic']):
-                print("Invalid magic: " + hexlify(inMagic).decode('utf-8'))
-                return
-            inLenLE = inhdr[4:]
-            su = struct.unpack("<I", inLenLE)
-            inLen = su[0] - 80 # length without header
-            blk_hdr = self.inF.read(80)
-            inExtent = BlockExtent(self.inFn, self.inF.tell(), inhdr, blk_hdr, inLen)
-
-            self.hash_str = calc_hash_str(blk_hdr)
-            if not self.hash_str in blkmap:
-                # Because blocks can be written to files out-of-order as of 0.10, the script
-                # may encounter blocks it doesn't know about. Treat as debug output.
-                if settings['debug_output'] == 'true':
-                    print("Skipping unknown block " + self.hash_str)
-                self.inF.seek(inLen, os.SEEK_CUR)
-                continue
-
-            blkHeight = self.blkmap[self.hash_str]
-            self.blkCountIn += 1
-
-            if self.blkCountOut == blkHeight:
-                # If in-order block, just copy
-                rawblock = self.inF.read(inLen)
-                self.writeBlock(inhdr, blk_hdr, rawblock)
-
-                # See if we can catch up to prior out-of-order blocks
-                while self.blkCountOut in self.blockExtents:
-                    self.copyOneBlock()
-
-            else: # If out-of-order, skip over block data for now
-                self.blockExtents[blkHeight] = inExtent
-                if self.outOfOrderSize < self.settings['out_of_order_cache_sz']:
-                    # If there is space in the cache, read the data
-                    # Reading the data in file sequence instead of seeking and fetching it later is preferred,
-                    # but we don't want to fill up memory
-                    self.outOfOrderData[blkHeight] = self.inF.read(inLen)
-                    self.outOfOrderSize += inLen
-                else: # If no space in cache, seek forward
-                    self.inF.seek(inLen, os.SEEK_CUR)
+                    break
+                self.writeBlock(self.blockExtents[self.blkCountOut])
+            if self.outF:
+                self.flush()
+                self.outF.close()
+                if self.setFileTime:
+                    os.utime(self.outFname, (int(time.time()), self.highTS))
+        finally:
+            for buf in self.inputs.values():
+                buf.close()
+            self.inputs.clear()
 
         print("Done (%i blocks written)" % (self.blkCountOut))
 
@@ -295,8 +406,12 @@ if __name__ == '__main__':
         settings['split_timestamp'] = 0
     if 'max_out_sz' not in settings:
         settings['max_out_sz'] = 1000 * 1000 * 1000
-    if 'out_of_order_cache_sz' not in settings:
-        settings['out_of_order_cache_sz'] = 100 * 1000 * 1000
+    if 'con_blockheightinheader' not in settings:
+        settings['con_blockheightinheader'] = 'false'
+    if 'con_signed_blocks' not in settings:
+        settings['con_signed_blocks'] = 'false'
+    if 'scan_processes' not in settings:
+        settings['scan_processes'] = cpu_count()
     if 'debug_output' not in settings:
         settings['debug_output'] = 'false'
 
@@ -304,7 +419,9 @@ if __name__ == '__main__':
     settings['split_timestamp'] = int(settings['split_timestamp'])
     settings['file_timestamp'] = int(settings['file_timestamp'])
     settings['netmagic'] = unhexlify(settings['netmagic'].encode('utf-8'))
-    settings['out_of_order_cache_sz'] = int(settings['out_of_order_cache_sz'])
+    settings['con_blockheightinheader'] = settings['con_blockheightinheader'].lower() in ('1', 'true')
+    settings['con_signed_blocks'] = settings['con_signed_blocks'].lower() in ('1', 'true')
+    settings['scan_processes'] = max(int(settings['scan_processes']), 1)
     settings['debug_output'] = settings['debug_output'].lower()
 
     if 'output_file' not in settings and 'output' not in settings:
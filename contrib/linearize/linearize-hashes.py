@@ -13,11 +13,14 @@ try: # Python 3
 except ImportError: # Python 2
     import httplib
 import json
+import threading
 import re
 import base64
 import sys
 import os
 import os.path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 settings = {}
 
@@ -68,31 +71,50 @@ class BitcoinRPC:
         return 'error' in resp_obj and resp_obj['error'] is not None
 
 def get_block_hashes(settings, max_blocks_per_call=10000):
-    rpc = BitcoinRPC(settings['host'], settings['port'],
-             settings['rpcuser'], settings['rpcpassword'])
-
-    height = settings['min_height']
-    while height < settings['max_height']+1:
-        num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
+    connections = settings['rpc_connections']
+    local = threading.local()
+
+    def fetch_batch(height, num_blocks):
+        # One keep-alive connection per worker thread
+        if not hasattr(local, 'rpc'):
+            local.rpc = BitcoinRPC(settings['host'], settings['port'],
+                     settings['rpcuser'], settings['rpcpassword'])
         batch = []
         for x in range(num_blocks):
-            batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
-
-        reply = rpc.execute(batch)
-        if reply is None:
-            print('Cannot continue. Program will halt.')
-            return None
-
-        for x,resp_obj in enumerate(reply):
-            if rpc.response_is_error(resp_obj):
-                print('JSON-RPC: error at height', height+x, ': ', resp_obj['error'], file=sys.stderr)
-                sys.exit(1)
-            assert(resp_obj['id'] == x) # assume replies are in-sequence
-            if settings['rev_hash_bytes'] == 'true':
-                resp_obj['result'] = hex_switchEndian(resp_obj['result'])
-            print(resp_obj['result'])
-
-        height += num_blocks
+            batch.append(BitcoinRPC.build_request(x, 'getblockhash', [height + x]))
+        return local.rpc.execute(batch)
+
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        # Keep a couple of batches queued per connection, so that the node
+        # never waits on a round trip, and write them out in height order.
+        pending = deque()
+        height = settings['min_height']
+        while height < settings['max_height']+1 or pending:
+            while height < settings['max_height']+1 and len(pending) < 2 * connections:
+                num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
+                pending.append((height, executor.submit(fetch_batch, height, num_blocks)))
+                height += num_blocks
+
+            batch_height, future = pending.popleft()
+            reply = future.result()
+            if reply is None:
+                print('Cannot continue. Program will halt.')
+                for _, f in pending:
+                    f.cancel()
+                return None
+
+            hashes = []
+            for x,resp_obj in enumerate(reply):
+                if BitcoinRPC.response_is_error(resp_obj):
+                    print('JSON-RPC: error at height', batch_height+x, ': ', resp_obj['error'], file=sys.stderr)
+                    for _, f in pending:
+                        f.cancel()
+                    sys.exit(1)
+                assert(resp_obj['id'] == x) # assume replies are in-sequence
+                if settings['rev_hash_bytes'] == 'true':
+                    resp_obj['result'] = hex_switchEndian(resp_obj['result'])
+                hashes.append(resp_obj['result'] + '\n')
+            sys.stdout.write(''.join(hashes))
 
 def get_rpc_cookie():
     # Open the cookie file
@@ -131,6 +153,10 @@ if __name__ == '__main__':
         settings['max_height'] = 313000
     if 'rev_hash_bytes' not in settings:
         settings['rev_hash_bytes'] = 'false'
+    if 'rpc_connections' not in settings:
+        settings['rpc_connections'] = 4
+    if 'max_blocks_per_call' not in settings:
+        settings['max_blocks_per_call'] = 10000
 
     use_userpass = True
     use_datadir = False
@@ -145,6 +171,8 @@ if __name__ == '__main__':
     settings['port'] = int(settings['port'])
     settings['min_height'] = int(settings['min_height'])
     settings['max_height'] = int(settings['max_height'])
+    settings['rpc_connections'] = max(int(settings['rpc_connections']), 1)
+    settings['max_blocks_per_call'] = max(int(settings['max_blocks_per_call']), 1)
 
     # Force hash byte format setting to be lowercase to make comparisons easier.
     settings['rev_hash_bytes'] = settings['rev_hash_bytes'].lower()
@@ -153,4 +181,4 @@ if __name__ == '__main__':
     if use_datadir:
         get_rpc_cookie()
 
-    get_block_hashes(settings)
+    get_block_hashes(settings, settings['max_blocks_per_call'])
@@ -6,15 +6,37 @@
 # Generate seeds.txt from Pieter's DNS seeder
 #
 
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import ipaddress
+import itertools
+import json
+import os
 import re
 import sys
-import dns.resolver
-import collections
+import time
+
+try:
+    import dns.resolver
+    HAVE_DNSPYTHON = True
+except ImportError:
+    HAVE_DNSPYTHON = False
 
 NSEEDS=512
 
 MAX_SEEDS_PER_ASN=2
 
+# Concurrent DNS queries to Team Cymru
+DNS_THREADS=32
+
+# Addresses resolved at once
+DNS_CHUNK_SIZE=4 * DNS_THREADS
+
+# Seconds for which ASNs resolved through DNS are kept in the cache
+CACHE_TTL=7 * 24 * 60 * 60
+
 MIN_BLOCKS = 337600
 
 # These are hosts that have been observed to be behaving strangely (e.g.
@@ -106,38 +128,141 @@ def filtermultiport(ips):
         hist[ip['sortkey']].append(ip)
     return [value[0] for (key,value) in list(hist.items()) if len(value)==1]
 
+def load_asmap(path):
+    '''Load an offline prefix to ASN table.
+
+    Each line is either "<prefix> <asn>", with the prefix in CIDR notation
+    (as dumped from an MRT RIB with pyasn_util_convert.py or bgpdump), or
+    "<first ip> <last ip> <asn> ..." (the ip2asn TSV format). Addresses
+    announced by AS 0 are not routed. Returns, for IPv4 and IPv6, a dict
+    of prefix length to a dict of network address to ASN.'''
+    asmap = {4: collections.defaultdict(dict), 6: collections.defaultdict(dict)}
+    with open(path, encoding='utf8') as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if '/' in fields[0]:
+                networks = [ipaddress.ip_network(fields[0], strict=False)]
+                asn = int(fields[1].upper().lstrip('AS'))
+            else:
+                first, last = ipaddress.ip_address(fields[0]), ipaddress.ip_address(fields[1])
+                networks = ipaddress.summarize_address_range(first, last)
+                asn = int(fields[2].upper().lstrip('AS'))
+            if asn == 0:
+                continue
+            for network in networks:
+                asmap[network.version][network.prefixlen][int(network.network_address)] = asn
+    return asmap
+
+def lookup_asmap(asmap, ipstr):
+    '''ASN of the longest prefix of asmap containing ipstr, or None.'''
+    try:
+        ip = ipaddress.ip_address(ipstr)
+    except ValueError:
+        return None
+    ipnum = int(ip)
+    for prefixlen, networks in sorted(asmap[ip.version].items(), reverse=True):
+        asn = networks.get(ipnum >> (ip.max_prefixlen - prefixlen) << (ip.max_prefixlen - prefixlen))
+        if asn is not None:
+            return asn
+    return None
+
+def lookup_dns(ipstr):
+    '''ASN of ipstr from Team Cymru's IP to ASN mapping service.'''
+    ip = ipaddress.ip_address(ipstr)
+    # d.c.b.a.in-addr.arpa, or the reversed nibbles of an IPv6 address
+    name = ip.reverse_pointer.rsplit('.', 2)[0]
+    zone = 'origin.asn.cymru.com' if ip.version == 4 else 'origin6.asn.cymru.com'
+    return int([x.to_text() for x in dns.resolver.query(name + '.' + zone, 'TXT').response.answer][0].split('\"')[1].split(' ')[0])
+
+def load_cache(path, ttl):
+    '''Unexpired entries of the ASN cache at path, as a dict of IP to
+    (ASN, time of resolution).'''
+    try:
+        with open(path, encoding='utf8') as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    now = time.time()
+    return {ip: (asn, resolved) for ip, (asn, resolved) in cache.items() if now - resolved < ttl}
+
+def save_cache(path, cache):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf8') as f:
+        json.dump(cache, f, sort_keys=True)
+    os.replace(tmp, path)
+
+def try_lookup_dns(ipstr):
+    try:
+        return lookup_dns(ipstr)
+    except Exception:
+        return None
+
+def resolve_asns(ipstrs, asmap=None, cache=None, executor=None):
+    '''Map each of ipstrs to its ASN, or to None if it could not be
+    resolved. With an asmap, no network access is made. Otherwise, the
+    addresses missing from cache are resolved concurrently through DNS, on
+    executor, and added to it.'''
+    if asmap is not None:
+        return {ipstr: lookup_asmap(asmap, ipstr) for ipstr in ipstrs}
+    if cache is None:
+        cache = {}
+    missing = sorted(set(ipstrs) - set(cache))
+    if executor is None:
+        with ThreadPoolExecutor(DNS_THREADS) as executor:
+            return resolve_asns(ipstrs, asmap, cache, executor)
+    now = time.time()
+    for ipstr, asn in zip(missing, executor.map(try_lookup_dns, missing)):
+        if asn is not None:
+            cache[ipstr] = (asn, now)
+    return {ipstr: cache[ipstr][0] if ipstr in cache else None for ipstr in ipstrs}
+
 # Based on Greg Maxwell's seed_filter.py
-def filterbyasn(ips, max_per_asn, max_total):
-    # Sift out ips by type
-    ips_ipv4 = [ip for ip in ips if ip['net'] == 'ipv4']
-    ips_ipv6 = [ip for ip in ips if ip['net'] == 'ipv6']
-    ips_onion = [ip for ip in ips if ip['net'] == 'onion']
+def filterbyasn(ips, max_per_asn, max_total, resolve, chunk_size=DNS_CHUNK_SIZE):
+    '''Limit IPv4 and IPv6 hosts per ASN (which is shared between the two
+    networks), and keep at most max_total IPv4 hosts. Onion hosts are all
+    kept.
+
+    resolve maps a list of IPs to their ASNs (see resolve_asns). IPs are
+    resolved as they are needed, chunk_size at a time, so that no more
+    than a chunk of IPv4 hosts is looked up once max_total is reached.'''
+    def wanted(ip):
+        return ip['net'] != 'ipv4' or ipv4_count < max_total
 
-    # Filter IPv4 by ASN
     result = []
-    asn_count = {}
-    for ip in ips_ipv4:
-        if len(result) == max_total:
-            break
-        try:
-            asn = int([x.to_text() for x in dns.resolver.query('.'.join(reversed(ip['ip'].split('.'))) + '.origin.asn.cymru.com', 'TXT').response.answer][0].split('\"')[1].split(' ')[0])
-            if asn not in asn_count:
-                asn_count[asn] = 0
+    ipv4_count = 0
+    asn_count = collections.defaultdict(int)
+    asns = {}
+    for i, ip in enumerate(ips):
+        if not wanted(ip):
+            continue
+        # Onion hosts have no ASN
+        if ip['net'] != 'onion':
+            if ip['ip'] not in asns:
+                # Resolve this IP along with the next ones that may be kept
+                upcoming = (x['ip'] for x in ips[i:] if x['net'] != 'onion' and wanted(x) and x['ip'] not in asns)
+                asns.update(resolve(list(itertools.islice(upcoming, chunk_size))))
+            asn = asns[ip['ip']]
+            if asn is None:
+                sys.stderr.write('ERR: Could not resolve ASN for "' + ip['ip'] + '"\n')
+                continue
             if asn_count[asn] == max_per_asn:
                 continue
             asn_count[asn] += 1
-            result.append(ip)
-        except:
-            sys.stderr.write('ERR: Could not resolve ASN for "' + ip['ip'] + '"\n')
-
-    # TODO: filter IPv6 by ASN
-
-    # Add back non-IPv4
-    result.extend(ips_ipv6)
-    result.extend(ips_onion)
+        if ip['net'] == 'ipv4':
+            ipv4_count += 1
+        result.append(ip)
     return result
 
 def main():
+    parser = argparse.ArgumentParser(description='Generate a list of seeds from the seeder dump on stdin.')
+    parser.add_argument('-a', '--asmap', help='offline prefix to ASN table, used instead of DNS lookups')
+    parser.add_argument('-c', '--cache', help='file caching the ASNs resolved through DNS')
+    parser.add_argument('--cache-ttl', type=int, default=CACHE_TTL, help='seconds for which cached ASNs are valid (default: %(default)s)')
+    parser.add_argument('-j', '--threads', type=int, default=DNS_THREADS, help='concurrent DNS lookups (default: %(default)s)')
+    args = parser.parse_args()
+
     lines = sys.stdin.readlines()
     ips = [parseline(line) for line in lines]
 
@@ -157,8 +282,16 @@ def main():
     ips.sort(key=lambda x: (x['uptime'], x['lastsuccess'], x['ip']), reverse=True)
     # Filter out hosts with multiple bitcoin ports, these are likely abusive
     ips = filtermultiport(ips)
-    # Look up ASNs and limit results, both per ASN and globally.
-    ips = filterbyasn(ips, MAX_SEEDS_PER_ASN, NSEEDS)
+    # Look up ASNs and limit results, both per ASN and in total.
+    asmap = load_asmap(args.asmap) if args.asmap else None
+    if asmap is None and not HAVE_DNSPYTHON:
+        sys.exit('dnspython is needed to look up ASNs, unless an offline table is given with -a')
+    cache = load_cache(args.cache, args.cache_ttl) if args.cache and asmap is None else None
+    with ThreadPoolExecutor(args.threads) as executor:
+        resolve = functools.partial(resolve_asns, asmap=asmap, cache=cache, executor=executor)
+        ips = filterbyasn(ips, MAX_SEEDS_PER_ASN, NSEEDS, resolve, 4 * args.threads)
+    if cache is not None:
+        save_cache(args.cache, cache)
     # Sort the results by IP address (for deterministic output).
     ips.sort(key=lambda x: (x['net'], x['sortkey']))
 
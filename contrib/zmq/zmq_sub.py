@@ -6,17 +6,21 @@
 """
     ZMQ example using python3's asyncio
 
-    Bitcoin should be started with the command line arguments:
-        bitcoind -testnet -daemon \
+    Elements should be started with the command line arguments:
+        elementsd -daemon \
                 -zmqpubrawtx=tcp://127.0.0.1:28332 \
                 -zmqpubrawblock=tcp://127.0.0.1:28332 \
                 -zmqpubhashtx=tcp://127.0.0.1:28332 \
                 -zmqpubhashblock=tcp://127.0.0.1:28332
 
-    We use the asyncio library here.  `self.handle()` installs itself as a
-    future at the end of the function.  Since it never returns with the event
-    loop having an empty stack of futures, this creates an infinite loop.  An
-    alternative is to wrap the contents of `handle` inside `while True`.
+    The notifications are received in a single loop. The sequence number of
+    each topic is checked for gaps, which is how messages dropped by the
+    publisher (once the subscriber fell behind) show up. Statistics are
+    printed every STATS_INTERVAL notifications and on exit.
+
+    Elements block headers are variable-length, so raw blocks are only
+    printed with their size. The test framework has a subscriber that also
+    decodes them (test/functional/test_framework/zmq_subscriber.py).
 
     A blocking example using python 2.7 can be obtained from the git history:
     https://github.com/bitcoin/bitcoin/blob/37a7fe9e440b83e2364d5498931253937abe9294/contrib/zmq/zmq_sub.py
@@ -24,11 +28,13 @@
 
 import binascii
 import asyncio
+from collections import Counter
 import zmq
 import zmq.asyncio
 import signal
 import struct
 import sys
+import time
 
 if (sys.version_info.major, sys.version_info.minor) < (3, 5):
     print("This example only works with Python 3.5 and greater")
@@ -36,6 +42,8 @@ if (sys.version_info.major, sys.version_info.minor) < (3, 5):
 
 port = 28332
 
+STATS_INTERVAL = 1000
+
 class ZMQHandler():
     def __init__(self):
         self.loop = asyncio.get_event_loop()
@@ -49,37 +57,62 @@ class ZMQHandler():
         self.zmqSubSocket.setsockopt_string(zmq.SUBSCRIBE, "rawtx")
         self.zmqSubSocket.connect("tcp://127.0.0.1:%i" % port)
 
-    async def handle(self) :
-        msg = await self.zmqSubSocket.recv_multipart()
-        topic = msg[0]
-        body = msg[1]
-        sequence = "Unknown"
-        if len(msg[-1]) == 4:
-          msgSequence = struct.unpack('<I', msg[-1])[-1]
-          sequence = str(msgSequence)
-        if topic == b"hashblock":
-            print('- HASH BLOCK ('+sequence+') -')
-            print(binascii.hexlify(body))
-        elif topic == b"hashtx":
-            print('- HASH TX  ('+sequence+') -')
-            print(binascii.hexlify(body))
-        elif topic == b"rawblock":
-            print('- RAW BLOCK HEADER ('+sequence+') -')
-            print(binascii.hexlify(body[:80]))
-        elif topic == b"rawtx":
-            print('- RAW TX ('+sequence+') -')
-            print(binascii.hexlify(body))
-        # schedule ourselves to receive the next message
-        asyncio.ensure_future(self.handle())
+        self.started = time.time()
+        self.messages = Counter()
+        self.bytes = Counter()
+        self.lost = Counter()
+        self.nextSequence = {}
+
+    async def handle(self):
+        while True:
+            topic, body, seq = await self.zmqSubSocket.recv_multipart()
+            sequence = struct.unpack('<I', seq)[-1]
+            self.count(topic, body, sequence)
+            sequence = str(sequence)
+            if topic == b"hashblock":
+                print('- HASH BLOCK ('+sequence+') -')
+                print(binascii.hexlify(body))
+            elif topic == b"hashtx":
+                print('- HASH TX  ('+sequence+') -')
+                print(binascii.hexlify(body))
+            elif topic == b"rawblock":
+                print('- RAW BLOCK ('+sequence+') -')
+                print('%d bytes' % len(body))
+            elif topic == b"rawtx":
+                print('- RAW TX ('+sequence+') -')
+                print(binascii.hexlify(body))
+            if sum(self.messages.values()) % STATS_INTERVAL == 0:
+                self.printStats()
+
+    def count(self, topic, body, sequence):
+        self.messages[topic] += 1
+        self.bytes[topic] += len(body)
+        if topic in self.nextSequence:
+            lost = (sequence - self.nextSequence[topic]) % (1 << 32)
+            if lost:
+                print('- LOST %d %s -' % (lost, topic.decode()))
+                self.lost[topic] += lost
+        self.nextSequence[topic] = (sequence + 1) % (1 << 32)
+
+    def printStats(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        for topic in sorted(self.messages):
+            print('%s: %d messages (%.1f/s), %d bytes, %d lost' % (
+                topic.decode(), self.messages[topic], self.messages[topic] / elapsed, self.bytes[topic], self.lost[topic]))
 
     def start(self):
-        self.loop.add_signal_handler(signal.SIGINT, self.stop)
-        self.loop.create_task(self.handle())
-        self.loop.run_forever()
+        task = self.loop.create_task(self.handle())
+        self.loop.add_signal_handler(signal.SIGINT, task.cancel)
+        try:
+            self.loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.stop()
 
     def stop(self):
-        self.loop.stop()
         self.zmqContext.destroy()
+        self.printStats()
 
 daemon = ZMQHandler()
 daemon.start()
@@ -17,6 +17,7 @@ from test_framework.messages import (
     CTxIn,
     CTxOut,
     MAX_BLOCK_BASE_SIZE,
+    set_serialization_cache,
     uint256_from_str,
 )
 from test_framework.mininode import P2PDataStore
@@ -417,6 +418,10 @@ class FullBlockTest(BitcoinTestFramework):
         #           p2sh_script = OP_HASH160, ripemd160(sha256(script)), OP_EQUAL
         #
         self.log.info("Check P2SH SIGOPS are correctly counted")
+        # b39 to b41 serialize thousands of transactions several times each
+        # (block size accounting, sending, and reuse in b41): cache the
+        # serializations until b41 is accepted.
+        set_serialization_cache(True)
         self.move_tip(35)
         b39 = self.next_block(39)
         b39_outputs = 0
@@ -513,6 +518,7 @@ class FullBlockTest(BitcoinTestFramework):
         tx.rehash()
         self.update_block(41, [tx])
         self.sync_blocks([b41], True)
+        set_serialization_cache(False)
 
         # Fork off of b39 to create a constant base again
         #
@@ -1248,6 +1254,8 @@ class FullBlockTest(BitcoinTestFramework):
         fee = prev_tx.vout[prev_n].nValue.getAmount() - total_out
         if fee > 0:
             tx.vout.append(CTxOut(fee))
+        # tx.vout was changed in place
+        tx.invalidate_cache()
         tx.calc_sha256()
 
     # sign a transaction, using the key we know about
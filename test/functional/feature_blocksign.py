@@ -4,6 +4,7 @@ import codecs
 import hashlib
 import random
 
+from test_framework.federation import Federation, PHASES
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import (assert_raises_rpc_error, assert_equal, connect_nodes_bi)
 from test_framework import (
@@ -161,7 +162,16 @@ class BlockSignTest(BitcoinTestFramework):
 
         # mine a block with no transactions
         print("Mining and signing 101 blocks to unlock funds")
-        self.mine_blocks(101, False)
+        self.mine_blocks(1, False)
+        # the remaining ones with concurrent signing rounds
+        federation = Federation(self.nodes[:self.num_keys])
+        federation.mine_blocks(100)
+        self.sync_all()
+        self.check_height(101)
+        assert_equal([r.height for r in federation.rounds], list(range(2, 102)))
+        latencies = federation.latencies()
+        for phase in PHASES:
+            print("{}: mean {:.3f}s, max {:.3f}s".format(phase, *latencies[phase]))
 
         # mine blocks with transactions
         print("Mining and signing non-empty blocks")
@@ -16,7 +16,9 @@ from test_framework.messages import (
     CTxOutValue,
     CTxInWitness,
     CTxOutWitness,
+    FromHex,
 )
+from test_framework.secp256k1 import secp256k1
 from test_framework.util import (
     connect_nodes_bi,
     assert_equal,
@@ -99,6 +101,27 @@ class CTTest (BitcoinTestFramework):
         assert_equal(rec.getaddressinfo(blind_info["unconfidential"])["confidential"], blind_addr)
         self.nodes[0].unloadwallet("recover")
 
+    def verify_blinded_outputs(self, node, tx_hex):
+        """Check the range and surjection proofs of a blinded transaction
+        with libsecp256k1, independently of the node."""
+        if not (secp256k1 and secp256k1.has_zkp):
+            self.log.info("Skipping the local proof checks: no libsecp256k1 with the rangeproof/surjectionproof modules")
+            return
+        tx = FromHex(CTransaction(), tx_hex)
+        input_assets = []
+        for txin in tx.vin:
+            prev_tx = FromHex(CTransaction(), node.gettransaction("%064x" % txin.prevout.hash)["hex"])
+            input_assets.append(prev_tx.vout[txin.prevout.n].nAsset.vchCommitment)
+        blinded = 0
+        for txout, txoutwit in zip(tx.vout, tx.wit.vtxoutwit):
+            if txout.nValue.vchCommitment[0] in (8, 9):
+                assert secp256k1.verify_rangeproof(txoutwit.vchRangeproof, txout.nValue.vchCommitment,
+                                                   txout.nAsset.vchCommitment, txout.scriptPubKey) is not None
+                blinded += 1
+            if txout.nAsset.vchCommitment[0] in (10, 11):
+                assert secp256k1.verify_surjectionproof(txoutwit.vchSurjectionproof, input_assets, txout.nAsset.vchCommitment)
+        assert blinded > 0
+
     def run_test(self):
 
         print("Testing wallet secret recovery")
@@ -167,6 +190,7 @@ class CTTest (BitcoinTestFramework):
                                                 change_address: unspent[0]["amount"] - value2 - value3 - fee, "fee":fee})
         tx = self.nodes[0].blindrawtransaction(tx)
         tx_signed = self.nodes[0].signrawtransactionwithwallet(tx)
+        self.verify_blinded_outputs(self.nodes[0], tx_signed['hex'])
         raw_tx_id = self.nodes[0].sendrawtransaction(tx_signed['hex'])
         self.nodes[0].generate(101)
         self.sync_all()
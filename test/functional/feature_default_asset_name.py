@@ -17,11 +17,12 @@ class NamedDefaultAssetTest(BitcoinTestFramework):
     """
 
     def set_test_params(self):
-        self.setup_clean_chain = True
         self.num_nodes = 2
 
-        #Set default asset name
-        self.extra_args = [["-defaultpeggedassetname=testasset", "-initialfreecoins=2100000000000000", "-anyonecanspendaremine=1", "-con_connect_coinbase=1", "-con_blocksubsidy=0"]]*2
+        #Set default asset name. The chain parameters go in chain_config so
+        #that the nodes start from a cached chain built with them.
+        self.chain_config = ["defaultpeggedassetname=testasset", "initialfreecoins=2100000000000000", "con_connect_coinbase=1", "con_blocksubsidy=0"]
+        self.extra_args = [["-anyonecanspendaremine=1"]]*2
 
     def setup_network(self, split=False):
         self.setup_nodes()
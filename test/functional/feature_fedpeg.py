@@ -24,6 +24,7 @@ from test_framework.messages import (
 from test_framework.blocktools import (
     add_witness_commitment,
 )
+from test_framework.pegin import PeginWorkload
 from decimal import Decimal
 
 def get_new_unconfidential_address(node, addr_type="p2sh-segwit"):
@@ -369,6 +370,20 @@ class FedPegTest(BitcoinTestFramework):
             if "confirmations" not in tx or tx["confirmations"] == 0:
                 raise Exception("Peg-in confirmation has failed.")
 
+        print("Flooding mempool with bulk claims")
+        workload = PeginWorkload(parent, sidechain)
+        deposits = workload.deposit(200, Decimal("0.01"))
+        self.sync_all(self.node_groups)
+        result = workload.claim(deposits)
+        assert_equal(dict(result.rejections), {})
+        assert_equal(result.acceptance_rate, 1)
+        self.log.info("Claim validation latency: median {:.3f}s, 90th percentile {:.3f}s".format(
+            result.latency_percentile(50), result.latency_percentile(90)))
+        assert set(result.txids).issubset(sidechain.getrawmempool())
+        sidechain.generate(1)
+        assert_equal(sidechain.getrawmempool(), [])
+        self.sync_all(self.node_groups)
+
         print("Test pegouts")
         self.test_pegout(get_new_unconfidential_address(parent, "legacy"), sidechain)
         self.test_pegout(get_new_unconfidential_address(parent, "p2sh-segwit"), sidechain)
@@ -9,8 +9,9 @@ This test uses 4GB of disk space.
 This test takes 30 mins or more (up to 2 hours)
 """
 
+from test_framework.blocktools import LargeBlockBuilder
 from test_framework.test_framework import BitcoinTestFramework
-from test_framework.util import assert_equal, assert_greater_than, assert_raises_rpc_error, connect_nodes, mine_large_block, sync_blocks, wait_until
+from test_framework.util import assert_equal, assert_greater_than, assert_raises_rpc_error, connect_nodes, sync_blocks, wait_until
 
 import os
 
@@ -68,12 +69,14 @@ class PruneTest(BitcoinTestFramework):
 
     def create_big_chain(self):
         # Start by creating some coinbases we can spend later
-        self.nodes[1].generate(200)
+        self.block_builder_1.fund()
+        self.nodes[1].generate(199)
         sync_blocks(self.nodes[0:2])
-        self.nodes[0].generate(150)
+        self.block_builder_0.fund()
+        self.nodes[0].generate(149)
         # Then mine enough full blocks to create more than 550MiB of data
         for i in range(645):
-            mine_large_block(self.nodes[0], self.utxo_cache_0)
+            self.block_builder_0.mine_block()
 
         sync_blocks(self.nodes[0:5])
 
@@ -85,7 +88,7 @@ class PruneTest(BitcoinTestFramework):
         self.log.info("Mining 25 more blocks should cause the first block file to be pruned")
         # Pruning doesn't run until we're allocating another chunk, 20 full blocks past the height cutoff will ensure this
         for i in range(25):
-            mine_large_block(self.nodes[0], self.utxo_cache_0)
+            self.block_builder_0.mine_block()
 
         # Wait for blk00000.dat to be pruned
         wait_until(lambda: not os.path.isfile(os.path.join(self.prunedir, "blk00000.dat")), timeout=30)
@@ -107,18 +110,13 @@ class PruneTest(BitcoinTestFramework):
             self.stop_node(0)
             self.start_node(0, extra_args=self.full_node_default_args)
             # Mine 24 blocks in node 1
+            # The builder carries on from its outputs left on the main chain
             for i in range(24):
-                if j == 0:
-                    mine_large_block(self.nodes[1], self.utxo_cache_1)
-                else:
-                    # Add node1's wallet transactions back to the mempool, to
-                    # avoid the mined blocks from being too small.
-                    self.nodes[1].resendwallettransactions()
-                    self.nodes[1].generate(1) #tx's already in mempool from previous disconnects
+                self.block_builder_1.mine_block()
 
             # Reorg back with 25 block chain from node 0
             for i in range(25):
-                mine_large_block(self.nodes[0], self.utxo_cache_0)
+                self.block_builder_0.mine_block()
 
             # Create connections in the order so both nodes can see the reorg at the same time
             connect_nodes(self.nodes[1], 0)
@@ -171,14 +169,8 @@ class PruneTest(BitcoinTestFramework):
 
         self.log.info("Mine 220 more blocks so we have requisite history (some blocks will be big and cause pruning of previous chain)")
 
-        # Get node0's wallet transactions back in its mempool, to avoid the
-        # mined blocks from being too small.
-        self.nodes[0].resendwallettransactions()
-
-        for i in range(22):
-            # This can be slow, so do this in multiple RPC calls to avoid
-            # RPC timeouts.
-            self.nodes[0].generate(10) #node 0 has many large tx's in its mempool from the disconnects
+        for i in range(220):
+            self.block_builder_0.mine_block()
         sync_blocks(self.nodes[0:3], timeout=300)
 
         usage = calc_usage(self.prunedir)
@@ -348,9 +340,9 @@ class PruneTest(BitcoinTestFramework):
         # Determine default relay fee
         self.relayfee = self.nodes[0].getnetworkinfo()["relayfee"]
 
-        # Cache for utxos, as the listunspent may take a long time later in the test
-        self.utxo_cache_0 = []
-        self.utxo_cache_1 = []
+        # Mine the large blocks of nodes 0 and 1 without their wallets
+        self.block_builder_0 = LargeBlockBuilder(self.nodes[0])
+        self.block_builder_1 = LargeBlockBuilder(self.nodes[1])
 
         self.create_big_chain()
         # Chain diagram key:
@@ -3,37 +3,34 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Test the ZMQ notification interface."""
-import struct
+import asyncio
 
 from test_framework.address import ADDRESS_BCRT1_UNSPENDABLE
 from test_framework.test_framework import BitcoinTestFramework
-from test_framework.messages import CTransaction
-from test_framework.util import (
-    assert_equal,
-    bytes_to_hex_str,
-    hash256,
-)
-from io import BytesIO
+from test_framework.util import assert_equal
+from test_framework.zmq_subscriber import Notification, SubscriberStats, ZMQSubscriber as AsyncZMQSubscriber
 
 ADDRESS = "tcp://127.0.0.1:28332"
 
 class ZMQSubscriber:
-    def __init__(self, socket, topic):
+    def __init__(self, socket, topic, stats):
         self.sequence = 0
         self.socket = socket
         self.topic = topic
+        self.stats = stats
 
         import zmq
         self.socket.setsockopt(zmq.SUBSCRIBE, self.topic)
 
     def receive(self):
-        topic, body, seq = self.socket.recv_multipart()
+        notification = Notification.from_frames(self.socket.recv_multipart())
         # Topic should match the subscriber topic.
-        assert_equal(topic, self.topic)
+        assert_equal(notification.topic, self.topic)
         # Sequence should be incremental.
-        assert_equal(struct.unpack('<I', seq)[-1], self.sequence)
+        assert_equal(notification.sequence, self.sequence)
+        assert_equal(self.stats.add(notification), 0)
         self.sequence += 1
-        return body
+        return notification
 
 
 class ZMQTest (BitcoinTestFramework):
@@ -58,10 +55,11 @@ class ZMQTest (BitcoinTestFramework):
         socket.connect(ADDRESS)
 
         # Subscribe to all available topics.
-        self.hashblock = ZMQSubscriber(socket, b"hashblock")
-        self.hashtx = ZMQSubscriber(socket, b"hashtx")
-        self.rawblock = ZMQSubscriber(socket, b"rawblock")
-        self.rawtx = ZMQSubscriber(socket, b"rawtx")
+        self.stats = SubscriberStats()
+        self.hashblock = ZMQSubscriber(socket, b"hashblock", self.stats)
+        self.hashtx = ZMQSubscriber(socket, b"hashtx", self.stats)
+        self.rawblock = ZMQSubscriber(socket, b"rawblock", self.stats)
+        self.rawtx = ZMQSubscriber(socket, b"rawtx", self.stats)
 
         self.extra_args = [
             ["-zmqpub%s=%s" % (sub.topic.decode(), ADDRESS) for sub in [self.hashblock, self.hashtx, self.rawblock, self.rawtx]],
@@ -87,25 +85,22 @@ class ZMQTest (BitcoinTestFramework):
 
         for x in range(num_blocks):
             # Should receive the coinbase txid.
-            txid = self.hashtx.receive()
+            txid = self.hashtx.receive().decode()
 
             # Should receive the coinbase raw transaction.
-            hex = self.rawtx.receive()
-            tx = CTransaction()
-            tx.deserialize(BytesIO(hex))
-            tx.calc_sha256()
-            assert_equal(tx.hash, bytes_to_hex_str(txid))
+            tx = self.rawtx.receive().decode()
+            assert_equal(tx.hash, txid)
 
             # Should receive the generated block hash.
-            hash = bytes_to_hex_str(self.hashblock.receive())
+            hash = self.hashblock.receive().decode()
             assert_equal(genhashes[x], hash)
             # The block should only have the coinbase txid.
-            assert_equal([bytes_to_hex_str(txid)], self.nodes[1].getblock(hash)["tx"])
+            assert_equal([txid], self.nodes[1].getblock(hash)["tx"])
 
             # Should receive the generated raw block.
-            block = self.rawblock.receive()
-            # 79 bytes, last byte is saying block solution is "", ellide this for hash
-            assert_equal(genhashes[x], bytes_to_hex_str(hash256(block[:78])))
+            block = self.rawblock.receive().decode()
+            assert_equal(genhashes[x], block.hash)
+            assert_equal([txid], [tx.hash for tx in block.vtx])
 
         if self.is_wallet_compiled():
             self.log.info("Wait for tx from second node")
@@ -113,14 +108,12 @@ class ZMQTest (BitcoinTestFramework):
             self.sync_all()
 
             # Should receive the broadcasted txid.
-            txid = self.hashtx.receive()
-            assert_equal(payment_txid, bytes_to_hex_str(txid))
+            txid = self.hashtx.receive().decode()
+            assert_equal(payment_txid, txid)
 
             # Should receive the broadcasted raw transaction.
-            hex = self.rawtx.receive()
-            # disabled because of segwit
-            #assert_equal(payment_txid, bytes_to_hex_str(hash256(hex)))
-
+            tx = self.rawtx.receive().decode()
+            assert_equal(payment_txid, tx.hash)
 
         self.log.info("Test the getzmqnotifications RPC")
         assert_equal(self.nodes[0].getzmqnotifications(), [
@@ -132,5 +125,37 @@ class ZMQTest (BitcoinTestFramework):
 
         assert_equal(self.nodes[1].getzmqnotifications(), [])
 
+        # No notification was dropped
+        assert_equal(sum(self.stats.lost.values()), 0)
+        throughput = self.stats.throughput()
+        assert_equal(set(throughput), {b"hashblock", b"hashtx", b"rawblock", b"rawtx"})
+        self.log.debug("Notifications per second: %s" % throughput)
+
+        self.log.info("Receive a block with the asyncio subscriber")
+        self.network_thread.run_coroutine(self._receive_block_async())
+
+    async def _receive_block_async(self):
+        subscriber = AsyncZMQSubscriber(ADDRESS, [b"rawblock"])
+        try:
+            subscriber.start()
+            # Blocks published before the subscription reached the node are
+            # not sent to it, so mine until one comes through
+            genhashes = []
+            notification = None
+            while notification is None:
+                assert len(genhashes) < 10, "No block received by the asyncio subscriber"
+                genhashes += await self.nodes[0].async_rpc.generatetoaddress(1, ADDRESS_BCRT1_UNSPENDABLE)
+                try:
+                    notification = await subscriber.receive(timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            subscriber.close()
+        assert_equal(notification.topic, b"rawblock")
+        block = notification.decode()
+        assert block.hash in genhashes
+        assert_equal([tx.hash for tx in block.vtx], (await self.nodes[0].async_rpc.getblock(block.hash))["tx"])
+        assert_equal(sum(subscriber.stats.lost.values()), 0)
+
 if __name__ == '__main__':
     ZMQTest().main()
@@ -351,24 +351,15 @@ class CompactBlocksTest(BitcoinTestFramework):
         # Check that the cmpctblock message announced all the transactions.
         assert_equal(len(header_and_shortids.prefilled_txn) + len(header_and_shortids.shortids), len(block.vtx))
 
-        # And now check that all the shortids are as expected as well.
-        # Determine the siphash keys to use.
-        [k0, k1] = header_and_shortids.get_siphash_keys()
-
-        index = 0
-        while index < len(block.vtx):
-            if (len(header_and_shortids.prefilled_txn) > 0 and
-                    header_and_shortids.prefilled_txn[0].index == index):
-                # Already checked prefilled transactions above
-                header_and_shortids.prefilled_txn.pop(0)
-            else:
-                tx_hash = block.vtx[index].sha256
-                if version == 2:
-                    tx_hash = block.vtx[index].calc_sha256(True)
-                shortid = calculate_shortid(k0, k1, tx_hash)
-                assert_equal(shortid, header_and_shortids.shortids[0])
-                header_and_shortids.shortids.pop(0)
-            index += 1
+        # And now check that all the shortids are as expected as well, by
+        # resolving each announced shortid to the block transaction it names.
+        header_and_shortids.use_witness = (version == 2)
+        shortid_index = header_and_shortids.get_shortid_index(block.vtx)
+
+        # Already checked prefilled transactions above
+        prefilled = set(entry.index for entry in header_and_shortids.prefilled_txn)
+        expected_txs = [tx for index, tx in enumerate(block.vtx) if index not in prefilled]
+        assert_equal([shortid_index.get(shortid) for shortid in header_and_shortids.shortids], expected_txs)
 
     # Test that bitcoind requests compact blocks when we announce new blocks
     # via header or inv, and that responding to getblocktxn causes the block
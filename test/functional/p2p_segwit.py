@@ -37,6 +37,7 @@ from test_framework.messages import (
     msg_witness_tx,
     ser_uint256,
     ser_vector,
+    set_serialization_cache,
     sha256,
     uint256_from_str,
     FromHex,
@@ -958,6 +959,9 @@ class SegWitTest(BitcoinTestFramework):
         # Skipping this test for now; this is covered in p2p-fullblocktest.py
 
         # Test that witness-bearing blocks are limited at ceil(base + wit/4) <= 1MB.
+        # The block is over 2MB and is serialized several times to check its
+        # size and to send it: cache the serializations for this test.
+        set_serialization_cache(True)
         block = self.build_next_block()
 
         assert(len(self.utxo) > 0)
@@ -1011,6 +1015,8 @@ class SegWitTest(BitcoinTestFramework):
             block.vtx[-1].wit.vtxinwit[int(i / (2 * NUM_DROPS))].scriptWitness.stack[i % (2 * NUM_DROPS)] = b'a' * (195 + extra_bytes)
             additional_bytes -= extra_bytes
             i += 1
+        # The witness stacks were changed in place
+        block.vtx[-1].invalidate_cache()
 
         block.vtx[0].vout.pop()  # Remove old commitment
         add_witness_commitment(block)
@@ -1026,6 +1032,7 @@ class SegWitTest(BitcoinTestFramework):
         # Now resize the second transaction to make the block fit.
         cur_length = len(block.vtx[-1].wit.vtxinwit[0].scriptWitness.stack[0])
         block.vtx[-1].wit.vtxinwit[0].scriptWitness.stack[0] = b'a' * (cur_length - 1)
+        block.vtx[-1].invalidate_cache()
         block.vtx[0].vout.pop()
         add_witness_commitment(block)
         block.solve()
@@ -1036,6 +1043,7 @@ class SegWitTest(BitcoinTestFramework):
         # Update available utxo's
         self.utxo.pop(0)
         self.utxo.append(UTXO(block.vtx[-1].sha256, 0, block.vtx[-1].vout[0].nValue.getAmount()))
+        set_serialization_cache(False)
 
     @subtest
     def test_submit_block(self):
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
 from test_framework.test_framework import BitcoinTestFramework
-from test_framework.util import assert_equal, calcfastmerkleroot
+from test_framework.messages import hash256
+from test_framework.util import assert_equal, bytes_to_hex_str, calcfastmerkleroot
 from test_framework import util
 
 class CalcFastMerkleRoot(BitcoinTestFramework):
@@ -11,6 +12,7 @@ class CalcFastMerkleRoot(BitcoinTestFramework):
 
     def run_test(self):
         util.node_fastmerkle = self.nodes[0]
+        util.fastmerkle_crosscheck = True
         print(util.node_fastmerkle) # to avoid the dead code linter in all tests that use this
 
         test_leaves = ["b66b041650db0f297b53f8d93c0e8706925bf3323f8c59c14a6fac37bfdcd06f", "99cb2fa68b2294ae133550a9f765fc755d71baa7b24389fed67d1ef3e5cb0255", "257e1b2fa49dd15724c67bac4df7911d44f6689860aa9f65a881ae0a2f40a303", "b67b0b9f093fa83d5e44b707ab962502b7ac58630e556951136196e65483bb80"]
@@ -20,7 +22,14 @@ class CalcFastMerkleRoot(BitcoinTestFramework):
         for i in range(4):
             root = calcfastmerkleroot(leaves)
             assert_equal(root, test_roots[i])
+            assert_equal(self.nodes[0].calcfastmerkleroot(leaves), test_roots[i])
             leaves.append(test_leaves[i])
+        assert_equal(calcfastmerkleroot(leaves), test_roots[-1])
+
+        # The local implementation must agree with the node on larger, odd-sized trees too
+        leaves = [bytes_to_hex_str(hash256(bytes([i]))) for i in range(37)]
+        for n in range(len(leaves)):
+            assert_equal(calcfastmerkleroot(leaves[:n]), self.nodes[0].calcfastmerkleroot(leaves[:n]))
 
 if __name__ == '__main__':
     CalcFastMerkleRoot().main()
@@ -29,6 +29,7 @@ class RawTransactionsTest(BitcoinTestFramework):
         self.num_nodes = 4
         self.extra_args = [["-blindedaddresses=1"]] * self.num_nodes
         self.setup_clean_chain = True
+        self.sync_notifications = True
 
     def skip_test_if_missing_module(self):
         self.skip_if_no_wallet()
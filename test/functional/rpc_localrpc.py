@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Elements developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Test the in-process RPCs in test_framework/localrpc.py against the node.
+
+Every call goes through LocalRPC with crosscheck=1, so each successful
+answer is compared with the node's. Failing calls must fail with the
+same error code on both sides."""
+
+from decimal import Decimal
+
+from test_framework import liquid_addr, segwit_addr
+from test_framework.authproxy import JSONRPCException
+from test_framework.localrpc import LocalRPC
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import assert_equal, assert_raises_rpc_error
+
+class LocalRPCTest(BitcoinTestFramework):
+    def set_test_params(self):
+        self.setup_clean_chain = True
+        self.num_nodes = 1
+        # Confidential addresses, so blinded transactions get decoded too
+        self.extra_args = [["-blindedaddresses=1"]]
+
+    def skip_test_if_missing_module(self):
+        self.skip_if_no_wallet()
+
+    def assert_same_error(self, method, *args):
+        """Both the node and LocalRPC must reject the call with the same code."""
+        try:
+            getattr(self.nodes[0], method)(*args)
+        except JSONRPCException as e:
+            code = e.error["code"]
+        else:
+            raise AssertionError("%s%r did not fail on the node" % (method, args))
+        assert_raises_rpc_error(code, None, getattr(self.local, method), *args)
+
+    def run_test(self):
+        node = self.nodes[0]
+        self.local = LocalRPC(node, crosscheck=1)
+        node.generate(101)
+
+        self.log.info("calcfastmerkleroot")
+        leaves = []
+        for i in range(9):
+            self.local.calcfastmerkleroot(leaves)
+            leaves.append("%064x" % (i * 0x1234567))
+        self.assert_same_error("calcfastmerkleroot", ["00"])
+
+        self.log.info("tweakfedpegscript")
+        for _ in range(3):
+            self.local.tweakfedpegscript(node.getpeginaddress()["claim_script"])
+        self.local.tweakfedpegscript("")
+        self.assert_same_error("tweakfedpegscript", "zz")
+
+        self.log.info("validateaddress")
+        addresses = []
+        for address_type in ["legacy", "p2sh-segwit", "bech32"]:
+            address = node.getnewaddress("", address_type)
+            addresses.append(address)
+            addresses.append(node.getaddressinfo(address)["unconfidential"])
+        addresses.append(node.getpeginaddress()["mainchain_address"])
+        for address in addresses:
+            self.local.validateaddress(address)
+        for address in ["", "1", addresses[0][:-1], addresses[-1].upper(), " " + addresses[1]]:
+            self.local.validateaddress(address)
+
+        # The address codecs agree with the programs (and blinding keys) the
+        # node reports for its segwit addresses, both ways
+        params = self.local.params
+        for codec, hrp in [(segwit_addr, params.bech32_hrp), (liquid_addr, params.blech32_hrp)]:
+            segwit_addresses = [address for address in addresses if address.startswith(hrp + "1")]
+            assert_equal(len(segwit_addresses), 1)
+            programs = []
+            for address in segwit_addresses:
+                info = node.getaddressinfo(address)
+                program = info.get("confidential_key", "") + info["witness_program"] if codec is liquid_addr else info["witness_program"]
+                programs.append((info["witness_version"], bytes.fromhex(program)))
+            assert_equal(codec.decode_many(hrp, segwit_addresses), [(version, list(program)) for version, program in programs])
+            assert_equal(codec.encode_many(hrp, programs), segwit_addresses)
+
+        self.log.info("createrawtransaction")
+        utxo = node.listunspent()[0]
+        inputs = [{"txid": utxo["txid"], "vout": utxo["vout"]}]
+        outputs = [{address: Decimal("0.1") * (i + 1)} for i, address in enumerate(addresses)]
+        outputs += [{"data": "00ff"}, {"vdata": ["0011", "2233"]}, {"burn": Decimal("0.5")}, {"fee": Decimal("0.001")}]
+        created = [
+            self.local.createrawtransaction(inputs, outputs),
+            self.local.createrawtransaction(inputs, outputs[:1], 1000),
+            self.local.createrawtransaction(inputs, outputs[:2], 0, True),
+            self.local.createrawtransaction(inputs + [{"txid": utxo["txid"], "vout": 7, "sequence": 42}], {addresses[0]: 1}),
+            self.local.createrawtransaction([], [], None, None, {}),
+        ]
+        self.assert_same_error("createrawtransaction", inputs, [{addresses[0]: 1}, {addresses[0]: 2}])
+        self.assert_same_error("createrawtransaction", inputs, {"foo": 1})
+        self.assert_same_error("createrawtransaction", [{"txid": "00", "vout": 0}], {})
+        self.assert_same_error("createrawtransaction", inputs, {addresses[0]: -1})
+
+        self.log.info("decoderawtransaction")
+        for tx in created:
+            self.local.decoderawtransaction(tx)
+        signed = node.signrawtransactionwithwallet(created[1])["hex"]
+        self.local.decoderawtransaction(signed)
+        # Blinded, issuance and coinbase transactions from the wallet
+        txids = [
+            node.sendtoaddress(addresses[0], 1),
+            node.sendtoaddress(addresses[1], 1),
+            node.issueasset(1, 1)["txid"],
+            node.issueasset(2, 0, False)["txid"],
+        ]
+        txids.append(node.getblock(node.generate(1)[0])["tx"][0])
+        for txid in txids:
+            self.local.decoderawtransaction(node.gettransaction(txid)["hex"])
+        self.assert_same_error("decoderawtransaction", "00")
+        self.assert_same_error("decoderawtransaction", signed[:-2])
+
+        # Answers are memoized, and a copy is handed out each time
+        decoded = self.local.decoderawtransaction(signed)
+        decoded["vin"] = []
+        assert_equal(len(self.local.decoderawtransaction(signed)["vin"]), 1)
+
+if __name__ == '__main__':
+    LocalRPCTest().main()
@@ -29,7 +29,22 @@ def byte_to_base58(b, version):
         str = str[2:]
     return result
 
-# TODO: def base58_decode
+def base58_decode(s):
+    """Decode a base58check string to its payload (including the version
+    bytes), or return None if it is malformed or the checksum is wrong.
+
+    Like DecodeBase58Check(), surrounding whitespace is ignored."""
+    s = s.strip(" \f\n\r\t\v")
+    if not all(c in chars for c in s):
+        return None
+    value = 0
+    for c in s:
+        value = value * 58 + chars.index(c)
+    pad = len(s) - len(s.lstrip(chars[0]))
+    data = b'\x00' * pad + value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    if len(data) < 4 or hash256(data[:-4])[:4] != data[-4:]:
+        return None
+    return data[:-4]
 
 def keyhash_to_p2pkh(hash, main = False):
     assert (len(hash) == 20)
@@ -12,6 +12,7 @@ from .address import (
 )
 from .messages import (
     CBlock,
+    CBlockHeader,
     COIN,
     COutPoint,
     CTransaction,
@@ -24,6 +25,7 @@ from .messages import (
     bytes_to_hex_str,
     hash256,
     hex_str_to_bytes,
+    ser_compact_size,
     ser_string,
     ser_uint256,
     sha256,
@@ -41,12 +43,27 @@ from .script import (
     OP_TRUE,
     hash160,
 )
-from .util import assert_equal
+from .localrpc import LocalRPC
+from .util import assert_equal, gen_return_txouts
 from io import BytesIO
+import weakref
 
 # From BIP141
 WITNESS_COMMITMENT_HEADER = b"\xaa\x21\xa9\xed"
 
+MAX_BLOCK_WEIGHT = 4000000
+
+# Fraction of the LocalRPC answers that are checked against the node
+LOCAL_RPC_CROSSCHECK = 0.1
+
+_local_rpcs = weakref.WeakKeyDictionary()
+
+def get_local_rpc(node):
+    """The LocalRPC answering for node, with that node's chain parameters."""
+    if node not in _local_rpcs:
+        _local_rpcs[node] = LocalRPC(node, crosscheck=LOCAL_RPC_CROSSCHECK)
+    return _local_rpcs[node]
+
 # Assumes a BIP34 valid commitment exists
 def get_coinbase_height(coinbase):
     return CScriptNum.decode(coinbase.vin[0].scriptSig)
@@ -217,7 +234,8 @@ def create_witness_tx(node, use_p2wsh, utxo, pubkey, encode_p2sh, amount):
         assert_equal(node.getaddressinfo(addr)['scriptPubKey'], witness_script(use_p2wsh, pubkey))
     if "amount" not in utxo:
         utxo["amount"] = node.gettxout(utxo["txid"], utxo["vout"])["value"]
-    return node.createrawtransaction([utxo], {addr: amount, "fee": utxo["amount"]-amount})
+    # Built in-process, the node only signs and broadcasts it
+    return get_local_rpc(node).createrawtransaction([utxo], {addr: amount, "fee": utxo["amount"]-amount})
 
 def send_to_witness(use_p2wsh, node, utxo, pubkey, encode_p2sh, amount, sign=True, insert_redeem_script=""):
     """Create a transaction spending a given utxo to a segwit output.
@@ -238,3 +256,90 @@ def send_to_witness(use_p2wsh, node, utxo, pubkey, encode_p2sh, amount, sign=Tru
             tx_to_witness = ToHex(tx)
 
     return node.sendrawtransaction(tx_to_witness)
+
+class LargeBlockBuilder():
+    """Mine full-size blocks without the wallet.
+
+    The blocks are stuffed with transactions carrying the OP_RETURN outputs
+    of gen_return_txouts(), which are serialized once and shared by all of
+    them. Each transaction spends the anyone-can-spend change of the previous
+    one, starting from a coinbase of the builder's own (see fund()), and pays
+    no fee, so the chain can go on indefinitely. Such transactions are not
+    standard: they never enter the mempool, blocks are submitted whole with
+    submitblock.
+
+    When blocks of the builder are reorged out, it carries on from the last
+    of its outputs still on the active chain."""
+
+    def __init__(self, node, max_weight=MAX_BLOCK_WEIGHT - 40000):
+        self.node = node
+        self.max_weight = max_weight
+        self.script_pubkey = CScript([OP_TRUE])
+        txouts = gen_return_txouts()
+        self.txouts = b"".join(txout.serialize() for txout in txouts)
+        # The change output comes first
+        self.num_txouts = 1 + len(txouts)
+        # Outpoints and values of the spendable output after each block mined,
+        # the first being the funding coinbase
+        self.heads = []
+
+    def fund(self):
+        """Mine a block paying its coinbase to the builder.
+
+        It can be spent, and blocks mined, once it has matured (100 blocks)."""
+        height, ntime = self._tip()
+        coinbase = create_coinbase(height + 1)
+        block = create_block(int(self.node.getbestblockhash(), 16), coinbase, ntime + 1)
+        block.solve()
+        assert_equal(self.node.submitblock(ToHex(block)), None)
+        self.heads = [(COutPoint(coinbase.sha256, 0), coinbase.vout[0].nValue.getAmount())]
+        return block.hash
+
+    def mine_block(self):
+        """Mine one full block on the tip, returning its hash."""
+        outpoint, value = self._head()
+        height, ntime = self._tip()
+        coinbase = create_coinbase(height + 1)
+        change = CTxOut(value, self.script_pubkey).serialize()
+
+        # Base size of the block so far, with room for the transaction count
+        weight = 4 * (len(CBlockHeader().serialize()) + 3 + len(coinbase.serialize_without_witness()))
+        raw_txs = []
+        txids = [ser_uint256(coinbase.sha256)]
+        while True:
+            raw_tx = b"".join((
+                b"\x02\x00\x00\x00\x00",  # nVersion, no witness
+                b"\x01", outpoint.serialize(), b"\x00\xff\xff\xff\xff",
+                ser_compact_size(self.num_txouts), change, self.txouts,
+                b"\x00\x00\x00\x00",  # nLockTime
+            ))
+            if weight + 4 * len(raw_tx) > self.max_weight:
+                break
+            weight += 4 * len(raw_tx)
+            raw_txs.append(raw_tx)
+            txid = hash256(raw_tx)
+            txids.append(txid)
+            outpoint = COutPoint(uint256_from_str(txid), 0)
+        assert raw_txs
+
+        block = create_block(int(self.node.getbestblockhash(), 16), coinbase, ntime + 1)
+        block.hashMerkleRoot = CBlock.get_merkle_root(txids)
+        block.solve()
+        raw_block = CBlockHeader.serialize(block) + ser_compact_size(1 + len(raw_txs)) + coinbase.serialize_without_witness() + b"".join(raw_txs)
+        assert_equal(self.node.submitblock(bytes_to_hex_str(raw_block)), None)
+        assert_equal(self.node.getbestblockhash(), block.hash)
+        self.heads.append((outpoint, value))
+        return block.hash
+
+    def _tip(self):
+        header = self.node.getblockheader(self.node.getbestblockhash())
+        return header["height"], header["time"]
+
+    def _head(self):
+        assert self.heads, "fund() the builder first"
+        while len(self.heads) > 1:
+            outpoint, _ = self.heads[-1]
+            if self.node.gettxout("%064x" % outpoint.hash, outpoint.n, False) is not None:
+                break
+            self.heads.pop()
+        return self.heads[-1]
@@ -36,7 +36,9 @@ class AuthServiceProxyWrapper():
         if not isinstance(return_val, type(self.auth_service_proxy_instance)):
             # If proxy getattr returned an unwrapped value, do the same here.
             return return_val
-        return AuthServiceProxyWrapper(return_val, self.coverage_logfile)
+        wrapper = self.__class__(return_val, self.coverage_logfile)
+        self.__dict__[name] = wrapper
+        return wrapper
 
     def __call__(self, *args, **kwargs):
         """
@@ -56,13 +58,28 @@ class AuthServiceProxyWrapper():
                 f.write("%s\n" % rpc_method)
 
     def __truediv__(self, relative_uri):
-        return AuthServiceProxyWrapper(self.auth_service_proxy_instance / relative_uri,
-                                       self.coverage_logfile)
+        return self.__class__(self.auth_service_proxy_instance / relative_uri,
+                              self.coverage_logfile)
 
     def get_request(self, *args, **kwargs):
         self._log_call()
         return self.auth_service_proxy_instance.get_request(*args, **kwargs)
 
+class AsyncAuthServiceProxyWrapper(AuthServiceProxyWrapper):
+    """
+    An object that wraps AsyncAuthServiceProxy to record specific RPC calls.
+
+    """
+    async def __call__(self, *args, **kwargs):
+        """
+        Delegates to AsyncAuthServiceProxy, then writes the particular RPC
+        method called to a file.
+
+        """
+        return_val = await self.auth_service_proxy_instance.__call__(*args, **kwargs)
+        self._log_call()
+        return return_val
+
 def get_filename(dirname, n_node):
     """
     Get a filename unique to the test process ID and node.
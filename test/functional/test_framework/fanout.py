@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Elements developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Create large sets of confirmed UTXOs with a handful of RPCs.
+
+UTXOFanout pays to a deterministic P2WPKH key. The node's wallet funds a
+single output to it, which is then split up locally by a tree of wide
+transactions: each level is built with CTransaction, signed in Python,
+submitted in one JSON-RPC batch and mined before the next level, so the
+mempool ancestor and descendant limits are never hit.
+
+The key is imported into the wallet (see import_key()), so the resulting
+outputs can also be spent through the wallet RPCs, as the outputs of
+util.create_confirmed_utxos() always could.
+
+This module imports messages, which imports util, so util only imports it
+from within create_confirmed_utxos()."""
+
+from decimal import Decimal
+
+from .address import byte_to_base58, key_to_p2wpkh
+from .authproxy import JSONRPCException
+from .key import CECKey
+from .messages import (
+    COIN,
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxInWitness,
+    CTxOut,
+    CTxOutValue,
+    FromHex,
+    ToHex,
+    sha256,
+)
+from .script import CScript, OP_0, OP_CHECKSIG, OP_DUP, OP_EQUALVERIFY, OP_HASH160, hash160, sign_all_inputs
+from .util import bytes_to_hex_str
+
+# Version byte of WIF private keys on elementsregtest
+SECRET_KEY_PREFIX = 239
+
+# Outputs per transaction, keeping the transactions well below the
+# standardness weight limit
+DEFAULT_OUTPUTS_PER_TX = 500
+
+class UTXOFanout():
+    """Splits wallet funds into many outputs to a deterministic key."""
+
+    def __init__(self, node, *, seed=b"fanout", outputs_per_tx=DEFAULT_OUTPUTS_PER_TX):
+        assert 1 <= outputs_per_tx
+        self.node = node
+        self.outputs_per_tx = outputs_per_tx
+        self.key = CECKey()
+        self.key.set_secretbytes(sha256(seed))
+        self.key.set_compressed(True)
+        self.pubkey = self.key.get_pubkey()
+        self.script_pubkey = CScript([OP_0, hash160(self.pubkey)])
+        self.script_code = CScript([OP_DUP, OP_HASH160, hash160(self.pubkey), OP_EQUALVERIFY, OP_CHECKSIG])
+        self.address = key_to_p2wpkh(self.pubkey)
+        self.wif = byte_to_base58(self.key.secret + b"\x01", SECRET_KEY_PREFIX)
+
+    def import_key(self):
+        """Make the wallet of the node aware of the outputs to the key."""
+        self.node.importprivkey(self.wif, "fanout", False)
+
+    def fan_out(self, count, amount, fee):
+        """Create count confirmed outputs of amount each.
+
+        amount and fee are in coins, fee is paid for every output created.
+        The funds come from the wallet of the node. Returns the outputs as
+        listunspent-style dicts."""
+        amount = int(amount * COIN)
+        fee = int(fee * COIN)
+        assert count > 0 and amount > 0
+
+        # Work out the transaction tree from the leaves up: each level lists
+        # the output values of its transactions
+        levels = []
+        values = [amount] * count
+        while True:
+            txs = [values[i:i + self.outputs_per_tx] for i in range(0, len(values), self.outputs_per_tx)]
+            levels.append(txs)
+            values = [sum(tx) + len(tx) * fee for tx in txs]
+            if len(values) == 1:
+                break
+
+        txid = self.node.sendtoaddress(self.address, Decimal(values[0]) / COIN)
+        funding_tx = FromHex(CTransaction(), self.node.gettransaction(txid)["hex"])
+        vout = next(n for n, txout in enumerate(funding_tx.vout)
+                    if txout.scriptPubKey == self.script_pubkey and txout.nValue.getAmount() == values[0])
+        utxos = [(COutPoint(int(txid, 16), vout), values[0])]
+        self._mine()
+
+        for txs in reversed(levels):
+            assert len(txs) == len(utxos)
+            signed = [self._create_tx(outpoint, value, outputs) for (outpoint, value), outputs in zip(utxos, txs)]
+            self._submit(signed)
+            utxos = [(COutPoint(tx.sha256, n), txout.nValue.getAmount())
+                     for tx in signed for n, txout in enumerate(tx.vout) if not txout.is_fee()]
+
+        script_hex = bytes_to_hex_str(self.script_pubkey)
+        return [{"txid": "%064x" % outpoint.hash, "vout": outpoint.n, "address": self.address,
+                 "scriptPubKey": script_hex, "amount": Decimal(value) / COIN}
+                for outpoint, value in utxos]
+
+    def _create_tx(self, outpoint, value, outputs):
+        tx = CTransaction()
+        tx.nVersion = 2
+        tx.vin.append(CTxIn(outpoint, nSequence=0xffffffff))
+        tx.vout = [CTxOut(output, self.script_pubkey) for output in outputs]
+        tx.vout.append(CTxOut(value - sum(outputs)))
+        tx.wit.vtxinwit = [CTxInWitness()]
+        sig, = sign_all_inputs(tx, [self.key], [self.script_code], [CTxOutValue(value)])
+        tx.wit.vtxinwit[0].scriptWitness.stack = [sig, self.pubkey]
+        tx.rehash()
+        return tx
+
+    def _submit(self, txs):
+        responses = self.node.batch([self.node.sendrawtransaction.get_request(ToHex(tx)) for tx in txs])
+        for response in responses:
+            if response["error"] is not None:
+                raise JSONRPCException(response["error"])
+        self._mine()
+
+    def _mine(self):
+        while self.node.getmempoolinfo()["size"] > 0:
+            self.node.generate(1)
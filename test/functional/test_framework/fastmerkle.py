@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Elements developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Elements fast merkle root implementation.
+
+This implements ComputeFastMerkleRoot() from src/primitives/txwitness.cpp,
+which combines nodes with a single SHA256 compression of (left || right)
+and uses the raw midstate as the parent hash (no padding, no double hash).
+
+All hashes are 32-byte strings in internal (little-endian uint256) byte
+order, i.e. the reverse of the hex strings returned over RPC.
+"""
+
+from functools import lru_cache
+import struct
+
+SHA256_IV = (
+    0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+    0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+)
+
+SHA256_K = (
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+)
+
+def sha256_midstate(data):
+    """Return the SHA256 state after compressing one 64-byte block.
+
+    Equivalent to CSHA256().Write(data, 64).Midstate() in the C++ code."""
+    assert len(data) == 64
+    w = list(struct.unpack(">16I", data)) + [0] * 48
+    for i in range(16, 64):
+        x = w[i - 15]
+        y = w[i - 2]
+        s0 = (x >> 7 | x << 25) ^ (x >> 18 | x << 14) ^ (x >> 3)
+        s1 = (y >> 17 | y << 15) ^ (y >> 19 | y << 13) ^ (y >> 10)
+        w[i] = (w[i - 16] + w[i - 7] + s0 + s1) & 0xffffffff
+
+    a, b, c, d, e, f, g, h = SHA256_IV
+    for k, wi in zip(SHA256_K, w):
+        s1 = (e >> 6 | e << 26) ^ (e >> 11 | e << 21) ^ (e >> 25 | e << 7)
+        t1 = (h + s1 + ((e & f) ^ (~e & g)) + k + wi) & 0xffffffff
+        t2 = ((a >> 2 | a << 30) ^ (a >> 13 | a << 19) ^ (a >> 22 | a << 10)) + ((a & b) ^ (a & c) ^ (b & c))
+        h, g, f, e, d, c, b, a = g, f, e, (d + t1) & 0xffffffff, c, b, a, (t1 + t2) & 0xffffffff
+
+    return struct.pack(">8I",
+                       (SHA256_IV[0] + a) & 0xffffffff, (SHA256_IV[1] + b) & 0xffffffff,
+                       (SHA256_IV[2] + c) & 0xffffffff, (SHA256_IV[3] + d) & 0xffffffff,
+                       (SHA256_IV[4] + e) & 0xffffffff, (SHA256_IV[5] + f) & 0xffffffff,
+                       (SHA256_IV[6] + g) & 0xffffffff, (SHA256_IV[7] + h) & 0xffffffff)
+
+def merkle_hash_sha256_midstate(left, right):
+    return sha256_midstate(left + right)
+
+@lru_cache(maxsize=65536)
+def _fast_merkle_root(hashes):
+    # Same eager subtree algorithm as the C++ code, see ComputeFastMerkleRoot().
+    inner = [None] * 32
+    count = 0
+    for temp_hash in hashes:
+        count += 1
+        level = 0
+        while not count & (1 << level):
+            temp_hash = merkle_hash_sha256_midstate(inner[level], temp_hash)
+            level += 1
+        inner[level] = temp_hash
+
+    level = 0
+    while not count & (1 << level):
+        level += 1
+    result_hash = inner[level]
+
+    while count != (1 << level):
+        count += (1 << level)
+        level += 1
+        while not count & (1 << level):
+            result_hash = merkle_hash_sha256_midstate(inner[level], result_hash)
+            level += 1
+    return result_hash
+
+def compute_fast_merkle_root(hashes):
+    """Return the fast merkle root of a list of 32-byte hashes.
+
+    Results are memoized on the leaves, so recomputing the witness root of an
+    unchanged input, output or transaction costs a single dictionary lookup."""
+    if len(hashes) == 0:
+        return b"\x00" * 32
+    return _fast_merkle_root(tuple(bytes(h) for h in hashes))
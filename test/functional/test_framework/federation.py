@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Elements developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Run the block signing rounds of a federation of signing nodes.
+
+In each round, the proposer (chosen round robin by height) creates a block
+with getnewblockhex and sends its compact sketch to the other signers. They
+all reconstruct and validate the block (consumecompactsketch,
+finalizecompactblock and testproposedblock) and sign it concurrently, and
+the proposer combines the signatures as they come in, until the signblock
+script is satisfied. The signed block is then submitted to every signer.
+
+Rounds are pipelined: the next proposal starts as soon as its proposer has
+accepted the previous block, and each signer only waits for its own copy of
+the previous block before validating the next one.
+
+The latency of every phase of every round is recorded in Federation.rounds,
+see RoundTimings."""
+
+import asyncio
+from collections import namedtuple
+import time
+
+from .messages import CBlock, FromHex
+from .mininode import NetworkThread
+
+# Durations in seconds:
+#   propose: creating the block and its compact sketch,
+#   validate: from the sketch until the last signer validated the block,
+#   sign: from the sketch until enough signatures were combined,
+#   submit: from then until every signer accepted the block.
+RoundTimings = namedtuple("RoundTimings", ["height", "propose", "validate", "sign", "submit"])
+
+PHASES = ("propose", "validate", "sign", "submit")
+
+class Federation():
+    """Signing nodes with their block signing keys imported."""
+
+    def __init__(self, signers):
+        self.signers = signers
+        self.rounds = []
+
+    def mine_blocks(self, num_blocks):
+        """Propose, sign and submit num_blocks blocks. Returns their hashes."""
+        return NetworkThread.run_coroutine(self.mine_blocks_async(num_blocks))
+
+    async def mine_blocks_async(self, num_blocks):
+        height = await self.signers[0].async_rpc.getblockcount()
+        submitted = [None] * len(self.signers)
+        hashes = []
+        for _ in range(num_blocks):
+            height += 1
+            block_hash, submitted = await self._round(height, submitted)
+            hashes.append(block_hash)
+        await asyncio.gather(*submitted)
+        return hashes
+
+    async def _round(self, height, previous):
+        """Run a round on top of the previous block, whose submissions to the
+        signers are still in flight. Returns the hash of the new block and
+        its submissions."""
+        rpcs = [signer.async_rpc for signer in self.signers]
+        # Rounds finish out of order, keep their timings in height order
+        round_index = len(self.rounds)
+        self.rounds.append(None)
+        proposer_index = (height - 1) % len(rpcs)
+        proposer = rpcs[proposer_index]
+
+        start = time.time()
+        if previous[proposer_index] is not None:
+            await previous[proposer_index]
+        block = await proposer.getnewblockhex()
+        sketch = await proposer.getcompactsketch(block)
+        sketched = time.time()
+
+        validated = []
+
+        async def validate_and_sign(i):
+            if i != proposer_index:
+                if previous[i] is not None:
+                    await previous[i]
+                response = await rpcs[i].consumecompactsketch(sketch)
+                if "blockhex" in response:
+                    final_block = response["blockhex"]
+                else:
+                    block_txn = await proposer.consumegetblocktxn(block, response["block_tx_req"])
+                    final_block = await rpcs[i].finalizecompactblock(sketch, block_txn, response["found_transactions"])
+                await rpcs[i].testproposedblock(final_block)
+            validated.append(time.time())
+            return await rpcs[i].signblock(block)
+
+        sigs = []
+        signed_block = None
+        for signing in asyncio.as_completed([validate_and_sign(i) for i in range(len(rpcs))]):
+            sigs += await signing
+            if signed_block is None:
+                result = await proposer.combineblocksigs(block, sigs)
+                if result["complete"]:
+                    signed_block = result["hex"]
+                    signed = time.time()
+        assert signed_block is not None, "Not enough signatures for block %d" % height
+
+        timings = dict(height=height, propose=sketched - start, validate=max(validated) - sketched, sign=signed - sketched)
+        pending = [len(rpcs)]
+
+        async def submit(i):
+            # The block can only be connected on top of the previous one
+            if previous[i] is not None:
+                await previous[i]
+            # Signers connected to each other may have the block already
+            assert await rpcs[i].submitblock(signed_block) in (None, "duplicate")
+            pending[0] -= 1
+            if not pending[0]:
+                self.rounds[round_index] = RoundTimings(submit=time.time() - signed, **timings)
+
+        submitted = [asyncio.ensure_future(submit(i)) for i in range(len(rpcs))]
+        signed_header = FromHex(CBlock(), signed_block)
+        signed_header.rehash()
+        return signed_header.hash, submitted
+
+    def latencies(self):
+        """Mean and maximum duration of each phase over the rounds so far."""
+        return {phase: (sum(getattr(r, phase) for r in self.rounds) / len(self.rounds), max(getattr(r, phase) for r in self.rounds))
+                for phase in PHASES}
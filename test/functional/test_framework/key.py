@@ -1,6 +1,10 @@
 # Copyright (c) 2011 Sam Rushing
 """ECC secp256k1 OpenSSL wrapper.
 
+When a libsecp256k1 shared library can be loaded (see secp256k1.py), keys
+with a known secret sign and verify through it, and OpenSSL is only used as
+a fallback.
+
 WARNING: This module does not mlock() secrets; your private keys may end up on
 disk in swap! Use with caution!
 
@@ -10,6 +14,10 @@ This file is modified from python-bitcoinlib.
 import ctypes
 import ctypes.util
 import hashlib
+import unittest
+from unittest import mock
+
+from .secp256k1 import secp256k1
 
 ssl = ctypes.cdll.LoadLibrary(ctypes.util.find_library ('ssl') or 'libeay32')
 
@@ -19,6 +27,12 @@ ssl.BN_new.argtypes = []
 ssl.BN_bin2bn.restype = ctypes.c_void_p
 ssl.BN_bin2bn.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p]
 
+ssl.BN_bn2bin.restype = ctypes.c_int
+ssl.BN_bn2bin.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+
+ssl.BN_num_bits.restype = ctypes.c_int
+ssl.BN_num_bits.argtypes = [ctypes.c_void_p]
+
 ssl.BN_CTX_free.restype = None
 ssl.BN_CTX_free.argtypes = [ctypes.c_void_p]
 
@@ -46,6 +60,9 @@ ssl.EC_KEY_get0_group.argtypes = [ctypes.c_void_p]
 ssl.EC_KEY_get0_public_key.restype = ctypes.c_void_p
 ssl.EC_KEY_get0_public_key.argtypes = [ctypes.c_void_p]
 
+ssl.EC_KEY_get0_private_key.restype = ctypes.c_void_p
+ssl.EC_KEY_get0_private_key.argtypes = [ctypes.c_void_p]
+
 ssl.EC_KEY_set_private_key.restype = ctypes.c_int
 ssl.EC_KEY_set_private_key.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
 
@@ -67,6 +84,9 @@ ssl.EC_POINT_free.argtypes = [ctypes.c_void_p]
 ssl.EC_POINT_mul.restype = ctypes.c_int
 ssl.EC_POINT_mul.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
 
+ssl.EC_POINT_point2oct.restype = ctypes.c_size_t
+ssl.EC_POINT_point2oct.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_void_p]
+
 # this specifies the curve used with ECDSA.
 NID_secp256k1 = 714 # from openssl/obj_mac.h
 
@@ -91,6 +111,8 @@ class CECKey():
 
     def __init__(self):
         self.k = ssl.EC_KEY_new_by_curve_name(NID_secp256k1)
+        # The 32-byte secret, when known, for use with libsecp256k1
+        self.secret = None
 
     def __del__(self):
         if ssl:
@@ -109,13 +131,20 @@ class CECKey():
         ssl.EC_KEY_set_public_key(self.k, pub_key)
         ssl.EC_POINT_free(pub_key)
         ssl.BN_CTX_free(ctx)
+        # Read back the scalar OpenSSL used, so both backends agree on the key
+        buf = ctypes.create_string_buffer((ssl.BN_num_bits(priv_key) + 7) // 8)
+        ssl.BN_bn2bin(priv_key, buf)
+        secret_value = int.from_bytes(buf.raw, 'big') % SECP256K1_ORDER
+        self.secret = secret_value.to_bytes(32, 'big') if secret_value else None
         return self.k
 
     def set_privkey(self, key):
+        self.secret = None
         self.mb = ctypes.create_string_buffer(key)
         return ssl.d2i_ECPrivateKey(ctypes.byref(self.k), ctypes.byref(ctypes.pointer(self.mb)), len(key))
 
     def set_pubkey(self, key):
+        self.secret = None
         self.mb = ctypes.create_string_buffer(key)
         return ssl.o2i_ECPublicKey(ctypes.byref(self.k), ctypes.byref(ctypes.pointer(self.mb)), len(key))
 
@@ -145,7 +174,40 @@ class CECKey():
         r = self.get_raw_ecdh_key(other_pubkey)
         return kdf(r)
 
+    def ecdh(self, pubkey):
+        """Shared secret with the serialized pubkey, as computed by CKey::ECDH
+        for blinding nonces: sha256 of the compressed shared point."""
+        if secp256k1 and secp256k1.has_ecdh and self.secret:
+            return secp256k1.ecdh(self.secret, pubkey)
+        other = CECKey()
+        if not other.set_pubkey(pubkey):
+            raise ValueError("Invalid public key")
+        group = ssl.EC_KEY_get0_group(self.k)
+        point = ssl.EC_POINT_new(group)
+        ctx = ssl.BN_CTX_new()
+        try:
+            if not ssl.EC_POINT_mul(group, point, None, ssl.EC_KEY_get0_public_key(other.k), ssl.EC_KEY_get0_private_key(self.k), ctx):
+                raise ValueError("ECDH failed")
+            shared = ctypes.create_string_buffer(33)
+            ssl.EC_POINT_point2oct(group, point, self.POINT_CONVERSION_COMPRESSED, shared, 33, ctx)
+        finally:
+            ssl.EC_POINT_free(point)
+            ssl.BN_CTX_free(ctx)
+        return hashlib.sha256(shared.raw).digest()
+
+    def sign_batch(self, hashes, low_s = True):
+        """Sign each hash in hashes, returning a list of DER signatures."""
+        if secp256k1 and self.secret and low_s:
+            for hash in hashes:
+                if not isinstance(hash, bytes):
+                    raise TypeError('Hash must be bytes instance; got %r' % hash.__class__)
+            return secp256k1.sign_batch(self.secret, hashes)
+        return [self._sign_openssl(hash, low_s) for hash in hashes]
+
     def sign(self, hash, low_s = True):
+        return self.sign_batch([hash], low_s)[0]
+
+    def _sign_openssl(self, hash, low_s):
         # FIXME: need unit tests for below cases
         if not isinstance(hash, bytes):
             raise TypeError('Hash must be bytes instance; got %r' % hash.__class__)
@@ -179,6 +241,11 @@ class CECKey():
 
     def verify(self, hash, sig):
         """Verify a DER signature"""
+        if secp256k1:
+            result = secp256k1.verify(self.get_pubkey(), hash, sig)
+            if result is not None:
+                return result
+        # Not strict DER, or no libsecp256k1
         return ssl.ECDSA_verify(0, hash, len(hash), sig, len(sig), self.k) == 1
 
     def set_compressed(self, compressed):
@@ -224,3 +291,68 @@ class CPubKey(bytes):
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__, super(CPubKey, self).__repr__())
 
+def verify_batch(items):
+    """Verify a list of (pubkey, hash, DER signature) triples, returning a list of booleans."""
+    results = secp256k1.verify_batch(items) if secp256k1 else [None] * len(items)
+    return [CPubKey(pubkey).verify(hash, sig) if result is None else result
+            for result, (pubkey, hash, sig) in zip(results, items)]
+
+
+class TestFrameworkKey(unittest.TestCase):
+    def backends(self):
+        """Run the body of the loop with OpenSSL, then with libsecp256k1 if
+        it could be loaded."""
+        for backend in ([None, secp256k1] if secp256k1 else [None]):
+            with self.subTest(backend=backend and backend.path), mock.patch(__name__ + ".secp256k1", backend):
+                yield backend
+
+    def make_key(self, n):
+        key = CECKey()
+        key.set_secretbytes(hashlib.sha256(bytes([n])).digest())
+        key.set_compressed(True)
+        return key
+
+    def test_sign_batch(self):
+        key = self.make_key(1)
+        hashes = [hashlib.sha256(bytes([i])).digest() for i in range(20)]
+        for _ in self.backends():
+            sigs = key.sign_batch(hashes)
+            self.assertEqual(len(sigs), len(hashes))
+            for h, sig in zip(hashes, sigs):
+                self.assertTrue(key.verify(h, sig))
+                # Low S
+                s_size = sig[5 + sig[3]]
+                self.assertLessEqual(int.from_bytes(sig[6 + sig[3]:6 + sig[3] + s_size], 'big'), SECP256K1_ORDER_HALF)
+            self.assertTrue(key.verify(hashes[0], key.sign(hashes[0])))
+            self.assertRaises(ValueError, key.sign_batch, [b"\x00" * 31])
+            self.assertRaises(TypeError, key.sign_batch, ["00" * 32])
+
+    def test_verify_batch(self):
+        key = self.make_key(1)
+        other = self.make_key(2)
+        pubkey = key.get_pubkey()
+        h = hashlib.sha256(b"hash").digest()
+        sig = key.sign(h)
+        # The same signature, with a high S
+        r_size = sig[3]
+        high_s = (SECP256K1_ORDER - int.from_bytes(sig[6 + r_size:], 'big')).to_bytes(33, 'big')
+        high_s_sig = bytes([0x30, 4 + r_size + 33]) + sig[2:4 + r_size] + bytes([2, 33]) + high_s
+        cases = [
+            ((pubkey, h, sig), True),
+            ((pubkey, h, high_s_sig), True),
+            ((pubkey, h[::-1], sig), False),
+            ((other.get_pubkey(), h, sig), False),
+            ((pubkey, h, sig[:-1]), False),
+        ]
+        for _ in self.backends():
+            self.assertEqual(verify_batch([item for item, _ in cases]), [valid for _, valid in cases])
+
+    def test_ecdh(self):
+        key = self.make_key(1)
+        other = self.make_key(2)
+        shared = set()
+        for _ in self.backends():
+            shared.add(key.ecdh(other.get_pubkey()))
+            shared.add(other.ecdh(key.get_pubkey()))
+            self.assertRaises(ValueError, key.ecdh, b"\x02" + b"\xff" * 32)
+        self.assertEqual(len(shared), 1)
@@ -2,20 +2,39 @@
 # Copyright (c) 2017 Pieter Wuille
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
-"""Reference implementation for Blech32 and segwit addresses."""
-
-
-CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
-
-def blech32_polymod(values):
-    """Internal function that computes the blech32 checksum."""
-    generator = [0x7d52fba40bd886, 0x5e8dbf1a03950c, 0x1c3a3c74072a18, 0x385d72fa0e5139, 0x7093e5a608865b] # new generators, 7 bytes
-    chk = 1
-    for value in values:
-        top = chk >> 55 # 25->55
-        chk = ((chk & 0x7fffffffffffff) << 5) ^ value # 0x1ffffff->0x7fffffffffffff
-        for i in range(5):
-            chk ^= generator[i] if ((top >> i) & 1) else 0
+"""Reference implementation for Blech32 and segwit addresses.
+
+The character set, base conversion and step tables are shared with Bech32,
+see segwit_addr.py."""
+
+import functools
+import random
+import unittest
+
+from .segwit_addr import (
+    DECODE_TABLE,
+    ENCODE_TABLE,
+    convertbits,
+    is_valid_charset,
+    polymod_tables,
+)
+
+BLECH32_GENERATOR = [0x7d52fba40bd886, 0x5e8dbf1a03950c, 0x1c3a3c74072a18, 0x385d72fa0e5139, 0x7093e5a608865b] # new generators, 7 bytes
+BLECH32_STEP, BLECH32_STEP2 = polymod_tables(BLECH32_GENERATOR, 60)
+
+# Size of the blinding pubkey in front of the witness program
+BLINDING_KEY_SIZE = 33
+
+def blech32_polymod(values, chk=1):
+    """Internal function that computes the blech32 checksum.
+
+    chk is the state to continue from, by default that of an empty input."""
+    step, step2 = BLECH32_STEP, BLECH32_STEP2
+    it = iter(values)
+    if len(values) & 1:
+        chk = ((chk & 0x7fffffffffffff) << 5) ^ next(it) ^ step[chk >> 55] # 0x1ffffff->0x7fffffffffffff, 25->55
+    for a, b in zip(it, it):
+        chk = ((chk & 0x3ffffffffffff) << 10) ^ (a << 5) ^ b ^ step2[chk >> 50]
     return chk
 
 
@@ -24,83 +43,118 @@ def blech32_hrp_expand(hrp):
     return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
 
 
+@functools.lru_cache(maxsize=64)
+def blech32_hrp_state(hrp):
+    """Checksum state after the expanded HRP."""
+    return blech32_polymod(blech32_hrp_expand(hrp))
+
+
 def blech32_verify_checksum(hrp, data):
     """Verify a checksum given HRP and converted data characters."""
-    return blech32_polymod(blech32_hrp_expand(hrp) + data) == 1
+    return blech32_polymod(data, blech32_hrp_state(hrp)) == 1
 
 
 def blech32_create_checksum(hrp, data):
     """Compute the checksum values given HRP and data."""
-    values = blech32_hrp_expand(hrp) + data
-    polymod = blech32_polymod(values + [0]*12) ^ 1 # 6->12
+    polymod = blech32_polymod(data + [0]*12, blech32_hrp_state(hrp)) ^ 1 # 6->12
     return [(polymod >> 5 * (11 - i)) & 31 for i in range(12)]
 #                            ^ 5                          ^ 6
 
 def blech32_encode(hrp, data):
     """Compute a blech32 string given HRP and data values."""
     combined = data + blech32_create_checksum(hrp, data)
-    return hrp + '1' + ''.join([CHARSET[d] for d in combined])
+    return hrp + '1' + bytes(combined).translate(ENCODE_TABLE).decode()
 
 
 def blech32_decode(bech):
     """Validate a blech32 string, and determine HRP and data."""
-    if ((any(ord(x) < 33 or ord(x) > 126 for x in bech)) or
-            (bech.lower() != bech and bech.upper() != bech)):
+    if not is_valid_charset(bech):
         return (None, None)
     bech = bech.lower()
     pos = bech.rfind('1')
     if pos < 1 or pos + 13 > len(bech) or len(bech) > 1000: # 7->13 90->1000
         return (None, None)
-    if not all(x in CHARSET for x in bech[pos+1:]):
+    data = bech[pos+1:].encode().translate(DECODE_TABLE)
+    if 0xff in data:
         return (None, None)
     hrp = bech[:pos]
-    data = [CHARSET.find(x) for x in bech[pos+1:]]
+    data = list(data)
     if not blech32_verify_checksum(hrp, data):
         return (None, None)
     return (hrp, data[:-12]) # 6->12
 
 
-def convertbits(data, frombits, tobits, pad=True):
-    """General power-of-2 base conversion."""
-    acc = 0
-    bits = 0
-    ret = []
-    maxv = (1 << tobits) - 1
-    max_acc = (1 << (frombits + tobits - 1)) - 1
-    for value in data:
-        if value < 0 or (value >> frombits):
-            return None
-        acc = ((acc << frombits) | value) & max_acc
-        bits += frombits
-        while bits >= tobits:
-            bits -= tobits
-            ret.append((acc >> bits) & maxv)
-    if pad:
-        if bits:
-            ret.append((acc << (tobits - bits)) & maxv)
-    elif bits >= frombits or ((acc << (tobits - bits)) & maxv):
-        return None
-    return ret
-
-
 def decode(hrp, addr):
-    """Decode a segwit address."""
+    """Decode a confidential segwit address.
+
+    The program returned is the blinding pubkey followed by the witness program."""
     hrpgot, data = blech32_decode(addr)
     if hrpgot != hrp:
         return (None, None)
     decoded = convertbits(data[1:], 5, 8, False)
-    if decoded is None or len(decoded) < 2 or len(decoded) > 40:
+    if decoded is None or len(decoded) < BLINDING_KEY_SIZE + 2 or len(decoded) > BLINDING_KEY_SIZE + 40:
         return (None, None)
     if data[0] > 16:
         return (None, None)
-    if data[0] == 0 and len(decoded) != 20 and len(decoded) != 32:
+    if data[0] == 0 and len(decoded) != BLINDING_KEY_SIZE + 20 and len(decoded) != BLINDING_KEY_SIZE + 32:
         return (None, None)
     return (data[0], decoded)
 
 
 def encode(hrp, witver, witprog):
-    """Encode a segwit address."""
+    """Encode a confidential segwit address, witprog being the blinding
+    pubkey followed by the witness program."""
     ret = blech32_encode(hrp, [witver] + convertbits(witprog, 8, 5))
     if decode(hrp, ret) == (None, None):
         return None
     return ret
+
+
+def decode_many(hrp, addrs):
+    """decode() each of addrs."""
+    return [decode(hrp, addr) for addr in addrs]
+
+
+def encode_many(hrp, programs):
+    """encode() each (witver, witprog) pair of programs."""
+    return [encode(hrp, witver, witprog) for witver, witprog in programs]
+
+
+def blech32_polymod_bitwise(values, chk=1):
+    """blech32_polymod() one bit of the generator at a time."""
+    for value in values:
+        top = chk >> 55
+        chk = ((chk & 0x7fffffffffffff) << 5) ^ value
+        for i in range(5):
+            chk ^= BLECH32_GENERATOR[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+class TestFrameworkLiquidAddr(unittest.TestCase):
+    def test_polymod(self):
+        # Every entry of the step tables, as in TestFrameworkSegwitAddr
+        for top in range(1024):
+            chk = top << 50 | 0x123456789
+            self.assertEqual(blech32_polymod([7, 9], chk), blech32_polymod_bitwise([7, 9], chk))
+        for top in range(32):
+            chk = top << 55 | 0x123456789
+            self.assertEqual(blech32_polymod([7], chk), blech32_polymod_bitwise([7], chk))
+        rng = random.Random(0)
+        for length in range(200):
+            values = [rng.randrange(32) for _ in range(length)]
+            self.assertEqual(blech32_polymod(values), blech32_polymod_bitwise(values))
+        self.assertEqual(blech32_hrp_state("el"), blech32_polymod_bitwise(blech32_hrp_expand("el")))
+
+    def test_addresses(self):
+        rng = random.Random(0)
+        blinding_key = bytes([2]) + bytes(rng.randrange(256) for _ in range(32))
+        programs = [(0, blinding_key + bytes(20)), (0, blinding_key + bytes(range(32))), (1, blinding_key + b"\x01\x02"),
+                    (16, blinding_key + bytes(40))]
+        addresses = encode_many("el", programs)
+        self.assertEqual(decode_many("el", addresses), [(witver, list(witprog)) for witver, witprog in programs])
+        self.assertEqual(decode_many("ert", addresses), [(None, None)] * len(addresses))
+        # Wrong program sizes, and a corrupted character
+        self.assertEqual(encode_many("el", [(0, blinding_key + bytes(21)), (17, blinding_key + bytes(20)), (1, blinding_key + bytes(41))]),
+                         [None] * 3)
+        corrupted = addresses[0][:-1] + ("q" if addresses[0][-1] != "q" else "p")
+        self.assertEqual(decode("el", corrupted), (None, None))
@@ -0,0 +1,1058 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Elements developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""In-process implementations of pure-function RPCs.
+
+LocalRPC answers calcfastmerkleroot, tweakfedpegscript,
+decoderawtransaction, createrawtransaction and validateaddress without a
+node, memoizing the results on their arguments. The output matches the
+node's for the chain described by a ChainParams, which defaults to the
+elementsregtest chain as configured by util.initialize_datadir().
+
+Any other method is forwarded to the node the LocalRPC was given, if any.
+With crosscheck set, a seeded random sample of the local answers is also
+requested from that node and compared, so a test can verify the local
+implementations against the real ones (see rpc_localrpc.py).
+
+Only successful calls are compared: local errors are raised as
+JSONRPCException with the node's error codes, but messages for malformed
+argument types may differ."""
+
+from collections import OrderedDict
+import copy
+from decimal import Decimal, InvalidOperation
+import functools
+import hashlib
+import hmac
+from io import BytesIO
+import json
+import os
+import random
+import string
+import struct
+import unittest
+
+from . import liquid_addr, segwit_addr
+from .address import base58_decode, byte_to_base58
+from .authproxy import JSONRPCException
+from .fastmerkle import compute_fast_merkle_root
+from .messages import COIN, COutPoint, CTransaction, CTxIn, CTxOut, CTxOutAsset, CTxOutNonce, hash256, ser_uint256
+from .script import (
+    CScript,
+    CScriptOp,
+    OPCODE_NAMES,
+    OP_0,
+    OP_1,
+    OP_1NEGATE,
+    OP_16,
+    OP_CHECKMULTISIG,
+    OP_CHECKSIG,
+    OP_DUP,
+    OP_ELSE,
+    OP_EQUAL,
+    OP_EQUALVERIFY,
+    OP_HASH160,
+    OP_INVALIDOPCODE,
+    OP_PUSHDATA1,
+    OP_PUSHDATA2,
+    OP_PUSHDATA4,
+    OP_RETURN,
+    OP_SMALLINTEGER,
+    hash160,
+    sha256,
+)
+from .util import calcfastmerkleroot
+
+RPC_MISC_ERROR = -1
+RPC_TYPE_ERROR = -3
+RPC_INVALID_ADDRESS_OR_KEY = -5
+RPC_INVALID_PARAMETER = -8
+RPC_DESERIALIZATION_ERROR = -22
+
+MAX_MONEY = 21000000 * COIN
+MAX_SCRIPT_SIZE = 10000
+SEQUENCE_FINAL = 0xffffffff
+MAX_BIP125_RBF_SEQUENCE = 0xfffffffd
+
+SIGHASH_NAMES = {
+    0x01: "ALL",
+    0x81: "ALL|ANYONECANPAY",
+    0x02: "NONE",
+    0x82: "NONE|ANYONECANPAY",
+    0x03: "SINGLE",
+    0x83: "SINGLE|ANYONECANPAY",
+}
+
+# Opcode names as printed by GetOpName(), which differ from OPCODE_NAMES for
+# small integers and also cover the Elements opcodes
+OP_NAMES = {int(op): name for op, name in OPCODE_NAMES.items() if op < OP_SMALLINTEGER or op == OP_INVALIDOPCODE}
+OP_NAMES.update({OP_0: "0", OP_1NEGATE: "-1"})
+OP_NAMES.update({op: str(op - OP_1 + 1) for op in range(OP_1, OP_16 + 1)})
+OP_NAMES.update({
+    0xc0: "OP_DETERMINISTICRANDOM",
+    0xc1: "OP_CHECKSIGFROMSTACK",
+    0xc2: "OP_CHECKSIGFROMSTACKVERIFY",
+    0xc3: "OP_SUBSTR_LAZY",
+})
+
+SECP256K1_P = 0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffefffffc2f
+SECP256K1_N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+SECP256K1_G = (0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
+               0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8)
+
+def rpc_error(code, message):
+    return JSONRPCException({"code": code, "message": message})
+
+class ChainParams():
+    """Address and asset parameters of a custom chain.
+
+    Keyword arguments override the defaults, which are those of the
+    framework's elementsregtest configuration. from_args() reads them from
+    node arguments ("-fedpegscript=...") or config lines instead."""
+
+    # Node option -> (attribute, type)
+    OPTIONS = {
+        "chain": ("chain", str),
+        "pubkeyprefix": ("pubkey_prefix", int),
+        "scriptprefix": ("script_prefix", int),
+        "blindedprefix": ("blinded_prefix", int),
+        "bech32_hrp": ("bech32_hrp", str),
+        "blech32_hrp": ("blech32_hrp", str),
+        "parentpubkeyprefix": ("parent_pubkey_prefix", int),
+        "parentscriptprefix": ("parent_script_prefix", int),
+        "parent_bech32_hrp": ("parent_bech32_hrp", str),
+        "parent_blech32_hrp": ("parent_blech32_hrp", str),
+        "parentgenesisblockhash": ("parent_genesis_hash", str),
+        "fedpegscript": ("fedpegscript", str),
+        "signblockscript": ("signblockscript", str),
+        "feeasset": ("fee_asset", str),
+        "anyonecanspendaremine": ("anyonecanspendaremine", bool),
+    }
+
+    def __init__(self, **kwargs):
+        self.chain = "elementsregtest"
+        self.pubkey_prefix = 235
+        self.script_prefix = 75
+        self.blinded_prefix = 4
+        self.bech32_hrp = "ert"
+        self.blech32_hrp = "el"
+        self.parent_pubkey_prefix = 111
+        self.parent_script_prefix = 196
+        self.parent_bech32_hrp = "bcrt"
+        self.parent_blech32_hrp = "bcrt"
+        self.parent_genesis_hash = "0f9188f13cb7b2c71f2a335e3a4fc328bf5beb436012afca590b1a11466e2206"
+        self.fedpegscript = "51"
+        self.signblockscript = "51"
+        self.fee_asset = None
+        # The node defaults to 1, initialize_datadir() sets 0
+        self.anyonecanspendaremine = False
+        for name, value in kwargs.items():
+            if not hasattr(self, name):
+                raise TypeError("Unknown chain parameter %s" % name)
+            setattr(self, name, value)
+
+    @classmethod
+    def from_args(cls, args):
+        kwargs = {}
+        for arg in args:
+            name, _, value = arg.lstrip("-").partition("=")
+            if name not in cls.OPTIONS:
+                continue
+            attr, conv = cls.OPTIONS[name]
+            if conv is bool:
+                kwargs[attr] = value in ("", "1")
+            else:
+                kwargs[attr] = conv(value)
+        return cls(**kwargs)
+
+    @classmethod
+    def from_node(cls, node):
+        """The parameters a TestNode runs with: its config file, then its arguments."""
+        with open(os.path.join(node.datadir, "elements.conf"), encoding="utf8") as f:
+            lines = [line.strip() for line in f if not line.startswith(("#", "["))]
+        return cls.from_args(lines + node.args + (node.extra_args or []))
+
+    @property
+    def pegged_asset(self):
+        """The pegged asset id, derived from the chain arguments as in CCustomParams."""
+        commitment = hashlib.sha256((self.chain + self.fedpegscript.lower() + self.signblockscript.lower()).encode()).digest()
+        entropy = compute_fast_merkle_root([hash256(commitment + struct.pack("<I", 0)), bytes.fromhex(self.parent_genesis_hash)[::-1]])
+        return compute_fast_merkle_root([entropy, b"\x00" * 32])[::-1].hex()
+
+    @property
+    def policy_asset(self):
+        return self.fee_asset or self.pegged_asset
+
+# secp256k1 arithmetic, only as much as key validation and tweaking need
+
+def decode_point(data):
+    """Affine point of a serialized public key, or None if
+    secp256k1_ec_pubkey_parse() would reject it."""
+    p = SECP256K1_P
+    if len(data) == 33 and data[0] in (2, 3):
+        x = int.from_bytes(data[1:], "big")
+        if x >= p:
+            return None
+        y2 = (pow(x, 3, p) + 7) % p
+        y = pow(y2, (p + 1) // 4, p)
+        if y * y % p != y2:
+            return None
+        if y & 1 != data[0] & 1:
+            y = p - y
+        return (x, y)
+    if len(data) == 65 and data[0] in (4, 6, 7):
+        x = int.from_bytes(data[1:33], "big")
+        y = int.from_bytes(data[33:], "big")
+        if x >= p or y >= p or (y * y - pow(x, 3, p) - 7) % p:
+            return None
+        # Hybrid keys encode the parity of y in the header
+        if data[0] != 4 and y & 1 != data[0] & 1:
+            return None
+        return (x, y)
+    return None
+
+def is_fully_valid_pubkey(data):
+    return decode_point(data) is not None
+
+def _point_add(a, b):
+    p = SECP256K1_P
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a[0] == b[0]:
+        if (a[1] + b[1]) % p == 0:
+            return None
+        lam = 3 * a[0] * a[0] * pow(2 * a[1], p - 2, p) % p
+    else:
+        lam = (b[1] - a[1]) * pow(b[0] - a[0], p - 2, p) % p
+    x = (lam * lam - a[0] - b[0]) % p
+    return (x, (lam * (a[0] - x) - a[1]) % p)
+
+def _point_mul(k, point):
+    result = None
+    while k:
+        if k & 1:
+            result = _point_add(result, point)
+        point = _point_add(point, point)
+        k >>= 1
+    return result
+
+def tweak_pubkey(pubkey, tweak):
+    """pubkey + tweak*G, compressed, like secp256k1_ec_pubkey_tweak_add()."""
+    t = int.from_bytes(tweak, "big")
+    assert t < SECP256K1_N
+    x, y = _point_add(decode_point(pubkey), _point_mul(t, SECP256K1_G))
+    return bytes([2 + (y & 1)]) + x.to_bytes(32, "big")
+
+# Script inspection, mirroring script/script.cpp and script/standard.cpp
+
+def get_op(script, pc):
+    """Return (opcode, data, next pc) for the op at pc, or None if it is
+    truncated, like GetScriptOp()."""
+    if pc >= len(script):
+        return None
+    opcode = script[pc]
+    pc += 1
+    if opcode > OP_PUSHDATA4:
+        return opcode, b"", pc
+    if opcode < OP_PUSHDATA1:
+        size = opcode
+    else:
+        width = {OP_PUSHDATA1: 1, OP_PUSHDATA2: 2, OP_PUSHDATA4: 4}[opcode]
+        if len(script) - pc < width:
+            return None
+        size = int.from_bytes(script[pc:pc + width], "little")
+        pc += width
+    if len(script) - pc < size:
+        return None
+    return opcode, bytes(script[pc:pc + size]), pc + size
+
+def _is_unspendable(script):
+    return len(script) == 0 or script[0] == OP_RETURN or len(script) > MAX_SCRIPT_SIZE
+
+def _is_push_only(script, pc):
+    while pc < len(script):
+        op = get_op(script, pc)
+        if op is None or op[0] > OP_16:
+            return False
+        pc = op[2]
+    return True
+
+def _scriptnum_to_int(data):
+    if not data:
+        return 0
+    value = int.from_bytes(data, "little")
+    if data[-1] & 0x80:
+        return -(value & ~(0x80 << (8 * (len(data) - 1))))
+    return value
+
+def _is_valid_signature_encoding(sig):
+    """BIP66 strict DER, including the sighash byte (IsValidSignatureEncoding())."""
+    if len(sig) < 9 or len(sig) > 73 or sig[0] != 0x30 or sig[1] != len(sig) - 3:
+        return False
+    len_r = sig[3]
+    if 5 + len_r >= len(sig):
+        return False
+    len_s = sig[5 + len_r]
+    if len_r + len_s + 7 != len(sig) or sig[2] != 0x02 or len_r == 0 or sig[4] & 0x80:
+        return False
+    if len_r > 1 and sig[4] == 0x00 and not sig[5] & 0x80:
+        return False
+    if sig[len_r + 4] != 0x02 or len_s == 0 or sig[len_r + 6] & 0x80:
+        return False
+    return not (len_s > 1 and sig[len_r + 6] == 0x00 and not sig[len_r + 7] & 0x80)
+
+def script_to_asm(script, attempt_sighash_decode=False):
+    """ScriptToAsmStr()"""
+    items = []
+    pc = 0
+    while pc < len(script):
+        op = get_op(script, pc)
+        if op is None:
+            items.append("[error]")
+            break
+        opcode, data, pc = op
+        if opcode > OP_PUSHDATA4:
+            items.append(OP_NAMES.get(opcode, "OP_UNKNOWN"))
+        elif len(data) <= 4:
+            items.append(str(_scriptnum_to_int(data)))
+        elif attempt_sighash_decode and not _is_unspendable(script) and _is_valid_signature_encoding(data) and data[-1] in SIGHASH_NAMES:
+            # Only decode data that looks like a signature, see ScriptToAsmStr()
+            items.append("%s[%s]" % (data[:-1].hex(), SIGHASH_NAMES[data[-1]]))
+        else:
+            items.append(data.hex())
+    return " ".join(items)
+
+def _valid_pubkey_size(data):
+    return len(data) > 0 and {2: 33, 3: 33, 4: 65, 6: 65, 7: 65}.get(data[0]) == len(data)
+
+def _match_multisig(script):
+    if not script or script[-1] != OP_CHECKMULTISIG:
+        return None
+    op = get_op(script, 0)
+    if op is None or not OP_1 <= op[0] <= OP_16:
+        return None
+    required = op[0] - OP_1 + 1
+    pc = op[2]
+    keys = []
+    while True:
+        op = get_op(script, pc)
+        if op is None:
+            opcode = OP_INVALIDOPCODE
+            break
+        opcode, data, pc = op
+        if not _valid_pubkey_size(data):
+            break
+        keys.append(data)
+    if not OP_1 <= opcode <= OP_16 or len(keys) != opcode - OP_1 + 1 or len(keys) < required:
+        return None
+    if pc + 1 != len(script):
+        return None
+    return required, keys
+
+def solver(script, params):
+    """Return the output type of script and its solutions, like Solver()."""
+    if params.anyonecanspendaremine and script == bytes([OP_1]):
+        return "true", []
+    if len(script) == 0:
+        return "fee", []
+    if len(script) == 23 and script[0] == OP_HASH160 and script[1] == 20 and script[22] == OP_EQUAL:
+        return "scripthash", [script[2:22]]
+    if 4 <= len(script) <= 42 and (script[0] == OP_0 or OP_1 <= script[0] <= OP_16) and script[1] + 2 == len(script):
+        version = 0 if script[0] == OP_0 else script[0] - OP_1 + 1
+        program = script[2:]
+        if version == 0 and len(program) == 20:
+            return "witness_v0_keyhash", [program]
+        if version == 0 and len(program) == 32:
+            return "witness_v0_scripthash", [program]
+        if version != 0:
+            return "witness_unknown", [bytes([version]), program]
+        return "nonstandard", []
+    if script[0] == OP_RETURN and _is_push_only(script, 1):
+        return "nulldata", []
+    if len(script) in (35, 67) and script[0] == len(script) - 2 and script[-1] == OP_CHECKSIG and _valid_pubkey_size(script[1:-1]):
+        return "pubkey", [script[1:-1]]
+    if len(script) == 25 and script[:3] == bytes([OP_DUP, OP_HASH160, 20]) and script[23:] == bytes([OP_EQUALVERIFY, OP_CHECKSIG]):
+        return "pubkeyhash", [script[3:23]]
+    multisig = _match_multisig(script)
+    if multisig is not None:
+        return "multisig", [bytes([multisig[0]])] + multisig[1] + [bytes([len(multisig[1])])]
+    return "nonstandard", []
+
+class Destination():
+    """A CTxDestination: kind is "pkh", "sh" or "witness" (version and program)."""
+    __slots__ = ("kind", "version", "program", "blinding_key")
+
+    def __init__(self, kind, program, version=None, blinding_key=b""):
+        self.kind = kind
+        self.version = version
+        self.program = bytes(program)
+        self.blinding_key = bytes(blinding_key)
+
+    def key(self):
+        # Destinations compare without their blinding key
+        return (self.kind, self.version, self.program)
+
+    def is_blinded(self):
+        return is_fully_valid_pubkey(self.blinding_key)
+
+    def unblinded(self):
+        return Destination(self.kind, self.program, self.version)
+
+    def script(self):
+        """GetScriptForDestination()"""
+        if self.kind == "pkh":
+            return CScript([OP_DUP, OP_HASH160, self.program, OP_EQUALVERIFY, OP_CHECKSIG])
+        if self.kind == "sh":
+            return CScript([OP_HASH160, self.program, OP_EQUAL])
+        return CScript([CScriptOp.encode_op_n(self.version), self.program])
+
+    def describe(self):
+        """DescribeAddress() followed by DescribeBlindAddress()"""
+        info = {}
+        if self.kind != "witness" or self.version == 0:
+            info["isscript"] = self.kind == "sh" or (self.kind == "witness" and len(self.program) == 32)
+        info["iswitness"] = self.kind == "witness"
+        if self.kind == "witness":
+            info["witness_version"] = self.version
+            info["witness_program"] = self.program.hex()
+        return info
+
+def extract_destination(script, params):
+    """ExtractDestination(), returning a Destination or None."""
+    kind, solutions = solver(script, params)
+    if kind == "pubkey":
+        if not _valid_pubkey_size(solutions[0]):
+            return None
+        return Destination("pkh", hash160(solutions[0]))
+    if kind == "pubkeyhash":
+        return Destination("pkh", solutions[0])
+    if kind == "scripthash":
+        return Destination("sh", solutions[0])
+    if kind in ("witness_v0_keyhash", "witness_v0_scripthash"):
+        return Destination("witness", solutions[0], 0)
+    if kind == "witness_unknown":
+        return Destination("witness", solutions[1], solutions[0][0])
+    return None
+
+def extract_destinations(script, params):
+    """ExtractDestinations(): (type, destinations, required), destinations
+    being None if no address can be derived."""
+    kind, solutions = solver(script, params)
+    if kind in ("nonstandard", "nulldata"):
+        return kind, None, None
+    if kind == "multisig":
+        destinations = [Destination("pkh", hash160(key)) for key in solutions[1:-1] if _valid_pubkey_size(key)]
+        return kind, destinations or None, solutions[0][0]
+    destination = extract_destination(script, params)
+    return kind, None if destination is None else [destination], 1
+
+def encode_destination(dest, params, for_parent=False):
+    """EncodeDestination(), or EncodeParentDestination() with for_parent."""
+    blinded = dest.is_blinded()
+    if dest.kind in ("pkh", "sh"):
+        if blinded:
+            # The payload of blinded addresses starts with the chain's (not
+            # the parent's) regular prefix, even for parent destinations
+            prefix = params.pubkey_prefix if dest.kind == "pkh" else params.script_prefix
+            return byte_to_base58(bytes([prefix]) + dest.blinding_key + dest.program, params.blinded_prefix)
+        if dest.kind == "pkh":
+            prefix = params.parent_pubkey_prefix if for_parent else params.pubkey_prefix
+        else:
+            prefix = params.parent_script_prefix if for_parent else params.script_prefix
+        return byte_to_base58(dest.program, prefix)
+    if not 0 <= dest.version <= 16 or (dest.version > 0 and not 2 <= len(dest.program) <= 40):
+        return ""
+    if blinded:
+        hrp = params.parent_blech32_hrp if for_parent else params.blech32_hrp
+        return liquid_addr.blech32_encode(hrp, [dest.version] + liquid_addr.convertbits(dest.blinding_key + dest.program, 8, 5))
+    hrp = params.parent_bech32_hrp if for_parent else params.bech32_hrp
+    return segwit_addr.bech32_encode(hrp, [dest.version] + segwit_addr.convertbits(dest.program, 8, 5))
+
+def _witness_destination(version, program, blinding_key=b""):
+    if version == 0:
+        if len(program) in (20, 32):
+            return Destination("witness", program, 0, blinding_key)
+        return None
+    if version > 16 or not 2 <= len(program) <= 40:
+        return None
+    return Destination("witness", program, version, blinding_key)
+
+def decode_destination(address, params, for_parent=False):
+    """DecodeDestination(), returning a Destination or None."""
+    data = base58_decode(address)
+    if data is not None:
+        blinded_size = 1 + 1 + 33 + 20
+        for kind, prefix in (("pkh", params.parent_pubkey_prefix if for_parent else params.pubkey_prefix),
+                             ("sh", params.parent_script_prefix if for_parent else params.script_prefix)):
+            if len(data) == 21 and data[0] == prefix:
+                return Destination(kind, data[1:])
+            if len(data) == blinded_size and data[0] == params.blinded_prefix and data[1] == prefix:
+                blinding_key = data[2:35] if _valid_pubkey_size(data[2:35]) else b""
+                return Destination(kind, data[35:], blinding_key=blinding_key)
+
+    version, program = segwit_addr.decode(params.parent_bech32_hrp if for_parent else params.bech32_hrp, address)
+    if version is not None:
+        return _witness_destination(version, bytes(program))
+
+    # The program of a blech32 address starts with the blinding pubkey
+    version, data = liquid_addr.decode(params.parent_blech32_hrp if for_parent else params.blech32_hrp, address)
+    if version is not None:
+        blinding_key = bytes(data[:33]) if _valid_pubkey_size(data[:33]) else b""
+        return _witness_destination(version, bytes(data[33:]), blinding_key)
+    return None
+
+def witness_script_for(redeem_script, params):
+    """GetScriptForWitness()"""
+    kind, solutions = solver(redeem_script, params)
+    if kind == "pubkey":
+        return CScript([OP_0, hash160(solutions[0])])
+    if kind == "pubkeyhash":
+        return CScript([OP_0, solutions[0]])
+    return CScript([OP_0, sha256(redeem_script)])
+
+def is_pegout_script(script):
+    """IsPegoutScript(): (parent genesis hash, parent scriptPubKey) or None."""
+    op = get_op(script, 0)
+    if op is None or op[0] != OP_RETURN:
+        return None
+    genesis = get_op(script, op[2])
+    if genesis is None or len(genesis[1]) != 32:
+        return None
+    destination = get_op(script, genesis[2])
+    if destination is None or len(destination[1]) == 0:
+        return None
+    return genesis[1], destination[1]
+
+def calculate_contract(fedpegscript, claim_script):
+    """calculate_contract(): tweak each pubkey of the federation script with
+    HMAC-SHA256(pubkey, claim_script)."""
+    ops = []
+    # Only the watchmen template contains OP_ELSE, and its emergency keys
+    # after it are left alone
+    else_found = False
+    pc = 0
+    while True:
+        op = get_op(fedpegscript, pc)
+        if op is None:
+            break
+        opcode, data, pc = op
+        if opcode == OP_ELSE:
+            else_found = True
+        if len(data) == 33 and not else_found:
+            tweak = hmac.new(data, claim_script, hashlib.sha256).digest()
+            ops.append(tweak_pubkey(data, tweak))
+        elif len(data) > 0:
+            ops.append(data)
+        else:
+            ops.append(CScriptOp(opcode))
+    return CScript(ops)
+
+def value_from_amount(amount):
+    """ValueFromAmount(), as a Decimal like AuthServiceProxy returns it."""
+    sign = "-" if amount < 0 else ""
+    return Decimal("%s%d.%08d" % (sign, abs(amount) // COIN, abs(amount) % COIN))
+
+def rangeproof_info(proof):
+    """secp256k1_rangeproof_info(): (exp, mantissa, min_value, max_value) or None."""
+    if len(proof) < 65 or proof[0] & 128:
+        return None
+    uint64_max = (1 << 64) - 1
+    exp = -1
+    mantissa = 0
+    max_value = 0
+    offset = 0
+    if proof[0] & 64:
+        exp = proof[0] & 31
+        offset += 1
+        if exp > 18:
+            return None
+        mantissa = proof[offset] + 1
+        if mantissa > 64:
+            return None
+        max_value = uint64_max >> (64 - mantissa)
+    offset += 1
+    for _ in range(exp):
+        if max_value > uint64_max // 10:
+            return None
+        max_value *= 10
+    min_value = 0
+    if proof[0] & 32:
+        if len(proof) - offset < 8:
+            return None
+        min_value = int.from_bytes(proof[offset:offset + 8], "big")
+    if max_value > uint64_max - min_value:
+        return None
+    return exp, mantissa, min_value, max_value + min_value
+
+def _signed64(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _commitment_hex(vch):
+    # The framework serializes null commitments as a single 0 byte, the node keeps them empty
+    return "" if vch == b"\x00" else vch.hex()
+
+def _is_explicit(vch, size):
+    return len(vch) == size and vch[0] == 1
+
+def _is_hex(s):
+    return isinstance(s, str) and len(s) > 0 and len(s) % 2 == 0 and all(c in string.hexdigits for c in s)
+
+def _parse_hash(value, name):
+    """ParseHashV(), returning the uint256 as an int."""
+    if not isinstance(value, str):
+        raise rpc_error(RPC_MISC_ERROR, "JSON value is not a string as expected")
+    if len(value) != 64:
+        raise rpc_error(RPC_INVALID_PARAMETER, "%s must be of length 64 (not %d, for '%s')" % (name, len(value), value))
+    if not _is_hex(value):
+        raise rpc_error(RPC_INVALID_PARAMETER, "%s must be hexadecimal string (not '%s')" % (name, value))
+    return int(value, 16)
+
+def _parse_hex(value, name):
+    """ParseHexV()"""
+    if not _is_hex(value):
+        raise rpc_error(RPC_INVALID_PARAMETER, "%s must be hexadecimal string (not '%s')" % (name, value if isinstance(value, str) else ""))
+    return bytes.fromhex(value)
+
+def _is_number(value):
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+def _amount_from_value(value):
+    """AmountFromValue()"""
+    if not _is_number(value) and not isinstance(value, str):
+        raise rpc_error(RPC_TYPE_ERROR, "Amount is not a number or string")
+    try:
+        amount = Decimal(str(value)) * COIN
+    except InvalidOperation:
+        raise rpc_error(RPC_TYPE_ERROR, "Invalid amount")
+    if not amount.is_finite() or amount != amount.to_integral_value():
+        raise rpc_error(RPC_TYPE_ERROR, "Invalid amount")
+    if not 0 <= amount <= MAX_MONEY:
+        raise rpc_error(RPC_TYPE_ERROR, "Amount out of range")
+    return int(amount)
+
+# Marks a cache miss, as None may be a cached answer
+_MISSING = object()
+
+def local_rpc(method):
+    """Memoize a LocalRPC method and cross-check it against the node."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def call(self, *args, **kwargs):
+        key = (name, json.dumps([args, kwargs], sort_keys=True, default=str))
+        result = self._cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = method(self, *args, **kwargs)
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        if self.crosscheck and self.node is not None and self._random.random() < self.crosscheck:
+            expected = getattr(self.node, name)(*args, **kwargs)
+            if result != expected:
+                raise AssertionError("Local %s%s differs from the node: %s != %s" % (name, key[1], result, expected))
+        return copy.deepcopy(result)
+    return call
+
+class LocalRPC():
+    """Pure-function RPCs answered in process.
+
+    node, if given, receives all other RPCs and the cross-checked calls;
+    params default to the node's when it is a TestNode; crosscheck is the fraction (0 to 1) of local answers to verify against
+    it, sampled with random.Random(seed)."""
+
+    def __init__(self, node=None, params=None, crosscheck=0, seed=0, cache_size=4096):
+        self.node = node
+        if params is None:
+            params = ChainParams.from_node(node) if hasattr(node, "datadir") else ChainParams()
+        self.params = params
+        self.crosscheck = crosscheck
+        self.cache_size = cache_size
+        self._random = random.Random(seed)
+        self._cache = OrderedDict()
+
+    def __getattr__(self, name):
+        node = self.__dict__.get("node")
+        if name.startswith("_") or node is None:
+            raise AttributeError(name)
+        return getattr(node, name)
+
+    @local_rpc
+    def calcfastmerkleroot(self, leaves):
+        return calcfastmerkleroot(leaves)
+
+    @local_rpc
+    def tweakfedpegscript(self, claim_script):
+        if not _is_hex(claim_script):
+            raise rpc_error(RPC_TYPE_ERROR, "the first argument must be a hex string")
+        tweaked = calculate_contract(bytes.fromhex(self.params.fedpegscript), bytes.fromhex(claim_script))
+        address = Destination("sh", hash160(witness_script_for(tweaked, self.params)))
+        return {
+            "script": tweaked.hex(),
+            "address": encode_destination(address, self.params, for_parent=True),
+        }
+
+    @local_rpc
+    def validateaddress(self, address):
+        if not isinstance(address, str):
+            raise rpc_error(RPC_MISC_ERROR, "JSON value is not a string as expected")
+        dest = decode_destination(address, self.params)
+        parent_dest = decode_destination(address, self.params, for_parent=True)
+        ret = {"isvalid": dest is not None, "isvalid_parent": parent_dest is not None}
+        if dest is not None:
+            ret["address"] = encode_destination(dest, self.params)
+            ret.update(self._describe(dest))
+        if parent_dest is not None:
+            info = {"address": encode_destination(parent_dest, self.params, for_parent=True)}
+            info.update(self._describe(parent_dest))
+            ret["parent_address_info"] = info
+        return ret
+
+    def _describe(self, dest):
+        info = {"scriptPubKey": dest.script().hex()}
+        info.update(dest.describe())
+        # DescribeBlindAddress() encodes the unblinded address for the chain, even for parent addresses
+        if dest.kind != "witness" or dest.version == 0:
+            if dest.is_blinded():
+                info["confidential_key"] = dest.blinding_key.hex()
+            else:
+                info["confidential_key"] = ""
+            info["unconfidential"] = encode_destination(dest.unblinded(), self.params)
+        return info
+
+    @local_rpc
+    def createrawtransaction(self, inputs, outputs, locktime=None, replaceable=None, output_assets=None):
+        """ConstructTransaction()"""
+        if inputs is None or outputs is None:
+            raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter, arguments 1 and 2 must be non-null")
+        if not isinstance(inputs, list):
+            raise rpc_error(RPC_TYPE_ERROR, "Expected type array, got %s" % type(inputs).__name__)
+        if not isinstance(outputs, (list, dict)):
+            raise rpc_error(RPC_MISC_ERROR, "JSON value is not an array as expected")
+        if locktime is not None and not _is_number(locktime):
+            raise rpc_error(RPC_TYPE_ERROR, "Expected type number, got %s" % type(locktime).__name__)
+        if replaceable is not None and not isinstance(replaceable, bool):
+            raise rpc_error(RPC_TYPE_ERROR, "Expected type bool, got %s" % type(replaceable).__name__)
+        if output_assets is not None and not isinstance(output_assets, dict):
+            raise rpc_error(RPC_TYPE_ERROR, "Expected type object, got %s" % type(output_assets).__name__)
+
+        tx = CTransaction()
+        tx.nVersion = 2
+        if locktime is not None:
+            if locktime < 0 or locktime > 0xffffffff:
+                raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter, locktime out of range")
+            tx.nLockTime = int(locktime)
+
+        for txin in inputs:
+            if not isinstance(txin, dict):
+                raise rpc_error(RPC_MISC_ERROR, "JSON value is not an object as expected")
+            txid = _parse_hash(txin.get("txid"), "txid")
+            vout = txin.get("vout")
+            if not _is_number(vout):
+                raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter, missing vout key")
+            if vout < 0:
+                raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter, vout must be positive")
+            if replaceable:
+                sequence = MAX_BIP125_RBF_SEQUENCE
+            elif tx.nLockTime:
+                sequence = SEQUENCE_FINAL - 1
+            else:
+                sequence = SEQUENCE_FINAL
+            if _is_number(txin.get("sequence")):
+                if not 0 <= txin["sequence"] <= SEQUENCE_FINAL:
+                    raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter, sequence number is out of range")
+                sequence = int(txin["sequence"])
+            tx.vin.append(CTxIn(COutPoint(txid, int(vout)), b"", sequence))
+
+        if isinstance(outputs, list):
+            # Translate the array of key-value pairs into a list of items,
+            # keeping repeated keys like the node's UniValue object does
+            pairs = outputs
+            outputs = []
+            for pair in pairs:
+                if not isinstance(pair, dict):
+                    raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter, key-value pair not an object as expected")
+                if len(pair) != 1:
+                    raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter, key-value pair must contain exactly one key")
+                outputs.extend(pair.items())
+        else:
+            outputs = list(outputs.items())
+
+        destinations = set()
+        fee_out = None
+        for name, value in outputs:
+            asset = self.params.policy_asset
+            if output_assets is not None and output_assets.get(name) is not None:
+                asset = "%064x" % _parse_hash(output_assets[name], name)
+            asset = CTxOutAsset(b"\x01" + bytes.fromhex(asset)[::-1])
+
+            if name == "data":
+                tx.vout.append(CTxOut(0, CScript([OP_RETURN, _parse_hex(value, "Data")]), asset, CTxOutNonce()))
+            elif name == "vdata":
+                if not isinstance(value, list):
+                    raise rpc_error(RPC_MISC_ERROR, "JSON value is not an array as expected")
+                script = CScript([OP_RETURN] + [_parse_hex(data, "Data") for data in value])
+                tx.vout.append(CTxOut(0, script, asset, CTxOutNonce()))
+            elif name == "fee":
+                fee_out = CTxOut(_amount_from_value(value), b"", asset, CTxOutNonce())
+            elif name == "burn":
+                tx.vout.append(CTxOut(_amount_from_value(value), CScript([OP_RETURN]), asset, CTxOutNonce()))
+            else:
+                dest = decode_destination(name, self.params)
+                if dest is None:
+                    raise rpc_error(RPC_INVALID_ADDRESS_OR_KEY, "Invalid Bitcoin address: " + name)
+                if dest.key() in destinations:
+                    raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter, duplicated address: " + name)
+                destinations.add(dest.key())
+                nonce = CTxOutNonce(dest.blinding_key if dest.is_blinded() else b"\x00")
+                tx.vout.append(CTxOut(_amount_from_value(value), dest.script(), asset, nonce))
+
+        if fee_out is not None and fee_out.nValue.getAmount() > 0:
+            tx.vout.append(fee_out)
+
+        if replaceable is not None and tx.vin and bool(replaceable) != any(txin.nSequence < SEQUENCE_FINAL - 1 for txin in tx.vin):
+            raise rpc_error(RPC_INVALID_PARAMETER, "Invalid parameter combination: Sequence number(s) contradict replaceable option")
+
+        return tx.serialize().hex()
+
+    @local_rpc
+    def decoderawtransaction(self, hexstring, iswitness=None):
+        """decoderawtransaction, i.e. TxToUniv() without hex"""
+        if not isinstance(hexstring, str):
+            raise rpc_error(RPC_TYPE_ERROR, "Expected type string, got %s" % type(hexstring).__name__)
+        if iswitness is not None and not isinstance(iswitness, bool):
+            raise rpc_error(RPC_TYPE_ERROR, "Expected type bool, got %s" % type(iswitness).__name__)
+        tx = self._deserialize(hexstring)
+        if tx is None:
+            raise rpc_error(RPC_DESERIALIZATION_ERROR, "TX decode failed")
+        return self.tx_to_univ(tx)
+
+    def _deserialize(self, hexstring):
+        # Elements transactions always carry the witness flag byte, so
+        # iswitness does not change how they decode
+        if not _is_hex(hexstring):
+            return None
+        data = bytes.fromhex(hexstring)
+        tx = CTransaction()
+        try:
+            tx.deserialize(BytesIO(data))
+            # Catches truncation, trailing data, non-canonical sizes and
+            # witness records that are all empty, which the node rejects
+            if tx.serialize_with_witness() != data:
+                return None
+        except Exception:
+            return None
+        commitments = [out.nAsset.vchCommitment for out in tx.vout] + [out.nValue.vchCommitment for out in tx.vout]
+        commitments += [out.nNonce.vchCommitment for out in tx.vout]
+        commitments += [txin.assetIssuance.nAmount.vchCommitment for txin in tx.vin]
+        commitments += [txin.assetIssuance.nInflationKeys.vchCommitment for txin in tx.vin]
+        if any(vch[0] == 0xff for vch in commitments):
+            return None
+        return tx
+
+    def tx_to_univ(self, tx):
+        """TxToUniv() of a CTransaction, as decoderawtransaction returns it."""
+        tx.rehash()
+        wtxid = "%064x" % tx.calc_sha256(True)
+        stripped_size = len(tx.serialize_without_witness())
+        size = len(tx.serialize_with_witness())
+        weight = stripped_size * 3 + size
+        entry = {
+            "txid": tx.hash,
+            "hash": wtxid,
+            "wtxid": wtxid,
+            "withash": tx.calc_witness_hash(),
+            "version": tx.nVersion,
+            "size": size,
+            "vsize": (weight + 3) // 4,
+            "weight": weight,
+            "locktime": tx.nLockTime,
+        }
+
+        is_coinbase = len(tx.vin) == 1 and tx.vin[0].prevout.isNull()
+        entry["vin"] = []
+        for i, txin in enumerate(tx.vin):
+            wit = tx.wit.vtxinwit[i] if i < len(tx.wit.vtxinwit) else None
+            info = {}
+            if is_coinbase:
+                info["coinbase"] = txin.scriptSig.hex()
+            else:
+                info["txid"] = "%064x" % txin.prevout.hash
+                info["vout"] = txin.prevout.n
+                info["scriptSig"] = {"asm": script_to_asm(txin.scriptSig, True), "hex": txin.scriptSig.hex()}
+                info["is_pegin"] = txin.m_is_pegin
+            info["sequence"] = txin.nSequence
+            if wit is not None and wit.scriptWitness.stack:
+                info["txinwitness"] = [item.hex() for item in wit.scriptWitness.stack]
+            if wit is not None and wit.peginWitness.stack:
+                info["pegin_witness"] = [item.hex() for item in wit.peginWitness.stack]
+            if not txin.assetIssuance.isNull():
+                info["issuance"] = self._issuance_to_univ(txin)
+            entry["vin"].append(info)
+
+        entry["vout"] = []
+        for i, txout in enumerate(tx.vout):
+            out = {}
+            value = txout.nValue.vchCommitment
+            if _is_explicit(value, 9):
+                out["value"] = value_from_amount(txout.nValue.getAmount())
+            else:
+                info = None
+                if i < len(tx.wit.vtxoutwit):
+                    info = rangeproof_info(tx.wit.vtxoutwit[i].vchRangeproof)
+                if info is not None:
+                    exp, mantissa, min_value, max_value = info
+                    if exp == -1:
+                        out["value"] = value_from_amount(_signed64(min_value))
+                    else:
+                        out["value-minimum"] = value_from_amount(_signed64(min_value))
+                        out["value-maximum"] = value_from_amount(_signed64(max_value))
+                    out["ct-exponent"] = exp
+                    out["ct-bits"] = mantissa
+                out["valuecommitment"] = _commitment_hex(value)
+            asset = txout.nAsset.vchCommitment
+            if _is_explicit(asset, 33):
+                out["asset"] = asset[1:][::-1].hex()
+            else:
+                out["assetcommitment"] = _commitment_hex(asset)
+            out["commitmentnonce"] = _commitment_hex(txout.nNonce.vchCommitment)
+            out["commitmentnonce_fully_valid"] = is_fully_valid_pubkey(txout.nNonce.vchCommitment)
+            out["n"] = i
+            out["scriptPubKey"] = self.script_pubkey_to_univ(txout.scriptPubKey)
+            entry["vout"].append(out)
+        return entry
+
+    def _issuance_to_univ(self, txin):
+        issuance = txin.assetIssuance
+        amount = issuance.nAmount.vchCommitment
+        tokens = issuance.nInflationKeys.vchCommitment
+        info = {"assetBlindingNonce": "%064x" % issuance.assetBlindingNonce}
+        if issuance.assetBlindingNonce == 0:
+            entropy = compute_fast_merkle_root([hash256(txin.prevout.serialize()), ser_uint256(issuance.assetEntropy)])
+            info["assetEntropy"] = entropy[::-1].hex()
+            info["isreissuance"] = False
+            token_tag = 2 if len(amount) == 33 and amount[0] in (8, 9) else 1
+            info["token"] = compute_fast_merkle_root([entropy, bytes([token_tag]) + b"\x00" * 31])[::-1].hex()
+        else:
+            entropy = ser_uint256(issuance.assetEntropy)
+            info["assetEntropy"] = "%064x" % issuance.assetEntropy
+            info["isreissuance"] = True
+        info["asset"] = compute_fast_merkle_root([entropy, b"\x00" * 32])[::-1].hex()
+        for vch, name in ((amount, "assetamount"), (tokens, "tokenamount")):
+            if _is_explicit(vch, 9):
+                info[name] = value_from_amount(int.from_bytes(vch[1:], "big"))
+            elif len(vch) == 33 and vch[0] in (8, 9):
+                info[name + "commitment"] = vch.hex()
+        return info
+
+    def script_pubkey_to_univ(self, script):
+        """ScriptPubKeyToUniv() with hex"""
+        out = self._sidechain_script_to_univ(script, "", False)
+        pegout = is_pegout_script(script)
+        if pegout is not None:
+            out["pegout_chain"] = pegout[0][::-1].hex()
+            out.update(self._sidechain_script_to_univ(pegout[1], "pegout_", True))
+        return out
+
+    def _sidechain_script_to_univ(self, script, prefix, is_parent_chain):
+        out = {prefix + "asm": script_to_asm(script), prefix + "hex": bytes(script).hex()}
+        kind, destinations, required = extract_destinations(script, self.params)
+        if destinations is None:
+            out[prefix + "type"] = kind
+            return out
+        out[prefix + "reqSigs"] = required
+        out[prefix + "type"] = kind
+        out[prefix + "addresses"] = [encode_destination(dest, self.params, is_parent_chain) for dest in destinations]
+        return out
+
+class TestFrameworkLocalRPC(unittest.TestCase):
+    TXID = "%064x" % 0x1234
+
+    class CountingRPC(LocalRPC):
+        calls = 0
+
+        @local_rpc
+        def nothing(self, arg):
+            self.calls += 1
+            return None
+
+    class FakeNode:
+        """Answers createrawtransaction like the node, or wrongly."""
+        def __init__(self, answer):
+            self.answer = answer
+
+        def createrawtransaction(self, *args):
+            return self.answer(*args)
+
+        def getblockcount(self):
+            return 42
+
+    def test_memoization(self):
+        rpc = self.CountingRPC(cache_size=2)
+        self.assertIsNone(rpc.nothing(1))
+        self.assertIsNone(rpc.nothing(1))
+        self.assertEqual(rpc.calls, 1)
+        # Least recently used answers are evicted
+        rpc.nothing(2)
+        rpc.nothing(1)
+        rpc.nothing(3)
+        self.assertEqual(rpc.calls, 3)
+        rpc.nothing(1)
+        self.assertEqual(rpc.calls, 3)
+        rpc.nothing(2)
+        self.assertEqual(rpc.calls, 4)
+
+    def test_chain_params(self):
+        params = ChainParams.from_args(["-pubkeyprefix=111", "bech32_hrp=bcrt", "-anyonecanspendaremine", "-txindex=1"])
+        self.assertEqual(params.pubkey_prefix, 111)
+        self.assertEqual(params.bech32_hrp, "bcrt")
+        self.assertTrue(params.anyonecanspendaremine)
+        self.assertEqual(params.script_prefix, 75)
+        self.assertEqual(ChainParams(fee_asset="ab" * 32).policy_asset, "ab" * 32)
+        self.assertEqual(ChainParams().policy_asset, ChainParams().pegged_asset)
+        with self.assertRaises(TypeError):
+            ChainParams(nonsense=1)
+
+    def test_createrawtransaction(self):
+        rpc = LocalRPC()
+        address = segwit_addr.encode("ert", 0, bytes(range(20)))
+        hex_tx = rpc.createrawtransaction([{"txid": self.TXID, "vout": 1}], [{address: Decimal("1.5")}, {"fee": Decimal("0.001")}], 7)
+        decoded = rpc.decoderawtransaction(hex_tx)
+        self.assertEqual(decoded["locktime"], 7)
+        self.assertEqual([(txin["txid"], txin["vout"], txin["sequence"]) for txin in decoded["vin"]], [(self.TXID, 1, SEQUENCE_FINAL - 1)])
+        self.assertEqual([out["value"] for out in decoded["vout"]], [Decimal("1.5"), Decimal("0.001")])
+        self.assertEqual(decoded["vout"][0]["scriptPubKey"]["addresses"], [address])
+        self.assertEqual(decoded["vout"][1]["scriptPubKey"]["type"], "fee")
+        self.assertTrue(rpc.validateaddress(address)["isvalid"])
+        self.assertFalse(rpc.validateaddress(address[:-1])["isvalid"])
+
+        # Errors carry the node's codes
+        for outputs, code in [({address: -1}, RPC_TYPE_ERROR), ({"nonsense": 1}, RPC_INVALID_ADDRESS_OR_KEY),
+                              ([{address: 1}, {address: 2}], RPC_INVALID_PARAMETER)]:
+            with self.assertRaises(JSONRPCException) as cm:
+                rpc.createrawtransaction([], outputs)
+            self.assertEqual(cm.exception.error["code"], code)
+
+        # The chain parameters select the address format and fee asset
+        with self.assertRaises(JSONRPCException):
+            LocalRPC(params=ChainParams(bech32_hrp="bcrt")).createrawtransaction([], {address: 1})
+        fee_asset = "cd" * 32
+        decoded = rpc.decoderawtransaction(LocalRPC(params=ChainParams(fee_asset=fee_asset)).createrawtransaction([], {"fee": 1}))
+        self.assertEqual(decoded["vout"][0]["asset"], fee_asset)
+
+    def test_crosscheck(self):
+        local = LocalRPC()
+        args = ([{"txid": self.TXID, "vout": 0}], {"fee": 1})
+        expected = local.createrawtransaction(*args)
+        LocalRPC(self.FakeNode(local.createrawtransaction), crosscheck=1).createrawtransaction(*args)
+        wrong = LocalRPC(self.FakeNode(lambda *args: "00"), crosscheck=1)
+        with self.assertRaises(AssertionError):
+            wrong.createrawtransaction(*args)
+        # Without crosscheck the node is not asked, other methods are forwarded to it
+        unchecked = LocalRPC(self.FakeNode(None))
+        self.assertEqual(unchecked.createrawtransaction(*args), expected)
+        self.assertEqual(unchecked.getblockcount(), 42)
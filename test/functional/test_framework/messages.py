@@ -17,17 +17,23 @@ ser_*, deser_*: functions that handle serialization/deserialization.
 
 Classes use __slots__ to ensure extraneous attributes aren't accidentally added
 by tests, compromising their intended effect.
+
+Transaction parts implement __copy__ and __deepcopy__ structurally: copies
+get their own objects and lists, but share the (immutable) bytes they hold,
+such as scripts, commitments and proofs.
 """
 from codecs import encode
 import copy
+import functools
 import hashlib
 from io import BytesIO
 import random
 import socket
 import struct
 import time
+import unittest
 
-from test_framework.siphash import siphash256
+from test_framework.siphash import SipHasher, siphash256
 from test_framework.util import hex_str_to_bytes, bytes_to_hex_str, calcfastmerkleroot, BITCOIN_ASSET_OUT
 
 MIN_VERSION_SUPPORTED = 60001
@@ -183,6 +189,73 @@ def FromHex(obj, hex_string):
 def ToHex(obj):
     return bytes_to_hex_str(obj.serialize())
 
+# Serialization caching
+#
+# While the cache is enabled (see set_serialization_cache), CachedSerializable
+# objects (CTxIn, CTxOut, CTransaction and CBlockHeader) memoize the results of
+# their serialization methods. An object's cache is dropped whenever one of its
+# slots is assigned. In-place changes to nested objects and lists, e.g.
+# tx.vin.append(txin) or tx.vout[0].nValue.setToAmount(n), are not seen: call
+# rehash() (or invalidate_cache()) on the modified object afterwards.
+#
+# Assignments are only tracked while the cache is enabled, so that they cost
+# little otherwise. Caches filled before the cache was last enabled are
+# ignored.
+cache_generation = 0
+
+def set_serialization_cache(enabled):
+    global cache_generation
+    if enabled == CachedSerializable.cache_enabled:
+        return
+    if enabled:
+        cache_generation += 1
+    CachedSerializable.cache_enabled = enabled
+
+def cached_serialization(method):
+    """Memoize a CachedSerializable method on its arguments while the cache is enabled."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        if not CachedSerializable.cache_enabled:
+            return method(self, *args)
+        cache = getattr(self, "_cache", None)
+        if cache is None or cache[None] != cache_generation:
+            cache = {None: cache_generation}
+            object.__setattr__(self, "_cache", cache)
+        key = (name,) + args
+        if key not in cache:
+            cache[key] = method(self, *args)
+        return cache[key]
+    return wrapper
+
+class CachedSerializable:
+    __slots__ = ("_cache",)
+
+    cache_enabled = False
+
+    # Slots that may be assigned without dropping the serialization cache: the
+    # cached hashes, and the cache itself (so that copies keep their cache)
+    cache_exempt_slots = frozenset(("_cache", "hash", "sha256"))
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if CachedSerializable.cache_enabled and name not in self.cache_exempt_slots:
+            object.__setattr__(self, "_cache", None)
+
+    def invalidate_cache(self):
+        object.__setattr__(self, "_cache", None)
+
+    def _copy_cache_to(self, other):
+        cache = getattr(self, "_cache", None)
+        object.__setattr__(other, "_cache", None if cache is None else dict(cache))
+
+def share_or_deepcopy(value, memo):
+    """Return value itself if it is immutable bytes (or a CScript), else a deep copy."""
+    if isinstance(value, bytes):
+        return value
+    return copy.deepcopy(value, memo)
+
 # Objects that map to bitcoind objects, which can be serialized/deserialized
 
 
@@ -292,6 +365,11 @@ class COutPoint:
         r += struct.pack("<I", self.n)
         return r
 
+    def __deepcopy__(self, memo):
+        return COutPoint(self.hash, self.n)
+
+    __copy__ = __deepcopy__
+
     def __repr__(self):
         return "COutPoint(hash=%064x n=%i)" % (self.hash, self.n)
 
@@ -317,7 +395,7 @@ class CAssetIssuance():
         self.nAmount = CTxOutValue()
         self.nAmount.deserialize(f)
         self.nInflationKeys = CTxOutValue()
-        self.nInflatoinKeys.deserialize(f)
+        self.nInflationKeys.deserialize(f)
 
     def serialize(self):
         r = b""
@@ -327,10 +405,18 @@ class CAssetIssuance():
         r += self.nInflationKeys.serialize()
         return r
 
+    def __deepcopy__(self, memo):
+        c = CAssetIssuance.__new__(CAssetIssuance)
+        c.assetBlindingNonce = self.assetBlindingNonce
+        c.assetEntropy = self.assetEntropy
+        c.nAmount = self.nAmount.__deepcopy__(memo)
+        c.nInflationKeys = self.nInflationKeys.__deepcopy__(memo)
+        return c
+
     def __repr__(self):
         return "CAssetIssuance(assetBlindingNonce=%064x assetEntropy=%064x nAmount=%s nInflationKeys=%s)" % (self.assetBlindingNonce, self.assetEntropy, self.nAmount.vchCommitment, self.nInflationKeys.vchCommitment)
 
-class CTxIn:
+class CTxIn(CachedSerializable):
     __slots__ = ("nSequence", "prevout", "scriptSig", "m_is_pegin", "assetIssuance")
 
     def __init__(self, outpoint=None, scriptSig=b"", nSequence=0):
@@ -363,6 +449,7 @@ class CTxIn:
             self.assetIssuance = CAssetIssuance()
             self.assetIssuance.deserialize(f)
 
+    @cached_serialization
     def serialize(self):
         outpoint = COutPoint()
         outpoint.hash = self.prevout.hash
@@ -382,13 +469,31 @@ class CTxIn:
             r += self.assetIssuance.serialize()
         return r
 
+    def __deepcopy__(self, memo):
+        c = CTxIn.__new__(CTxIn)
+        set_slot = object.__setattr__
+        set_slot(c, "prevout", self.prevout.__deepcopy__(memo))
+        set_slot(c, "scriptSig", share_or_deepcopy(self.scriptSig, memo))
+        set_slot(c, "nSequence", self.nSequence)
+        set_slot(c, "m_is_pegin", self.m_is_pegin)
+        set_slot(c, "assetIssuance", self.assetIssuance.__deepcopy__(memo))
+        self._copy_cache_to(c)
+        return c
+
+    def __copy__(self):
+        c = CTxIn.__new__(CTxIn)
+        for name in CTxIn.__slots__:
+            object.__setattr__(c, name, getattr(self, name))
+        self._copy_cache_to(c)
+        return c
+
     def __repr__(self):
         return "CTxIn(prevout=%s scriptSig=%s nSequence=%i m_is_pegin=%s assetIssuance=%s)" \
             % (repr(self.prevout), bytes_to_hex_str(self.scriptSig),
                self.nSequence, self.m_is_pegin, self.assetIssuance)
 
 class CTxOutAsset:
-    __slots__ = ("vchCommitment")
+    __slots__ = ("vchCommitment",)
 
     def __init__(self, vchCommitment=b"\x00"):
         self.vchCommitment = vchCommitment
@@ -419,11 +524,21 @@ class CTxOutAsset:
     #        raise 'invalid asset hash (expected 32 bytes got %d)' % len(val)
     #    self.vchCommitment = b'\x01' + val
 
+    def __copy__(self):
+        c = CTxOutAsset.__new__(CTxOutAsset)
+        c.vchCommitment = self.vchCommitment
+        return c
+
+    def __deepcopy__(self, memo):
+        c = CTxOutAsset.__new__(CTxOutAsset)
+        c.vchCommitment = share_or_deepcopy(self.vchCommitment, memo)
+        return c
+
     def __repr__(self):
         return "CTxOutAsset(vchCommitment=%s)" % self.vchCommitment
 
 class CTxOutValue:
-    __slots__ = ("vchCommitment")
+    __slots__ = ("vchCommitment",)
 
     def __init__(self, value=None):
         self.setNull()
@@ -471,11 +586,21 @@ class CTxOutValue:
             ret |= self.vchCommitment[i+1]
         return ret
 
+    def __copy__(self):
+        c = CTxOutValue.__new__(CTxOutValue)
+        c.vchCommitment = self.vchCommitment
+        return c
+
+    def __deepcopy__(self, memo):
+        c = CTxOutValue.__new__(CTxOutValue)
+        c.vchCommitment = share_or_deepcopy(self.vchCommitment, memo)
+        return c
+
     def __repr__(self):
         return "CTxOutValue(vchCommitment=%s)" % self.vchCommitment
 
 class CTxOutNonce:
-    __slots__ = ("vchCommitment")
+    __slots__ = ("vchCommitment",)
 
     def __init__(self, vchCommitment=b"\x00"):
         self.vchCommitment = vchCommitment
@@ -501,20 +626,30 @@ class CTxOutNonce:
         r += self.vchCommitment
         return r
 
+    def __copy__(self):
+        c = CTxOutNonce.__new__(CTxOutNonce)
+        c.vchCommitment = self.vchCommitment
+        return c
+
+    def __deepcopy__(self, memo):
+        c = CTxOutNonce.__new__(CTxOutNonce)
+        c.vchCommitment = share_or_deepcopy(self.vchCommitment, memo)
+        return c
+
     def __repr__(self):
         return "CTxOutNonce(vchCommitment=%s)" % self.vchCommitment
 
 
-class CTxOut():
+class CTxOut(CachedSerializable):
     __slots__ = ("nValue", "scriptPubKey", "nAsset", "nNonce")
 
-    def __init__(self, nValue=CTxOutValue(), scriptPubKey=b'', nAsset=CTxOutAsset(BITCOIN_ASSET_OUT), nNonce=CTxOutNonce()):
-        self.nAsset = nAsset
-        if type(nValue) is int:
+    def __init__(self, nValue=None, scriptPubKey=b'', nAsset=None, nNonce=None):
+        self.nAsset = CTxOutAsset(BITCOIN_ASSET_OUT) if nAsset is None else nAsset
+        if nValue is None or type(nValue) is int:
             self.nValue = CTxOutValue(nValue)
         else:
             self.nValue = nValue
-        self.nNonce = nNonce
+        self.nNonce = CTxOutNonce() if nNonce is None else nNonce
         self.scriptPubKey = scriptPubKey
 
     def setNull(self):
@@ -535,6 +670,7 @@ class CTxOut():
         self.nNonce.deserialize(f)
         self.scriptPubKey = deser_string(f)
 
+    @cached_serialization
     def serialize(self):
         r = b""
         r += self.nAsset.serialize()
@@ -543,6 +679,16 @@ class CTxOut():
         r += ser_string(self.scriptPubKey)
         return r
 
+    def __deepcopy__(self, memo):
+        c = CTxOut.__new__(CTxOut)
+        set_slot = object.__setattr__
+        set_slot(c, "nAsset", self.nAsset.__deepcopy__(memo))
+        set_slot(c, "nValue", self.nValue.__deepcopy__(memo))
+        set_slot(c, "nNonce", self.nNonce.__deepcopy__(memo))
+        set_slot(c, "scriptPubKey", share_or_deepcopy(self.scriptPubKey, memo))
+        self._copy_cache_to(c)
+        return c
+
     def __repr__(self):
         return "CTxOut(nAsset=%s nValue=%s nNonce=%s scriptPubKey=%s)" \
             % (self.nAsset, self.nValue, self.nNonce, bytes_to_hex_str(self.scriptPubKey))
@@ -555,6 +701,11 @@ class CScriptWitness:
         # stack is a vector of strings
         self.stack = []
 
+    def __deepcopy__(self, memo):
+        c = CScriptWitness.__new__(CScriptWitness)
+        c.stack = [share_or_deepcopy(x, memo) for x in self.stack]
+        return c
+
     def __repr__(self):
         return "CScriptWitness(%s)" % \
                (",".join([bytes_to_hex_str(x) for x in self.stack]))
@@ -598,6 +749,14 @@ class CTxInWitness:
         ]
         return calcfastmerkleroot(leaves)
 
+    def __deepcopy__(self, memo):
+        c = CTxInWitness.__new__(CTxInWitness)
+        c.vchIssuanceAmountRangeproof = share_or_deepcopy(self.vchIssuanceAmountRangeproof, memo)
+        c.vchInflationKeysRangeproof = share_or_deepcopy(self.vchInflationKeysRangeproof, memo)
+        c.scriptWitness = self.scriptWitness.__deepcopy__(memo)
+        c.peginWitness = self.peginWitness.__deepcopy__(memo)
+        return c
+
     def __repr__(self):
         return "CTxInWitness (%s, %s, %s %s)" % (self.vchIssuanceAmountRangeproof,
             self.vchInflationKeysRangeproof, self.scriptWitness, self.peginWitness)
@@ -633,6 +792,12 @@ class CTxOutWitness:
         ]
         return calcfastmerkleroot(leaves)
 
+    def __deepcopy__(self, memo):
+        c = CTxOutWitness.__new__(CTxOutWitness)
+        c.vchSurjectionproof = share_or_deepcopy(self.vchSurjectionproof, memo)
+        c.vchRangeproof = share_or_deepcopy(self.vchRangeproof, memo)
+        return c
+
     def __repr__(self):
         return "CTxOutWitness (%s, %s)" % (self.vchSurjectionproof, self.vchRangeproof)
 
@@ -665,6 +830,12 @@ class CTxWitness:
             r += x.serialize()
         return r
 
+    def __deepcopy__(self, memo):
+        c = CTxWitness.__new__(CTxWitness)
+        c.vtxinwit = [x.__deepcopy__(memo) for x in self.vtxinwit]
+        c.vtxoutwit = [x.__deepcopy__(memo) for x in self.vtxoutwit]
+        return c
+
     def __repr__(self):
         return "CTxWitness([%s], [%s])" % \
                (';'.join([repr(x) for x in self.vtxinwit]),
@@ -680,7 +851,7 @@ class CTxWitness:
         return True
 
 
-class CTransaction:
+class CTransaction(CachedSerializable):
     __slots__ = ("hash", "nLockTime", "nVersion", "sha256", "vin", "vout",
                  "wit")
 
@@ -695,12 +866,15 @@ class CTransaction:
             self.hash = None
         else:
             self.nVersion = tx.nVersion
-            self.vin = copy.deepcopy(tx.vin)
-            self.vout = copy.deepcopy(tx.vout)
+            self.vin = [txin.__deepcopy__({}) for txin in tx.vin]
+            self.vout = [txout.__deepcopy__({}) for txout in tx.vout]
             self.nLockTime = tx.nLockTime
             self.sha256 = tx.sha256
             self.hash = tx.hash
-            self.wit = copy.deepcopy(tx.wit)
+            self.wit = tx.wit.__deepcopy__({})
+
+    def __deepcopy__(self, memo):
+        return CTransaction(self)
 
     def deserialize(self, f):
         self.nVersion = struct.unpack("<i", f.read(4))[0]
@@ -719,6 +893,7 @@ class CTransaction:
         self.hash = None
 
     # Only applicable for non-CT, non-segwit transactions
+    @cached_serialization
     def serialize_without_witness(self):
         r = b""
         r += struct.pack("<i", self.nVersion)
@@ -729,6 +904,7 @@ class CTransaction:
         return r
 
     # Only serialize with witness when explicitly called for
+    @cached_serialization
     def serialize_with_witness(self):
         flags = 0
         if not self.wit.is_null():
@@ -757,20 +933,33 @@ class CTransaction:
         return self.serialize_with_witness()
 
     def rehash(self):
+        self.invalidate_cache()
+        for x in self.vin:
+            x.invalidate_cache()
+        for x in self.vout:
+            x.invalidate_cache()
         self.sha256 = None
         self.calc_sha256()
         return self.hash
 
+    @cached_serialization
+    def calc_hash256(self, with_witness):
+        """Return the txid (or wtxid) bytes, in internal byte order."""
+        if with_witness:
+            return hash256(self.serialize_with_witness())
+        return hash256(self.serialize_without_witness())
+
     # We will only cache the serialization without witness in
     # self.sha256 and self.hash -- those are expected to be the txid.
     def calc_sha256(self, with_witness=False):
         if with_witness:
             # Don't cache the result, just return it
-            return uint256_from_str(hash256(self.serialize_with_witness()))
+            return uint256_from_str(self.calc_hash256(True))
 
+        txid = self.calc_hash256(False)
         if self.sha256 is None:
-            self.sha256 = uint256_from_str(hash256(self.serialize_without_witness()))
-        self.hash = encode(hash256(self.serialize_without_witness())[::-1], 'hex_codec').decode('ascii')
+            self.sha256 = uint256_from_str(txid)
+        self.hash = encode(txid[::-1], 'hex_codec').decode('ascii')
 
     def calc_witness_hash(self):
         leaves = []
@@ -834,7 +1023,7 @@ class CProof:
         return "CProof(challenge=%s solution=%s)" \
             % (self.challenge, self.solution)
 
-class CBlockHeader:
+class CBlockHeader(CachedSerializable):
     __slots__ = ("hash", "hashMerkleRoot", "hashPrevBlock", "nBits", "nNonce",
                  "nTime", "nVersion", "sha256", "block_height", "proof")
 
@@ -872,6 +1061,7 @@ class CBlockHeader:
         self.sha256 = None
         self.hash = None
 
+    @cached_serialization
     def serialize(self):
         r = b""
         r += struct.pack("<i", self.nVersion)
@@ -891,10 +1081,12 @@ class CBlockHeader:
             r += struct.pack("<I", self.nTime)
             r += struct.pack("<I", self.block_height)
             r += self.proof.serialize_for_hash()
-            self.sha256 = uint256_from_str(hash256(r))
-            self.hash = encode(hash256(r)[::-1], 'hex_codec').decode('ascii')
+            h = hash256(r)
+            self.sha256 = uint256_from_str(h)
+            self.hash = encode(h[::-1], 'hex_codec').decode('ascii')
 
     def rehash(self):
+        self.invalidate_cache()
         self.sha256 = None
         self.calc_sha256()
         return self.sha256
@@ -1065,6 +1257,10 @@ def calculate_shortid(k0, k1, tx_hash):
     expected_shortid &= 0x0000ffffffffffff
     return expected_shortid
 
+# calculate_shortid() for each of tx_hashes, sharing the key setup
+def calculate_shortids(k0, k1, tx_hashes):
+    return [h & 0x0000ffffffffffff for h in SipHasher(k0, k1).hash256_many(tx_hashes)]
+
 
 # This version gets rid of the array lengths, and reinterprets the differential
 # encoding into indices that can be used for lookup.
@@ -1120,12 +1316,23 @@ class HeaderAndShortIDs:
         self.shortids = []
         self.use_witness = use_witness
         [k0, k1] = self.get_siphash_keys()
-        for i in range(len(block.vtx)):
-            if i not in prefill_list:
-                tx_hash = block.vtx[i].sha256
-                if use_witness:
-                    tx_hash = block.vtx[i].calc_sha256(with_witness=True)
-                self.shortids.append(calculate_shortid(k0, k1, tx_hash))
+        prefilled = set(prefill_list)
+        tx_hashes = [self._tx_hash(tx) for i, tx in enumerate(block.vtx) if i not in prefilled]
+        self.shortids = calculate_shortids(k0, k1, tx_hashes)
+
+    def _tx_hash(self, tx):
+        if self.use_witness:
+            return tx.calc_sha256(with_witness=True)
+        if tx.sha256 is None:
+            tx.calc_sha256()
+        return tx.sha256
+
+    # Map the shortids that txs would have in this block to the transactions,
+    # to look up the ones announced in shortids
+    def get_shortid_index(self, txs):
+        [k0, k1] = self.get_siphash_keys()
+        shortids = calculate_shortids(k0, k1, [self._tx_hash(tx) for tx in txs])
+        return dict(zip(shortids, txs))
 
     def __repr__(self):
         return "HeaderAndShortIDs(header=%s, nonce=%d, shortids=%s, prefilledtxn=%s" % (repr(self.header), self.nonce, repr(self.shortids), repr(self.prefilled_txn))
@@ -1766,3 +1973,158 @@ class msg_witness_blocktxn(msg_blocktxn):
         r = b""
         r += self.block_transactions.serialize(with_witness=True)
         return r
+
+
+class TestFrameworkMessages(unittest.TestCase):
+    def tearDown(self):
+        set_serialization_cache(False)
+
+    def test_serialization_cache(self):
+        tx = CTransaction()
+        tx.vin.append(CTxIn(COutPoint(1, 0)))
+        tx.vout.append(CTxOut(1000))
+        txid = tx.rehash()
+        serialized = tx.serialize()
+
+        set_serialization_cache(True)
+        # Hit: the same bytes object is returned
+        first = tx.serialize()
+        self.assertEqual(first, serialized)
+        self.assertIs(tx.serialize(), first)
+
+        # Assigning a slot drops the cache
+        tx.nLockTime = 1
+        self.assertNotEqual(tx.serialize(), serialized)
+        self.assertNotEqual(tx.rehash(), txid)
+        tx.nLockTime = 0
+        self.assertEqual(tx.serialize(), serialized)
+        self.assertEqual(tx.rehash(), txid)
+
+        # In-place changes to nested objects are not seen until rehash()
+        tx.vout[0].nValue.setToAmount(2000)
+        self.assertEqual(tx.serialize(), serialized)
+        self.assertNotEqual(tx.rehash(), txid)
+        self.assertNotEqual(tx.serialize(), serialized)
+
+    def test_serialization_cache_disabled(self):
+        header = CBlockHeader()
+        set_serialization_cache(True)
+        serialized = header.serialize()
+        set_serialization_cache(False)
+        self.assertFalse(CachedSerializable.cache_enabled)
+        header.nTime = 1
+        self.assertNotEqual(header.serialize(), serialized)
+
+        # Caches from before the cache was last enabled are not used, even
+        # though assignments were not tracked in between
+        set_serialization_cache(True)
+        self.assertNotEqual(header.serialize(), serialized)
+
+    def _make_tx(self):
+        tx = CTransaction()
+        for i in range(3):
+            tx.vin.append(CTxIn(COutPoint(i + 1, i), b"\x51\x52", 0xfffffffe - i))
+        for i in range(2):
+            tx.vout.append(CTxOut((i + 1) * 1000, b"\x76\xa9" + bytes([i]) * 20))
+        tx.wit.vtxinwit = [CTxInWitness() for _ in tx.vin]
+        tx.wit.vtxinwit[0].scriptWitness.stack = [b"\x01" * 72, b"\x02" * 33]
+        tx.nLockTime = 42
+        tx.rehash()
+        return tx
+
+    def test_signature_hash(self):
+        # script imports this module, so it can't be imported at the top
+        from test_framework.script import (
+            CScript, FindAndDelete, OP_CHECKSIG, OP_CODESEPARATOR, SignatureHash,
+            SIGHASH_ALL, SIGHASH_ANYONECANPAY, SIGHASH_NONE, SIGHASH_SINGLE,
+        )
+
+        def full_copy_signature_hash(script, txTo, inIdx, hashtype):
+            """SignatureHash working on a full CTransaction(txTo) copy."""
+            txtmp = CTransaction(txTo)
+            for txin in txtmp.vin:
+                txin.scriptSig = b''
+            txtmp.vin[inIdx].scriptSig = FindAndDelete(script, CScript([OP_CODESEPARATOR]))
+            if (hashtype & 0x1f) == SIGHASH_NONE:
+                txtmp.vout = []
+                for i in range(len(txtmp.vin)):
+                    if i != inIdx:
+                        txtmp.vin[i].nSequence = 0
+            elif (hashtype & 0x1f) == SIGHASH_SINGLE:
+                if inIdx >= len(txtmp.vout):
+                    return None
+                txtmp.vout = [CTxOut(-1) for _ in range(inIdx)] + [txtmp.vout[inIdx]]
+                for i in range(len(txtmp.vin)):
+                    if i != inIdx:
+                        txtmp.vin[i].nSequence = 0
+            if hashtype & SIGHASH_ANYONECANPAY:
+                txtmp.vin = [txtmp.vin[inIdx]]
+            s = struct.pack("<i", txtmp.nVersion)
+            s += ser_vector(txtmp.vin)
+            s += ser_vector(txtmp.vout)
+            s += struct.pack("<I", txtmp.nLockTime)
+            s += struct.pack("<I", hashtype)
+            return hash256(s)
+
+        tx = self._make_tx()
+        serialized = tx.serialize()
+        script = CScript([b"\x03" * 33, OP_CODESEPARATOR, OP_CHECKSIG])
+        for base in (SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE):
+            for hashtype in (base, base | SIGHASH_ANYONECANPAY):
+                for inIdx in range(len(tx.vin)):
+                    sighash, err = SignatureHash(script, tx, inIdx, hashtype)
+                    expected = full_copy_signature_hash(script, tx, inIdx, hashtype)
+                    if expected is None:
+                        self.assertIsNotNone(err)
+                    else:
+                        self.assertIsNone(err)
+                        self.assertEqual(sighash, expected)
+        # The transaction signed is left alone
+        self.assertEqual(tx.serialize(), serialized)
+        self.assertEqual([txin.scriptSig for txin in tx.vin], [b"\x51\x52"] * 3)
+
+    def test_deepcopy(self):
+        tx = self._make_tx()
+        serialized = tx.serialize()
+        for c in (copy.deepcopy(tx), CTransaction(tx)):
+            self.assertEqual(c.serialize(), serialized)
+            c.vin[0].prevout.n = 9
+            c.vin[1].scriptSig = b""
+            c.vout[0].nValue.setToAmount(5)
+            c.vout[1].nAsset.vchCommitment = b"\x01" + b"\x22" * 32
+            c.vout[1].nNonce.vchCommitment = b"\x02" + b"\x33" * 32
+            c.wit.vtxinwit[0].scriptWitness.stack[0] = b""
+            c.wit.vtxinwit[0].scriptWitness.stack.append(b"\x04")
+            c.rehash()
+            self.assertNotEqual(c.serialize(), serialized)
+            self.assertEqual(tx.serialize(), serialized)
+
+    def test_default_txout_fields_not_shared(self):
+        a = CTxOut()
+        b = CTxOut()
+        self.assertIsNot(a.nValue, b.nValue)
+        self.assertIsNot(a.nAsset, b.nAsset)
+        self.assertIsNot(a.nNonce, b.nNonce)
+        a.nValue.setToAmount(1)
+        a.nAsset.setNull()
+        a.nNonce.vchCommitment = b"\x02" + b"\x33" * 32
+        self.assertTrue(b.nValue.isNull())
+        self.assertEqual(b.nAsset.vchCommitment, CTxOut().nAsset.vchCommitment)
+        self.assertEqual(b.nNonce.vchCommitment, CTxOut().nNonce.vchCommitment)
+
+    def test_get_shortid_index(self):
+        block = CBlock()
+        for i in range(4):
+            tx = self._make_tx()
+            tx.nLockTime = i
+            tx.rehash()
+            block.vtx.append(tx)
+        for use_witness in (False, True):
+            comp_block = HeaderAndShortIDs()
+            comp_block.initialize_from_block(block, nonce=7, prefill_list=[0, 2], use_witness=use_witness)
+            shortid_index = comp_block.get_shortid_index(block.vtx)
+            self.assertEqual(len(shortid_index), len(block.vtx))
+            self.assertEqual([shortid_index[s] for s in comp_block.shortids], [block.vtx[1], block.vtx[3]])
+            # The index only resolves the shortids of this block's keys
+            comp_block.nonce = 8
+            self.assertNotIn(comp_block.shortids[0], comp_block.get_shortid_index(block.vtx))
@@ -82,6 +82,10 @@ MESSAGEMAP = {
     b"version": msg_version,
 }
 
+# command (12 bytes), payload length, checksum (4 bytes), after the magic bytes
+MSG_HEADER = struct.Struct("<12sI4s")
+MSG_HEADER_SIZE = 4 + MSG_HEADER.size
+
 MAGIC_BYTES = {
     "mainnet": b"\xf9\xbe\xb4\xd9",   # mainnet
     "testnet3": b"\x0b\x11\x09\x07",  # testnet3
@@ -117,7 +121,7 @@ class P2PConnection(asyncio.Protocol):
         self.dstport = dstport
         # The initial message to send after the connection was made:
         self.on_connection_send_msg = None
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
         self.network = net
         logger.debug('Connecting to Bitcoin Node: %s:%d' % (self.dstaddr, self.dstport))
 
@@ -136,7 +140,9 @@ class P2PConnection(asyncio.Protocol):
         """asyncio callback when a connection is opened."""
         assert not self._transport
         logger.debug("Connected & Listening: %s:%d" % (self.dstaddr, self.dstport))
-        self._transport = transport
+        with mininode_lock:
+            self._transport = transport
+            mininode_lock.notify_all()
         if self.on_connection_send_msg:
             self.send_message(self.on_connection_send_msg)
             self.on_connection_send_msg = None  # Never used again
@@ -148,8 +154,10 @@ class P2PConnection(asyncio.Protocol):
             logger.warning("Connection lost to {}:{} due to {}".format(self.dstaddr, self.dstport, exc))
         else:
             logger.debug("Closed connection to: %s:%d" % (self.dstaddr, self.dstport))
-        self._transport = None
-        self.recvbuf = b""
+        with mininode_lock:
+            self._transport = None
+            mininode_lock.notify_all()
+        self.recvbuf = bytearray()
         self.on_close()
 
     # Socket read methods
@@ -165,29 +173,35 @@ class P2PConnection(asyncio.Protocol):
 
         This method reads data from the buffer in a loop. It deserializes,
         parses and verifies the P2P header, then passes the P2P payload to
-        the on_message callback for processing."""
+        the on_message callback for processing.
+
+        Headers are parsed in place and the read position is tracked with a
+        cursor; consumed bytes are only dropped from the front of the buffer
+        once per call, so bursts of messages are not copied repeatedly."""
+        buf = self.recvbuf
+        pos = 0
         try:
             while True:
-                if len(self.recvbuf) < 4:
+                if len(buf) - pos < 4:
                     return
-                if self.recvbuf[:4] != MAGIC_BYTES[self.network]:
-                    raise ValueError("got garbage %s" % repr(self.recvbuf))
-                if len(self.recvbuf) < 4 + 12 + 4 + 4:
+                if buf[pos:pos+4] != MAGIC_BYTES[self.network]:
+                    raise ValueError("got garbage %s" % repr(buf[pos:]))
+                if len(buf) - pos < MSG_HEADER_SIZE:
                     return
-                command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
-                checksum = self.recvbuf[4+12+4:4+12+4+4]
-                if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
+                command, msglen, checksum = MSG_HEADER.unpack_from(buf, pos + 4)
+                command = command.split(b"\x00", 1)[0]
+                payload_start = pos + MSG_HEADER_SIZE
+                payload_end = payload_start + msglen
+                if len(buf) < payload_end:
                     return
-                msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
-                th = sha256(msg)
-                h = sha256(th)
-                if checksum != h[:4]:
-                    raise ValueError("got bad checksum " + repr(self.recvbuf))
-                self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
-                if command not in MESSAGEMAP:
-                    raise ValueError("Received unknown command from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, command, repr(msg)))
-                f = BytesIO(msg)
+                with memoryview(buf) as view, view[payload_start:payload_end] as msg:
+                    h = sha256(sha256(msg))
+                    if checksum != h[:4]:
+                        raise ValueError("got bad checksum " + repr(buf[pos:]))
+                    if command not in MESSAGEMAP:
+                        raise ValueError("Received unknown command from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, command, repr(bytes(msg))))
+                    f = BytesIO(msg)
+                pos = payload_end
                 t = MESSAGEMAP[command]()
                 t.deserialize(f)
                 self._log_message("receive", t)
@@ -195,6 +209,10 @@ class P2PConnection(asyncio.Protocol):
         except Exception as e:
             logger.exception('Error reading message:', repr(e))
             raise
+        finally:
+            # on_message may have closed the connection and replaced recvbuf
+            if pos and buf is self.recvbuf:
+                del buf[:pos]
 
     def on_message(self, message):
         """Callback for processing a P2P payload. Must be overridden by derived class."""
@@ -308,6 +326,9 @@ class P2PInterface(P2PConnection):
             except:
                 print("ERROR delivering %s (%s)" % (repr(message), sys.exc_info()[0]))
                 raise
+            finally:
+                # Wake up the wait_until() calls waiting on this message
+                mininode_lock.notify_all()
 
     # Callback methods. Can be overridden by subclasses in individual test
     # cases to provide custom message handling behaviour.
@@ -429,7 +450,11 @@ class P2PInterface(P2PConnection):
 # P2PConnection acquires this lock whenever delivering a message to a P2PInterface.
 # This lock should be acquired in the thread running the test logic to synchronize
 # access to any data shared with the P2PInterface or P2PConnection.
-mininode_lock = threading.RLock()
+#
+# It is also a condition variable, notified after every message delivered to a
+# P2PInterface and on every connection and disconnection, so that wait_until()
+# with lock=mininode_lock returns as soon as the awaited message has arrived.
+mininode_lock = threading.Condition(threading.RLock())
 
 
 class NetworkThread(threading.Thread):
@@ -446,6 +471,11 @@ class NetworkThread(threading.Thread):
         """Start the network thread."""
         self.network_event_loop.run_forever()
 
+    @classmethod
+    def run_coroutine(cls, coro):
+        """Run a coroutine on the network event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, cls.network_event_loop).result()
+
     def close(self, timeout=10):
         """Close the connections and network event loop."""
         self.network_event_loop.call_soon_threadsafe(self.network_event_loop.stop)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Elements developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Block and transaction notifications for the sync helpers.
+
+SyncNotifier lets sync_blocks and sync_mempools sleep until one of the
+nodes reports a change, instead of for a fixed interval. It is set up for
+tests that set sync_notifications in set_test_params. Nodes publish
+hashblock and hashtx over ZMQ when both bitcoind and python3-zmq support
+it. Otherwise (POSIX only) they write block hashes to a FIFO via
+-blocknotify, which covers blocks but not the mempool, and forks a shell
+for every block.
+
+Notifications only wake the waiters up; the sync helpers still compare
+the nodes' state over RPC, so a missed or spurious notification costs at
+most one polling interval."""
+
+import os
+import select
+import tempfile
+import threading
+
+from .util import zmq_port
+
+class SyncNotifier():
+    def __init__(self, use_zmq):
+        self.use_zmq = use_zmq
+        self.fifo_path = None
+        self._fifo = None
+        # Number of notifications received, and seen by wait()
+        self._received = 0
+        self._seen = 0
+        self._cond = threading.Condition()
+        self._stop = False
+
+        if use_zmq:
+            import zmq
+            self._zmq_context = zmq.Context()
+            self._socket = self._zmq_context.socket(zmq.SUB)
+            self._socket.setsockopt(zmq.SUBSCRIBE, b"hashblock")
+            self._socket.setsockopt(zmq.SUBSCRIBE, b"hashtx")
+            self._zmq_addresses = []
+        else:
+            self._dir = tempfile.mkdtemp(prefix="syncnotify")
+            self.fifo_path = os.path.join(self._dir, "blocknotify")
+            os.mkfifo(self.fifo_path)
+            self._fifo = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+            # Keep a writer open, so the reader never sees EOF between notifications
+            self._fifo_writer = os.open(self.fifo_path, os.O_WRONLY)
+
+        self._thread = threading.Thread(target=self._run, name="SyncNotifier", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def is_available(zmq_compiled):
+        """Whether notifications can be received, and if so, over ZMQ."""
+        if zmq_compiled:
+            try:
+                import zmq  # noqa
+                return True, True
+            except ImportError:
+                pass
+        return hasattr(os, "mkfifo"), False
+
+    def node_args(self, n, extra_args):
+        """Arguments for node n to send notifications, unless the test configures them itself."""
+        if any(arg.startswith(("-zmqpubhashblock", "-zmqpubhashtx", "-blocknotify")) for arg in extra_args):
+            return []
+        if self.use_zmq:
+            address = "tcp://127.0.0.1:%d" % zmq_port(n)
+            # ZMQ sockets aren't thread-safe, the reader thread connects it
+            with self._cond:
+                self._zmq_addresses.append(address)
+            return ["-zmqpubhashblock=%s" % address, "-zmqpubhashtx=%s" % address]
+        return ["-blocknotify=echo %%s > %s" % self.fifo_path]
+
+    def _run(self):
+        if self.use_zmq:
+            import zmq
+            poller = zmq.Poller()
+            poller.register(self._socket, zmq.POLLIN)
+        while not self._stop:
+            received = 0
+            if self.use_zmq:
+                with self._cond:
+                    addresses, self._zmq_addresses = self._zmq_addresses, []
+                for address in addresses:
+                    self._socket.connect(address)
+                if poller.poll(100):
+                    while self._socket.poll(0):
+                        self._socket.recv_multipart()
+                        received += 1
+            elif select.select([self._fifo], [], [], 0.1)[0]:
+                received = len(os.read(self._fifo, 65536))
+            if received:
+                with self._cond:
+                    self._received += 1
+                    self._cond.notify_all()
+
+    def wait(self, timeout):
+        """Wait until a notification arrives that wasn't seen yet, or timeout.
+
+        Notifications received since the previous call count, so nothing is
+        lost between polling the nodes and calling wait()."""
+        with self._cond:
+            if self._received == self._seen:
+                self._cond.wait(timeout)
+            self._seen = self._received
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        if self.use_zmq:
+            self._socket.close()
+            self._zmq_context.destroy(linger=0)
+        else:
+            os.close(self._fifo_writer)
+            os.close(self._fifo)
+            os.unlink(self.fifo_path)
+            os.rmdir(self._dir)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Elements developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Generate peg-in claims in bulk, and measure how the sidechain takes them.
+
+PeginWorkload makes many deposits to peg-in addresses of the sidechain's
+wallet with sendmany on the parent chain, so they land in a few parent
+transactions and blocks, and fetches their transactions and merkle proofs
+with one JSON-RPC batch. The claims are built and signed by the sidechain
+wallet in batches (createrawpegin and signrawtransactionwithwallet), then
+submitted concurrently with sendrawtransaction, timing each submission.
+That time is dominated by peg-in validation, which includes looking up the
+deposit on the parent chain when -validatepegin is set."""
+
+import asyncio
+from collections import Counter, namedtuple
+import time
+
+from .authproxy import JSONRPCException
+from .mininode import NetworkThread
+
+# A deposit to claim_script's peg-in address, made in the parent transaction
+# raw_tx, which proof shows to be in a block
+Deposit = namedtuple("Deposit", ["claim_script", "raw_tx", "proof"])
+
+# Deposits paid by each parent transaction
+DEPOSITS_PER_TX = 250
+# Parent transactions mined per block, staying well below the mempool
+# ancestor limits on the wallet's change
+TXS_PER_BLOCK = 10
+# Calls per JSON-RPC batch, and batches in flight at once
+BATCH_SIZE = 100
+MAX_PARALLEL_BATCHES = 4
+
+def _results(responses):
+    """Results of a JSON-RPC batch, raising the first error."""
+    for response in responses:
+        if response["error"] is not None:
+            raise JSONRPCException(response["error"])
+    return [response["result"] for response in responses]
+
+class PeginResult():
+    """Outcome of submitting a set of claims."""
+
+    def __init__(self):
+        self.txids = []
+        # Seconds taken by sendrawtransaction, for each claim
+        self.latencies = []
+        # Number of claims rejected, by reason
+        self.rejections = Counter()
+
+    @property
+    def submitted(self):
+        return len(self.latencies)
+
+    @property
+    def acceptance_rate(self):
+        return len(self.txids) / self.submitted
+
+    def latency_percentile(self, percentile):
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)]
+
+class PeginWorkload():
+    """Peg-ins from the wallet of parent to the wallet of sidechain."""
+
+    def __init__(self, parent, sidechain, *, pegin_confirmation_depth=10):
+        self.parent = parent
+        self.sidechain = sidechain
+        self.pegin_confirmation_depth = pegin_confirmation_depth
+
+    def deposit(self, count, amount):
+        """Make count deposits of amount, and mine them deep enough to be
+        claimed. Returns the Deposits."""
+        addresses = _results(self.sidechain.batch([self.sidechain.getpeginaddress.get_request() for _ in range(count)]))
+        txids = []
+        for start in range(0, count, DEPOSITS_PER_TX):
+            outputs = {a["mainchain_address"]: amount for a in addresses[start:start + DEPOSITS_PER_TX]}
+            txids.append(self.parent.sendmany("", outputs))
+            if len(txids) % TXS_PER_BLOCK == 0:
+                self.parent.generate(1)
+        if len(txids) % TXS_PER_BLOCK:
+            self.parent.generate(1)
+        # The deposit blocks give the first confirmation
+        self.parent.generate(self.pegin_confirmation_depth - 1)
+
+        raw_txs = [r["hex"] for r in _results(self.parent.batch([self.parent.gettransaction.get_request(txid) for txid in txids]))]
+        proofs = _results(self.parent.batch([self.parent.gettxoutproof.get_request([txid]) for txid in txids]))
+        return [Deposit(a["claim_script"], raw_txs[i // DEPOSITS_PER_TX], proofs[i // DEPOSITS_PER_TX])
+                for i, a in enumerate(addresses)]
+
+    def create_claims(self, deposits):
+        """Signed peg-in transactions claiming deposits, as hex."""
+        requests = [self.sidechain.createrawpegin.get_request(d.raw_tx, d.proof, d.claim_script) for d in deposits]
+        raw_claims = _results(self.sidechain.batch(requests, BATCH_SIZE, MAX_PARALLEL_BATCHES))
+        requests = [self.sidechain.signrawtransactionwithwallet.get_request(c["hex"]) for c in raw_claims]
+        signed = _results(self.sidechain.batch(requests, BATCH_SIZE, MAX_PARALLEL_BATCHES))
+        assert all(s["complete"] for s in signed)
+        return [s["hex"] for s in signed]
+
+    def submit(self, claims, *, concurrency=8):
+        """Submit the claims, up to concurrency at once. Returns a PeginResult."""
+        return NetworkThread.run_coroutine(self.submit_async(claims, concurrency=concurrency))
+
+    async def submit_async(self, claims, *, concurrency=8):
+        result = PeginResult()
+        semaphore = asyncio.Semaphore(concurrency)
+        rpc = self.sidechain.async_rpc
+
+        async def send(claim):
+            async with semaphore:
+                start = time.time()
+                try:
+                    result.txids.append(await rpc.sendrawtransaction(claim))
+                except JSONRPCException as e:
+                    result.rejections[e.error["message"]] += 1
+                result.latencies.append(time.time() - start)
+
+        await asyncio.gather(*(send(claim) for claim in claims))
+        return result
+
+    def claim(self, deposits, *, concurrency=8):
+        """Create, sign and submit claims for deposits. Returns a PeginResult."""
+        return self.submit(self.create_claims(deposits), concurrency=concurrency)
@@ -7,9 +7,10 @@
 This file is modified from python-bitcoinlib.
 """
 
-from .messages import CTransaction, CTxOut, sha256, hash256, uint256_from_str, ser_uint256, ser_string, ser_vector
+from .messages import CTransaction, CTxOut, sha256, hash256, ser_string, ser_vector
 
 from binascii import hexlify
+import copy
 import hashlib
 import struct
 
@@ -620,7 +621,12 @@ def SignatureHash(script, txTo, inIdx, hashtype):
 
     if inIdx >= len(txTo.vin):
         return (HASH_ONE, "inIdx %d out of range (%d)" % (inIdx, len(txTo.vin)))
-    txtmp = CTransaction(txTo)
+    # Only the inputs get modified, so the outputs and witness aren't copied
+    txtmp = CTransaction()
+    txtmp.nVersion = txTo.nVersion
+    txtmp.vin = [copy.copy(txin) for txin in txTo.vin]
+    txtmp.vout = list(txTo.vout)
+    txtmp.nLockTime = txTo.nLockTime
 
     for txin in txtmp.vin:
         txin.scriptSig = b''
@@ -668,56 +674,85 @@ def SignatureHash(script, txTo, inIdx, hashtype):
 
     return (hash, None)
 
-# TODO: Allow cached hashPrevouts/hashSequence/hashOutputs to be provided.
-# Performance optimization probably not necessary for python tests, however.
+class PrecomputedTransactionData:
+    """Per-transaction midstates for SegwitVersion1SignatureHash.
+
+    Mirrors PrecomputedTransactionData in src/script/interpreter.h: the
+    prevouts, sequences, issuances and outputs of txTo are hashed once, so
+    signing every input of a transaction costs O(N) instead of O(N^2).
+    The transaction must not be modified while the cache is in use."""
+    __slots__ = ("hashPrevouts", "hashSequence", "hashIssuance", "hashOutputs")
+
+    def __init__(self, txTo):
+        self.hashPrevouts = hash256(b"".join(i.prevout.serialize() for i in txTo.vin))
+        self.hashSequence = hash256(b"".join(struct.pack("<I", i.nSequence) for i in txTo.vin))
+        self.hashIssuance = hash256(serialize_issuances(txTo))
+        self.hashOutputs = hash256(b"".join(o.serialize() for o in txTo.vout))
+
+def serialize_issuance(txin):
+    """Serialize an input's asset issuance as committed to by the segwit sighash."""
+    if txin.assetIssuance.isNull():
+        return b'\x00'
+    return txin.assetIssuance.serialize()
+
+def serialize_issuances(txTo):
+    return b"".join(serialize_issuance(i) for i in txTo.vin)
+
 # Note that this corresponds to sigversion == 1 in EvalScript, which is used
 # for version 0 witnesses.
-def SegwitVersion1SignatureHash(script, txTo, inIdx, hashtype, amount):
+def SegwitVersion1SignatureHash(script, txTo, inIdx, hashtype, amount, cache=None):
+    """Segwit v0 signature hash of input inIdx of txTo.
 
-    hashPrevouts = 0
-    hashSequence = 0
-    hashIssuance = 0
-    hashOutputs = 0
+    cache may be a PrecomputedTransactionData for txTo, to avoid rehashing
+    the prevouts, sequences, issuances and outputs for every input."""
+    if cache is None:
+        cache = PrecomputedTransactionData(txTo)
+
+    hashPrevouts = b'\x00' * 32
+    hashSequence = b'\x00' * 32
+    hashIssuance = b'\x00' * 32
+    hashOutputs = b'\x00' * 32
 
     if not (hashtype & SIGHASH_ANYONECANPAY):
-        serialize_prevouts = bytes()
-        for i in txTo.vin:
-            serialize_prevouts += i.prevout.serialize()
-        hashPrevouts = uint256_from_str(hash256(serialize_prevouts))
+        hashPrevouts = cache.hashPrevouts
+        hashIssuance = cache.hashIssuance
 
     if (not (hashtype & SIGHASH_ANYONECANPAY) and (hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_sequence = bytes()
-        for i in txTo.vin:
-            serialize_sequence += struct.pack("<I", i.nSequence)
-        hashSequence = uint256_from_str(hash256(serialize_sequence))
-
-    if not (hashtype & SIGHASH_ANYONECANPAY):
-        serialize_issuance = bytes()
-        # TODO actually serialize issuances
-        for _ in txTo.vin:
-            serialize_issuance += b'\x00'
-        hashIssuance = uint256_from_str(hash256(serialize_issuance))
+        hashSequence = cache.hashSequence
 
     if ((hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_outputs = bytes()
-        for o in txTo.vout:
-            serialize_outputs += o.serialize()
-        hashOutputs = uint256_from_str(hash256(serialize_outputs))
+        hashOutputs = cache.hashOutputs
     elif ((hashtype & 0x1f) == SIGHASH_SINGLE and inIdx < len(txTo.vout)):
         serialize_outputs = txTo.vout[inIdx].serialize()
-        hashOutputs = uint256_from_str(hash256(serialize_outputs))
+        hashOutputs = hash256(serialize_outputs)
 
+    txin = txTo.vin[inIdx]
     ss = bytes()
     ss += struct.pack("<i", txTo.nVersion)
-    ss += ser_uint256(hashPrevouts)
-    ss += ser_uint256(hashSequence)
-    ss += ser_uint256(hashIssuance)
-    ss += txTo.vin[inIdx].prevout.serialize()
+    ss += hashPrevouts
+    ss += hashSequence
+    ss += hashIssuance
+    ss += txin.prevout.serialize()
     ss += ser_string(script)
     ss += amount.serialize()
-    ss += struct.pack("<I", txTo.vin[inIdx].nSequence)
-    ss += ser_uint256(hashOutputs)
+    ss += struct.pack("<I", txin.nSequence)
+    if not txin.assetIssuance.isNull():
+        ss += txin.assetIssuance.serialize()
+    ss += hashOutputs
     ss += struct.pack("<i", txTo.nLockTime)
     ss += struct.pack("<I", hashtype)
 
     return hash256(ss)
+
+def sign_all_inputs(txTo, keys, scripts, amounts, hashtype=SIGHASH_ALL):
+    """Create segwit v0 signatures for every input of txTo.
+
+    keys, scripts and amounts give, for each input, the signing key (a
+    CECKey), the scriptCode and the CTxOutValue of the spent output. The
+    midstates are computed once for the whole transaction. Returns the
+    signatures, with the hashtype byte appended, in input order."""
+    assert len(keys) == len(scripts) == len(amounts) == len(txTo.vin)
+    cache = PrecomputedTransactionData(txTo)
+    hashtype_byte = bytes([hashtype])
+    return [key.sign(SegwitVersion1SignatureHash(script, txTo, i, hashtype, amount, cache)) + hashtype_byte
+            for i, (key, script, amount) in enumerate(zip(keys, scripts, amounts))]
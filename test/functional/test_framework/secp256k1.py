@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Elements developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""ctypes wrapper around a libsecp256k1 shared library.
+
+The library is looked up, in order, at the path in the LIBSECP256K1
+environment variable, in this tree's src/secp256k1/.libs (the bundled copy
+is built static by default; configure it with --enable-shared to get a
+shared object there), and finally on the system library path.
+
+Besides ECDSA, the Elements modules (ecdh, generator, rangeproof and
+surjectionproof) are wrapped when the library was built with them: check
+has_ecdh and has_zkp before using them.
+
+If no library can be loaded, `secp256k1` is None and callers should fall
+back to OpenSSL (see key.py)."""
+
+import ctypes
+import ctypes.util
+import os
+import unittest
+
+SECP256K1_CONTEXT_VERIFY = (1 << 0) | (1 << 8)
+SECP256K1_CONTEXT_SIGN = (1 << 0) | (1 << 9)
+
+SECP256K1_SURJECTIONPROOF_MAX_N_INPUTS = 256
+
+# Sizes of the opaque structures passed by pointer
+PUBKEY_SIZE = 64
+SIGNATURE_SIZE = 64
+GENERATOR_SIZE = 64
+COMMITMENT_SIZE = 64
+# size_t n_inputs, used_inputs bitmap and borromean signature, plus room
+# for the `initialized` field of builds with VERIFY defined
+SURJECTIONPROOF_SIZE = 16 + SECP256K1_SURJECTIONPROOF_MAX_N_INPUTS // 8 + 32 * (1 + SECP256K1_SURJECTIONPROOF_MAX_N_INPUTS)
+
+def _library_paths():
+    if os.getenv("LIBSECP256K1"):
+        yield os.getenv("LIBSECP256K1")
+    libdir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../../src/secp256k1/.libs"))
+    for name in ("libsecp256k1.so", "libsecp256k1.dylib", "libsecp256k1-0.dll"):
+        yield os.path.join(libdir, name)
+    system_lib = ctypes.util.find_library("secp256k1")
+    if system_lib:
+        yield system_lib
+
+class Secp256k1:
+    """A loaded libsecp256k1 with signing and verification contexts.
+
+    All keys, hashes, signatures and commitments are passed as bytes in
+    their serialized form; the opaque library structures never escape."""
+
+    def __init__(self, path):
+        lib = ctypes.cdll.LoadLibrary(path)
+        self.lib = lib
+        self.path = path
+
+        lib.secp256k1_context_create.restype = ctypes.c_void_p
+        lib.secp256k1_context_create.argtypes = [ctypes.c_uint]
+        self.ctx = lib.secp256k1_context_create(SECP256K1_CONTEXT_SIGN | SECP256K1_CONTEXT_VERIFY)
+
+        c_size_p = ctypes.POINTER(ctypes.c_size_t)
+        self._bind("secp256k1_ec_pubkey_parse", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t])
+        self._bind("secp256k1_ecdsa_sign", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p])
+        self._bind("secp256k1_ecdsa_verify", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p])
+        self._bind("secp256k1_ecdsa_signature_parse_der", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t])
+        self._bind("secp256k1_ecdsa_signature_serialize_der", [ctypes.c_void_p, ctypes.c_char_p, c_size_p, ctypes.c_char_p])
+        self._bind("secp256k1_ecdsa_signature_normalize", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p])
+
+        self.has_ecdh = self._bind("secp256k1_ecdh", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p], required=False)
+        self.has_zkp = all([
+            self._bind("secp256k1_generator_parse", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p], required=False),
+            self._bind("secp256k1_generator_generate", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p], required=False),
+            self._bind("secp256k1_pedersen_commitment_parse", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p], required=False),
+            self._bind("secp256k1_rangeproof_verify", [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint64), ctypes.POINTER(ctypes.c_uint64), ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p], required=False),
+            self._bind("secp256k1_surjectionproof_parse", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t], required=False),
+            self._bind("secp256k1_surjectionproof_verify", [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p], required=False),
+        ])
+
+    def _bind(self, name, argtypes, required=True):
+        if not required and not hasattr(self.lib, name):
+            return False
+        func = getattr(self.lib, name)
+        func.restype = ctypes.c_int
+        func.argtypes = argtypes
+        return True
+
+    # ECDSA
+
+    def _parse_pubkey(self, pubkey):
+        pk = ctypes.create_string_buffer(PUBKEY_SIZE)
+        if not self.lib.secp256k1_ec_pubkey_parse(self.ctx, pk, pubkey, len(pubkey)):
+            raise ValueError("Invalid public key")
+        return pk
+
+    def sign_batch(self, secret, hashes):
+        """Return low-S DER signatures of each 32-byte hash in hashes."""
+        sign = self.lib.secp256k1_ecdsa_sign
+        serialize = self.lib.secp256k1_ecdsa_signature_serialize_der
+        ctx = self.ctx
+        sig = ctypes.create_string_buffer(SIGNATURE_SIZE)
+        der = ctypes.create_string_buffer(72)
+        derlen = ctypes.c_size_t()
+        derlen_p = ctypes.byref(derlen)
+        sigs = []
+        for h in hashes:
+            if len(h) != 32:
+                raise ValueError('Hash must be exactly 32 bytes long')
+            if not sign(ctx, sig, h, secret, None, None):
+                raise ValueError("Signing failed")
+            derlen.value = 72
+            serialize(ctx, der, derlen_p, sig)
+            sigs.append(der.raw[:derlen.value])
+        return sigs
+
+    def sign(self, secret, hash):
+        return self.sign_batch(secret, [hash])[0]
+
+    def verify_batch(self, items):
+        """Verify (pubkey, hash, DER signature) triples.
+
+        High-S signatures are accepted, like OpenSSL's ECDSA_verify. Returns
+        a list of booleans, or None in place of a signature that is not
+        strict DER (callers may retry those with a lax parser)."""
+        lib = self.lib
+        ctx = self.ctx
+        sig = ctypes.create_string_buffer(SIGNATURE_SIZE)
+        pubkeys = {}
+        results = []
+        for pubkey, h, der in items:
+            if not lib.secp256k1_ecdsa_signature_parse_der(ctx, sig, der, len(der)):
+                results.append(None)
+                continue
+            lib.secp256k1_ecdsa_signature_normalize(ctx, sig, sig)
+            if pubkey not in pubkeys:
+                try:
+                    pubkeys[pubkey] = self._parse_pubkey(pubkey)
+                except ValueError:
+                    pubkeys[pubkey] = None
+            pk = pubkeys[pubkey]
+            results.append(pk is not None and len(h) == 32 and lib.secp256k1_ecdsa_verify(ctx, sig, h, pk) == 1)
+        return results
+
+    def verify(self, pubkey, hash, sig):
+        return self.verify_batch([(pubkey, hash, sig)])[0]
+
+    # Elements primitives
+
+    def ecdh(self, secret, pubkey):
+        """Shared secret as computed by CKey::ECDH: sha256 of the compressed point."""
+        if not self.has_ecdh:
+            raise RuntimeError("%s was built without the ecdh module" % self.path)
+        out = ctypes.create_string_buffer(32)
+        if not self.lib.secp256k1_ecdh(self.ctx, out, self._parse_pubkey(pubkey), secret, None, None):
+            raise ValueError("ECDH failed")
+        return out.raw
+
+    def _check_zkp(self):
+        if not self.has_zkp:
+            raise RuntimeError("%s was built without the rangeproof/surjectionproof modules" % self.path)
+
+    def _parse_generator(self, asset_commitment):
+        """Generator for a serialized CTxOutAsset (explicit or blinded)."""
+        gen = ctypes.create_string_buffer(GENERATOR_SIZE)
+        if len(asset_commitment) == 33 and asset_commitment[0] == 1:
+            ok = self.lib.secp256k1_generator_generate(self.ctx, gen, bytes(asset_commitment[1:]))
+        elif len(asset_commitment) == 33 and asset_commitment[0] in (10, 11):
+            ok = self.lib.secp256k1_generator_parse(self.ctx, gen, bytes(asset_commitment))
+        else:
+            ok = 0
+        if not ok:
+            raise ValueError("Invalid asset commitment")
+        return gen
+
+    def verify_surjectionproof(self, proof, input_assets, output_asset):
+        """Verify a surjection proof.
+
+        input_assets and output_asset are serialized CTxOutAsset commitments."""
+        self._check_zkp()
+        lib = self.lib
+        parsed = ctypes.create_string_buffer(SURJECTIONPROOF_SIZE)
+        if not lib.secp256k1_surjectionproof_parse(self.ctx, parsed, proof, len(proof)):
+            return False
+        try:
+            inputs = b"".join(self._parse_generator(a).raw for a in input_assets)
+            output = self._parse_generator(output_asset)
+        except ValueError:
+            return False
+        return lib.secp256k1_surjectionproof_verify(self.ctx, parsed, inputs, len(input_assets), output) == 1
+
+    def verify_rangeproof(self, proof, value_commitment, asset_commitment, script_pubkey=b""):
+        """Verify a range proof over a blinded CTxOutValue commitment.
+
+        script_pubkey is the extra data committed to, as in VerifyAmounts().
+        Returns the proven (min_value, max_value), or None if invalid."""
+        self._check_zkp()
+        lib = self.lib
+        commit = ctypes.create_string_buffer(COMMITMENT_SIZE)
+        if len(value_commitment) != 33 or not lib.secp256k1_pedersen_commitment_parse(self.ctx, commit, bytes(value_commitment)):
+            return None
+        try:
+            gen = self._parse_generator(asset_commitment)
+        except ValueError:
+            return None
+        min_value = ctypes.c_uint64()
+        max_value = ctypes.c_uint64()
+        if not lib.secp256k1_rangeproof_verify(self.ctx, ctypes.byref(min_value), ctypes.byref(max_value), commit,
+                                               proof, len(proof), bytes(script_pubkey), len(script_pubkey), gen):
+            return None
+        return (min_value.value, max_value.value)
+
+def load_secp256k1():
+    for path in _library_paths():
+        try:
+            lib = Secp256k1(path)
+        except (OSError, AttributeError):
+            continue
+        return lib
+    return None
+
+secp256k1 = load_secp256k1()
+
+class TestFrameworkSecp256k1(unittest.TestCase):
+    # An output of 7 units of asset sha256("asset"), blinded with a range
+    # proof over [0, 7] committing to scriptPubKey OP_TRUE, and a surjection
+    # proof from a single input of the same asset, made with libsecp256k1.
+    ASSET = bytes.fromhex("01d59386e0ae435e292fbe0ebcdb954b75ed5fb3922091277cb19f798fc5d50718")
+    ASSET_COMMITMENT = bytes.fromhex("0b3b0e0a8696df04a63033553c29bdc8c22f777ed3835defce02cef57ce44a4588")
+    VALUE_COMMITMENT = bytes.fromhex("08c8cff54c92360e063c8e2faa26d5d6705f3929f4c056b2b37fb08000d9c5eb97")
+    RANGEPROOF = bytes.fromhex("400200cc48af63350a82583d5d4d6187553ba531c50bdd09e39123a0f5f549630463f71baa4d397dd581e3cdafda135a"
+                                   "867b2ca6ef8121b5ddf874bf65578ad5cd2fee83a14d28c1335dbdb0f65ef992270455b6f4aa231b8a372d1f70782857"
+                                   "082cb18152775e18af771916cbbb4f97f09d458c6e5717b00817bb24c6de34731e2deea84926c42ce4d39f1a3c794d19"
+                                   "4f940443e6a9aa4ffd6a61b647d84cb3b32deb8068afa77b8fd418877230142f4725c08e2e0f941cbcafa48d398d5b99"
+                                   "ca26c165086b5b04bba880ff33be417a43d1f0f18617ab9baee00d50b35a24abbfeefbd2bfaa8b67d439472a373f8340"
+                                   "662207e730616e326983699c3bb43928696d91")
+    SURJECTIONPROOF = bytes.fromhex("0100011d4606ad0e95528282e2d572b06b0f410e8792d8532e35d7dcfbdbf33308ac2d8987a4dfd7474c6c2d7f952393"
+                                        "ab8e7f65934d4fb7ef8675284e1aab2e3b0692")
+
+    def setUp(self):
+        if not (secp256k1 and secp256k1.has_zkp):
+            self.skipTest("no libsecp256k1 with the rangeproof/surjectionproof modules")
+
+    def test_verify_rangeproof(self):
+        self.assertEqual(secp256k1.verify_rangeproof(self.RANGEPROOF, self.VALUE_COMMITMENT, self.ASSET_COMMITMENT, b"\x51"), (0, 7))
+        # Wrong extra commitment, wrong asset, truncated proof
+        self.assertIsNone(secp256k1.verify_rangeproof(self.RANGEPROOF, self.VALUE_COMMITMENT, self.ASSET_COMMITMENT, b"\x52"))
+        self.assertIsNone(secp256k1.verify_rangeproof(self.RANGEPROOF, self.VALUE_COMMITMENT, self.ASSET, b"\x51"))
+        self.assertIsNone(secp256k1.verify_rangeproof(self.RANGEPROOF[:-1], self.VALUE_COMMITMENT, self.ASSET_COMMITMENT, b"\x51"))
+
+    def test_verify_surjectionproof(self):
+        self.assertTrue(secp256k1.verify_surjectionproof(self.SURJECTIONPROOF, [self.ASSET], self.ASSET_COMMITMENT))
+        self.assertFalse(secp256k1.verify_surjectionproof(self.SURJECTIONPROOF, [b"\x01" + bytes(32)], self.ASSET_COMMITMENT))
+        self.assertFalse(secp256k1.verify_surjectionproof(self.SURJECTIONPROOF, [self.ASSET], self.ASSET))
+        self.assertFalse(secp256k1.verify_surjectionproof(b"", [self.ASSET], self.ASSET_COMMITMENT))
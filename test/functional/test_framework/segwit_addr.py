@@ -2,21 +2,60 @@
 # Copyright (c) 2017 Pieter Wuille
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
-"""Reference implementation for Bech32 and segwit addresses."""
+"""Reference implementation for Bech32 and segwit addresses.
+
+The checksum is computed with precomputed step tables (see polymod_tables())
+rather than bit by bit, and the checksum state after the HRP is cached, as
+the tests encode and decode many addresses for the same few HRPs."""
+
+import functools
+import random
+import unittest
 
 
 CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
 
+# bytes.translate() tables between 5-bit values and CHARSET characters.
+# Characters outside CHARSET decode to 0xff.
+ENCODE_TABLE = bytes.maketrans(bytes(range(32)), CHARSET.encode())
+DECODE_TABLE = bytes(CHARSET.find(chr(c)) & 0xff for c in range(256))
 
-def bech32_polymod(values):
-    """Internal function that computes the Bech32 checksum."""
-    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
-    chk = 1
-    for value in values:
-        top = chk >> 25
-        chk = (chk & 0x1ffffff) << 5 ^ value
+# Digits of int(s, 32), to convert 5-bit values to an integer in one go
+BASE32_DIGITS = "0123456789abcdefghijklmnopqrstuv"
+BASE32_TABLE = bytes.maketrans(bytes(range(32)), BASE32_DIGITS.encode())
+
+BECH32_GENERATOR = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+
+
+def polymod_tables(generator, checksum_bits):
+    """Step tables for a BCH checksum over 5-bit values.
+
+    The first (32 entries) maps the 5 bits shifted out of the checksum by one
+    step to the xor of the generators they select. The second (1024 entries)
+    does the same for the 10 bits shifted out by two consecutive steps."""
+    shift = checksum_bits - 5
+    mask = (1 << shift) - 1
+    step = [0] * 32
+    for top in range(32):
         for i in range(5):
-            chk ^= generator[i] if ((top >> i) & 1) else 0
+            if (top >> i) & 1:
+                step[top] ^= generator[i]
+    step2 = [((step[top >> 5] & mask) << 5) ^ step[(top & 31) ^ (step[top >> 5] >> shift)] for top in range(1024)]
+    return step, step2
+
+BECH32_STEP, BECH32_STEP2 = polymod_tables(BECH32_GENERATOR, 30)
+
+
+def bech32_polymod(values, chk=1):
+    """Internal function that computes the Bech32 checksum.
+
+    chk is the state to continue from, by default that of an empty input."""
+    step, step2 = BECH32_STEP, BECH32_STEP2
+    it = iter(values)
+    if len(values) & 1:
+        chk = ((chk & 0x1ffffff) << 5) ^ next(it) ^ step[chk >> 25]
+    for a, b in zip(it, it):
+        chk = ((chk & 0xfffff) << 10) ^ (a << 5) ^ b ^ step2[chk >> 20]
     return chk
 
 
@@ -25,37 +64,49 @@ def bech32_hrp_expand(hrp):
     return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
 
 
+@functools.lru_cache(maxsize=64)
+def bech32_hrp_state(hrp):
+    """Checksum state after the expanded HRP."""
+    return bech32_polymod(bech32_hrp_expand(hrp))
+
+
 def bech32_verify_checksum(hrp, data):
     """Verify a checksum given HRP and converted data characters."""
-    return bech32_polymod(bech32_hrp_expand(hrp) + data) == 1
+    return bech32_polymod(data, bech32_hrp_state(hrp)) == 1
 
 
 def bech32_create_checksum(hrp, data):
     """Compute the checksum values given HRP and data."""
-    values = bech32_hrp_expand(hrp) + data
-    polymod = bech32_polymod(values + [0, 0, 0, 0, 0, 0]) ^ 1
+    polymod = bech32_polymod(data + [0, 0, 0, 0, 0, 0], bech32_hrp_state(hrp)) ^ 1
     return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
 
 
 def bech32_encode(hrp, data):
     """Compute a Bech32 string given HRP and data values."""
     combined = data + bech32_create_checksum(hrp, data)
-    return hrp + '1' + ''.join([CHARSET[d] for d in combined])
+    return hrp + '1' + bytes(combined).translate(ENCODE_TABLE).decode()
+
+
+def is_valid_charset(bech):
+    """Whether bech is printable ASCII without spaces, and not of mixed case."""
+    if any(ord(x) < 33 or ord(x) > 126 for x in bech):
+        return False
+    return bech.lower() == bech or bech.upper() == bech
 
 
 def bech32_decode(bech):
     """Validate a Bech32 string, and determine HRP and data."""
-    if ((any(ord(x) < 33 or ord(x) > 126 for x in bech)) or
-            (bech.lower() != bech and bech.upper() != bech)):
+    if not is_valid_charset(bech):
         return (None, None)
     bech = bech.lower()
     pos = bech.rfind('1')
     if pos < 1 or pos + 7 > len(bech) or len(bech) > 90:
         return (None, None)
-    if not all(x in CHARSET for x in bech[pos+1:]):
+    data = bech[pos+1:].encode().translate(DECODE_TABLE)
+    if 0xff in data:
         return (None, None)
     hrp = bech[:pos]
-    data = [CHARSET.find(x) for x in bech[pos+1:]]
+    data = list(data)
     if not bech32_verify_checksum(hrp, data):
         return (None, None)
     return (hrp, data[:-6])
@@ -63,6 +114,10 @@ def bech32_decode(bech):
 
 def convertbits(data, frombits, tobits, pad=True):
     """General power-of-2 base conversion."""
+    if (frombits, tobits) == (8, 5):
+        return bytes_to_5bit(data, pad)
+    if (frombits, tobits) == (5, 8):
+        return bytes_from_5bit(data, pad)
     acc = 0
     bits = 0
     ret = []
@@ -84,6 +139,53 @@ def convertbits(data, frombits, tobits, pad=True):
     return ret
 
 
+def bytes_to_5bit(data, pad=True):
+    """convertbits(data, 8, 5, pad), through a single integer."""
+    try:
+        data = bytes(data)
+    except (TypeError, ValueError):
+        return None
+    nbits = len(data) * 8
+    acc = int.from_bytes(data, 'big')
+    extra = nbits % 5
+    if extra:
+        if not pad:
+            # Fewer than 5 bits are left over, and they must be zero padding
+            if acc & ((1 << extra) - 1):
+                return None
+            acc >>= extra
+            nbits -= extra
+        else:
+            acc <<= 5 - extra
+            nbits += 5 - extra
+    return [(acc >> shift) & 31 for shift in range(nbits - 5, -5, -5)]
+
+
+def bytes_from_5bit(data, pad=True):
+    """convertbits(data, 5, 8, pad), through a single integer."""
+    try:
+        data = bytes(data)
+    except (TypeError, ValueError):
+        return None
+    if not data:
+        return []
+    if max(data) > 31:
+        return None
+    nbits = len(data) * 5
+    acc = int(data.translate(BASE32_TABLE), 32)
+    extra = nbits % 8
+    if pad:
+        if extra:
+            acc <<= 8 - extra
+            nbits += 8 - extra
+    elif extra >= 5 or acc & ((1 << extra) - 1):
+        return None
+    else:
+        acc >>= extra
+        nbits -= extra
+    return list(acc.to_bytes(nbits // 8, 'big'))
+
+
 def decode(hrp, addr):
     """Decode a segwit address."""
     hrpgot, data = bech32_decode(addr)
@@ -105,3 +207,101 @@ def encode(hrp, witver, witprog):
     if decode(hrp, ret) == (None, None):
         return None
     return ret
+
+
+def decode_many(hrp, addrs):
+    """decode() each of addrs."""
+    return [decode(hrp, addr) for addr in addrs]
+
+
+def encode_many(hrp, programs):
+    """encode() each (witver, witprog) pair of programs."""
+    return [encode(hrp, witver, witprog) for witver, witprog in programs]
+
+
+def bech32_polymod_bitwise(values, chk=1):
+    """bech32_polymod() as in BIP173, one bit of the generator at a time."""
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            chk ^= BECH32_GENERATOR[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+class TestFrameworkSegwitAddr(unittest.TestCase):
+    # From BIP173
+    VALID_CHECKSUMS = [
+        "A12UEL5L",
+        "a12uel5l",
+        "an83characterlonghumanreadablepartthatcontainsthenumber1andtheexcludedcharactersbio1tt5tgs",
+        "abcdef1qpzry9x8gf2tvdw0s3jn54khce6mua7lmqqqxw",
+        "11" + "q" * 82 + "c8247j",
+        "split1checkupstagehandshakeupstreamerranterredcaperred2y9e3w",
+        "?1ezyfcl",
+    ]
+    INVALID_CHECKSUMS = [
+        " 1nwldj5",
+        "\x7f1axkwrx",
+        "\x801eym55h",
+        "an84characterslonghumanreadablepartthatcontainsthenumber1andtheexcludedcharactersbio1569pvx",
+        "pzry9x0s0muk",
+        "1pzry9x0s0muk",
+        "x1b4n0q5v",
+        "li1dgmt3",
+        "de1lg7wt\xff",
+        "A1G7SGD8",
+        "10a06t8",
+        "1qzzfhee",
+    ]
+    VALID_ADDRESSES = [
+        ("BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4", "0014751e76e8199196d454941c45d1b3a323f1433bd6"),
+        ("tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sl5k7",
+         "00201863143c14c5166804bd19203356da136c985678cd4d27a1b8c6329604903262"),
+        ("bc1pw508d6qejxtdg4y5r3zarvary0c5xw7kw508d6qejxtdg4y5r3zarvary0c5xw7k7grplx",
+         "5128751e76e8199196d454941c45d1b3a323f1433bd6751e76e8199196d454941c45d1b3a323f1433bd6"),
+        ("BC1SW50QA3JX3S", "6002751e"),
+    ]
+    INVALID_ADDRESSES = [
+        ("bc", "tc1qw508d6qejxtdg4y5r3zarvary0c5xw7kg3g4ty"),
+        ("bc", "bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t5"),
+        ("bc", "BC13W508D6QEJXTDG4Y5R3ZARVARY0C5XW7KN40WF2"),
+        ("bc", "bc1rw5uspcuh"),
+        ("bc", "bc10w508d6qejxtdg4y5r3zarvary0c5xw7kw508d6qejxtdg4y5r3zarvary0c5xw7kw5rljs90"),
+        ("tb", "tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sL5k7"),
+        ("bc", "bc1gmk9yu"),
+    ]
+
+    def test_polymod(self):
+        # Every entry of the step tables: states whose top 5 or 10 bits are
+        # shifted out by one or two values
+        for top in range(1024):
+            chk = top << 20 | 0x12345
+            self.assertEqual(bech32_polymod([7, 9], chk), bech32_polymod_bitwise([7, 9], chk))
+        for top in range(32):
+            chk = top << 25 | 0x12345
+            self.assertEqual(bech32_polymod([7], chk), bech32_polymod_bitwise([7], chk))
+        rng = random.Random(0)
+        for length in range(100):
+            values = [rng.randrange(32) for _ in range(length)]
+            self.assertEqual(bech32_polymod(values), bech32_polymod_bitwise(values))
+        self.assertEqual(bech32_hrp_state("bc"), bech32_polymod_bitwise(bech32_hrp_expand("bc")))
+
+    def test_checksums(self):
+        for bech in self.VALID_CHECKSUMS:
+            hrp, data = bech32_decode(bech)
+            self.assertIsNotNone(hrp, bech)
+            self.assertEqual(bech32_encode(hrp, data), bech.lower())
+        for bech in self.INVALID_CHECKSUMS:
+            self.assertEqual(bech32_decode(bech), (None, None), bech)
+
+    def test_addresses(self):
+        for hrp in ("bc", "tb"):
+            addresses = [address for address, _ in self.VALID_ADDRESSES if address.lower().startswith(hrp)]
+            decoded = decode_many(hrp, addresses)
+            for address, (witver, witprog) in zip(addresses, decoded):
+                script = bytes([witver + 0x50 if witver else 0, len(witprog)] + witprog)
+                self.assertEqual(script.hex(), dict(self.VALID_ADDRESSES)[address])
+            self.assertEqual(encode_many(hrp, decoded), [address.lower() for address in addresses])
+        for hrp, address in self.INVALID_ADDRESSES:
+            self.assertEqual(decode(hrp, address), (None, None), address)
@@ -5,8 +5,27 @@
 """Specialized SipHash-2-4 implementations.
 
 This implements SipHash-2-4 for 256-bit integers.
+
+SipHasher keeps the key-dependent initial state for a given (k0, k1), and
+hashes many integers in one call: with the rounds inlined in pure Python, or
+vectorized over NumPy uint64 arrays for large batches if NumPy is installed.
 """
 
+import random
+import unittest
+from unittest import mock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MASK64 = (1 << 64) - 1
+
+# Below this many hashes, the conversions to and from NumPy arrays cost more
+# than they save
+NUMPY_MIN_BATCH = 256
+
 def rotl64(n, b):
     return n >> (64 - b) | (n & ((1 << (64 - b)) - 1)) << b
 
@@ -61,3 +80,126 @@ def siphash256(k0, k1, h):
     v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
     v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
     return v0 ^ v1 ^ v2 ^ v3
+
+
+class SipHasher:
+    """SipHash-2-4 of 256-bit integers under a fixed key (k0, k1)."""
+    __slots__ = ("k0", "k1", "v0", "v1", "v2", "v3")
+
+    def __init__(self, k0, k1):
+        self.k0 = k0
+        self.k1 = k1
+        self.v0 = 0x736f6d6570736575 ^ k0
+        self.v1 = 0x646f72616e646f6d ^ k1
+        self.v2 = 0x6c7967656e657261 ^ k0
+        self.v3 = 0x7465646279746573 ^ k1
+
+    def hash256(self, h):
+        """siphash256(self.k0, self.k1, h)."""
+        return self.hash256_many((h,))[0]
+
+    def hash256_many(self, hashes):
+        """siphash256() of each of hashes, as a list."""
+        if numpy is not None and len(hashes) >= NUMPY_MIN_BATCH:
+            return self._hash256_numpy(hashes)
+        return [self._hash256(h) for h in hashes]
+
+    def _hash256(self, h):
+        # siphash256() with the rounds inlined
+        M = MASK64
+        n = (h & M, (h >> 64) & M, (h >> 128) & M, (h >> 192) & M, 0x2000000000000000)
+        v0, v1, v2, v3 = self.v0, self.v1, self.v2, self.v3
+        for i in range(5):
+            v3 ^= n[i]
+            for _ in range(2):
+                v0 = (v0 + v1) & M
+                v1 = ((v1 << 13) & M) | (v1 >> 51)
+                v1 ^= v0
+                v0 = ((v0 << 32) & M) | (v0 >> 32)
+                v2 = (v2 + v3) & M
+                v3 = ((v3 << 16) & M) | (v3 >> 48)
+                v3 ^= v2
+                v0 = (v0 + v3) & M
+                v3 = ((v3 << 21) & M) | (v3 >> 43)
+                v3 ^= v0
+                v2 = (v2 + v1) & M
+                v1 = ((v1 << 17) & M) | (v1 >> 47)
+                v1 ^= v2
+                v2 = ((v2 << 32) & M) | (v2 >> 32)
+            v0 ^= n[i]
+        v2 ^= 0xFF
+        for _ in range(4):
+            v0 = (v0 + v1) & M
+            v1 = ((v1 << 13) & M) | (v1 >> 51)
+            v1 ^= v0
+            v0 = ((v0 << 32) & M) | (v0 >> 32)
+            v2 = (v2 + v3) & M
+            v3 = ((v3 << 16) & M) | (v3 >> 48)
+            v3 ^= v2
+            v0 = (v0 + v3) & M
+            v3 = ((v3 << 21) & M) | (v3 >> 43)
+            v3 ^= v0
+            v2 = (v2 + v1) & M
+            v1 = ((v1 << 17) & M) | (v1 >> 47)
+            v1 ^= v2
+            v2 = ((v2 << 32) & M) | (v2 >> 32)
+        return v0 ^ v1 ^ v2 ^ v3
+
+    def _hash256_numpy(self, hashes):
+        u64 = numpy.uint64
+        # One row of four little-endian 64-bit words per hash. Arithmetic on
+        # uint64 arrays wraps around, as SipHash wants.
+        words = numpy.frombuffer(b"".join(h.to_bytes(32, "little") for h in hashes), dtype="<u8").reshape(-1, 4)
+        n = [words[:, 0], words[:, 1], words[:, 2], words[:, 3], numpy.full(len(hashes), 0x2000000000000000, dtype=u64)]
+        shape = (len(hashes),)
+        v0 = numpy.full(shape, self.v0, dtype=u64)
+        v1 = numpy.full(shape, self.v1, dtype=u64)
+        v2 = numpy.full(shape, self.v2, dtype=u64)
+        v3 = numpy.full(shape, self.v3, dtype=u64)
+
+        def rotl(x, b):
+            return (x << u64(b)) | (x >> u64(64 - b))
+
+        def sipround(v0, v1, v2, v3):
+            v0 = v0 + v1
+            v1 = rotl(v1, 13) ^ v0
+            v0 = rotl(v0, 32)
+            v2 = v2 + v3
+            v3 = rotl(v3, 16) ^ v2
+            v0 = v0 + v3
+            v3 = rotl(v3, 21) ^ v0
+            v2 = v2 + v1
+            v1 = rotl(v1, 17) ^ v2
+            v2 = rotl(v2, 32)
+            return v0, v1, v2, v3
+
+        for m in n:
+            v3 = v3 ^ m
+            v0, v1, v2, v3 = sipround(v0, v1, v2, v3)
+            v0, v1, v2, v3 = sipround(v0, v1, v2, v3)
+            v0 = v0 ^ m
+        v2 = v2 ^ u64(0xFF)
+        for _ in range(4):
+            v0, v1, v2, v3 = sipround(v0, v1, v2, v3)
+        return (v0 ^ v1 ^ v2 ^ v3).tolist()
+
+
+class TestFrameworkSiphash(unittest.TestCase):
+    def test_siphash256(self):
+        # From src/test/hash_tests.cpp
+        k0, k1 = 0x0706050403020100, 0x0F0E0D0C0B0A0908
+        h = 0x1f1e1d1c1b1a191817161514131211100f0e0d0c0b0a09080706050403020100
+        self.assertEqual(siphash256(k0, k1, h), 0x7127512f72f27cce)
+        self.assertEqual(SipHasher(k0, k1).hash256(h), 0x7127512f72f27cce)
+
+    def test_hash256_many(self):
+        rng = random.Random(0)
+        k0, k1 = rng.getrandbits(64), rng.getrandbits(64)
+        hashes = [0, (1 << 256) - 1] + [rng.getrandbits(256) for _ in range(NUMPY_MIN_BATCH)]
+        expected = [siphash256(k0, k1, h) for h in hashes]
+        hasher = SipHasher(k0, k1)
+        # Pure Python, then NumPy for the large batch if it is installed
+        self.assertEqual(hasher.hash256_many(hashes[:NUMPY_MIN_BATCH - 1]), expected[:NUMPY_MIN_BATCH - 1])
+        self.assertEqual(hasher.hash256_many(hashes), expected)
+        with mock.patch(__name__ + ".numpy", None):
+            self.assertEqual(hasher.hash256_many(hashes), expected)
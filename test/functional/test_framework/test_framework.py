@@ -6,6 +6,8 @@
 
 import configparser
 from enum import Enum
+import hashlib
+import json
 import logging
 import argparse
 import os
@@ -19,11 +21,16 @@ from .authproxy import JSONRPCException
 from . import coverage
 from .test_node import TestNode
 from .mininode import NetworkThread
+from .notifications import SyncNotifier
+from . import util
 from .util import (
+    DATADIR_CONFIG,
     MAX_NODES,
     PortSeed,
+    append_config,
     assert_equal,
     check_json_precision,
+    clone_datadir,
     connect_nodes_bi,
     disconnect_nodes,
     get_datadir_path,
@@ -31,7 +38,9 @@ from .util import (
     p2p_port,
     set_node_times,
     sync_blocks,
+    sync_blocks_async,
     sync_mempools,
+    sync_mempools_async,
 )
 
 class TestStatus(Enum):
@@ -43,6 +52,9 @@ TEST_EXIT_PASSED = 0
 TEST_EXIT_FAILED = 1
 TEST_EXIT_SKIPPED = 77
 
+# Bump when _create_chain_cache() changes, to stop using caches it built before
+CHAIN_CACHE_VERSION = 1
+
 
 class SkipTest(Exception):
     """This exception is raised to skip a test"""
@@ -90,9 +102,16 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
     def __init__(self):
         """Sets test framework defaults. Do not override this method. Instead, override the set_test_params() method"""
         self.chain = 'elementsregtest'
+        # Extra elements.conf options for all nodes, e.g. chain parameters
+        self.chain_config = []
         self.setup_clean_chain = False
         self.nodes = []
         self.network_thread = None
+        self.sync_notifier = None
+        # Whether the sync helpers wait for block and transaction notifications
+        # from the nodes, instead of only polling them. Tests that configure or
+        # inspect notifications (-zmqpub*, -blocknotify) must leave this off.
+        self.sync_notifications = False
         self.mocktime = 0
         self.rpc_timewait = 60  # Wait for up to 60 seconds for the RPC server to respond
         self.supports_cli = False
@@ -127,6 +146,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                             help="Attach a python debugger if test fails")
         parser.add_argument("--usecli", dest="usecli", default=False, action="store_true",
                             help="use bitcoin-cli instead of RPC for all commands")
+        parser.add_argument("--syncpoll", dest="syncpoll", default=False, action="store_true",
+                            help="sync nodes by polling them only, even in tests that wait for their block and transaction notifications")
         self.add_options(parser)
         self.options = parser.parse_args()
 
@@ -159,6 +180,13 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         self.network_thread = NetworkThread()
         self.network_thread.start()
 
+        if self.sync_notifications and not self.options.syncpoll:
+            available, use_zmq = SyncNotifier.is_available(self.is_zmq_compiled())
+            if available:
+                self.log.debug('Setting up sync notifications over %s' % ('zmq' if use_zmq else '-blocknotify'))
+                self.sync_notifier = SyncNotifier(use_zmq)
+                util.sync_notifier = self.sync_notifier
+
         success = TestStatus.FAILED
 
         try:
@@ -200,6 +228,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 node.cleanup_on_exit = False
             self.log.info("Note: bitcoinds were not stopped and may still be running")
 
+        if self.sync_notifier:
+            util.sync_notifier = None
+            self.sync_notifier.close()
+
         if not self.options.nocleanup and not self.options.noshutdown and success != TestStatus.FAILED:
             self.log.info("Cleaning up {} on exit".format(self.options.tmpdir))
             cleanup_tree_on_exit = True
@@ -299,7 +331,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         assert_equal(len(chain), num_nodes)
         for i in range(num_nodes):
             numnode = len(self.nodes)
-            self.nodes.append(TestNode(numnode, get_datadir_path(self.options.tmpdir, numnode), chain[i], rpchost=rpchost, timewait=self.rpc_timewait, bitcoind=binary[i], bitcoin_cli=self.options.bitcoincli, mocktime=self.mocktime, coverage_dir=self.options.coveragedir, extra_conf=extra_confs[i], extra_args=extra_args[i], use_cli=self.options.usecli, chain_in_args=chain_in_args[i]))
+            node_args = extra_args[i]
+            if self.sync_notifier:
+                node_args = node_args + self.sync_notifier.node_args(numnode, node_args)
+            self.nodes.append(TestNode(numnode, get_datadir_path(self.options.tmpdir, numnode), chain[i], rpchost=rpchost, timewait=self.rpc_timewait, bitcoind=binary[i], bitcoin_cli=self.options.bitcoincli, mocktime=self.mocktime, coverage_dir=self.options.coveragedir, extra_conf=extra_confs[i], extra_args=node_args, use_cli=self.options.usecli, chain_in_args=chain_in_args[i]))
 
     def start_node(self, i, *args, **kwargs):
         """Start a bitcoind"""
@@ -375,8 +410,14 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             node_groups = [self.nodes]
 
         for group in node_groups:
-            sync_blocks(group)
-            sync_mempools(group)
+            if self.options.usecli:
+                sync_blocks(group)
+                sync_mempools(group)
+            else:
+                # Query the nodes of the group concurrently from the network thread
+                rpcs = [node.async_rpc for node in group]
+                self.network_thread.run_coroutine(sync_blocks_async(rpcs))
+                self.network_thread.run_coroutine(sync_mempools_async(rpcs))
 
     def enable_mocktime(self):
         """Enable mocktime for the script.
@@ -427,74 +468,112 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         """Initialize a pre-mined blockchain for use by the test.
 
         Create a cache of a 200-block-long chain (with wallet) for MAX_NODES
-        Afterward, create num_nodes copies from the cache."""
-
-        assert self.num_nodes <= MAX_NODES
-        create_cache = False
-        for i in range(MAX_NODES):
-            if not os.path.isdir(get_datadir_path(self.options.cachedir, i)):
-                create_cache = True
-                break
-
-        if create_cache:
-            self.log.debug("Creating data directories from cached datadir")
-
-            # find and delete old cache directories if any exist
-            for i in range(MAX_NODES):
-                if os.path.isdir(get_datadir_path(self.options.cachedir, i)):
-                    shutil.rmtree(get_datadir_path(self.options.cachedir, i))
-
-            # Create cache directories, run bitcoinds:
-            for i in range(MAX_NODES):
-                datadir = initialize_datadir(self.options.cachedir, i, self.chain)
-                args = [self.options.bitcoind, "-datadir=" + datadir, '-disablewallet']
-                if i > 0:
-                    args.append("-connect=127.0.0.1:" + str(p2p_port(0)))
-                self.nodes.append(TestNode(i, get_datadir_path(self.options.cachedir, i), self.chain, extra_conf=["bind=127.0.0.1"], extra_args=[], rpchost=None, timewait=self.rpc_timewait, bitcoind=self.options.bitcoind, bitcoin_cli=self.options.bitcoincli, mocktime=self.mocktime, coverage_dir=None))
-                self.nodes[i].args = args
-                self.start_node(i)
-
-            # Wait for RPC connections to be ready
-            for node in self.nodes:
-                node.wait_for_rpc_connection()
-
-            # Create a 200-block-long chain; each of the 4 first nodes
-            # gets 25 mature blocks and 25 immature.
-            # Note: To preserve compatibility with older versions of
-            # initialize_chain, only 4 nodes will generate coins.
-            #
-            # blocks are created with timestamps 10 minutes apart
-            # starting from 2010 minutes in the past
-            self.enable_mocktime()
-            block_time = self.mocktime - (201 * 10 * 60)
-            for i in range(2):
-                for peer in range(4):
-                    for j in range(25):
-                        set_node_times(self.nodes, block_time)
-                        self.nodes[peer].generatetoaddress(1, self.nodes[peer].get_deterministic_priv_key().address)
-                        block_time += 10 * 60
-                    # Must sync before next peer starts generating blocks
-                    sync_blocks(self.nodes)
-
-            # Shut them down, and clean up cache directories:
-            self.stop_nodes()
-            self.nodes = []
-            self.disable_mocktime()
+        Afterward, create num_nodes copies from the cache.
 
-            def cache_path(n, *paths):
-                return os.path.join(get_datadir_path(self.options.cachedir, n), self.chain, *paths)
+        Each cache lives in a subdirectory of cachedir named after the
+        bitcoind binary, the chain and its configuration, so tests with a
+        different chain_config don't share it and a rebuilt binary never
+        uses a stale one."""
 
-            for i in range(MAX_NODES):
-                os.rmdir(cache_path(i, 'wallets'))  # Remove empty wallets dir
-                for entry in os.listdir(cache_path(i)):
-                    if entry not in ['chainstate', 'blocks']:
-                        os.remove(cache_path(i, entry))
+        assert self.num_nodes <= MAX_NODES
+        cache_dir = os.path.join(self.options.cachedir, self._chain_cache_key())
+        if not os.path.isdir(cache_dir):
+            self._create_chain_cache(cache_dir)
 
         for i in range(self.num_nodes):
-            from_dir = get_datadir_path(self.options.cachedir, i)
+            from_dir = get_datadir_path(cache_dir, i)
             to_dir = get_datadir_path(self.options.tmpdir, i)
-            shutil.copytree(from_dir, to_dir)
+            clone_datadir(from_dir, to_dir)
             initialize_datadir(self.options.tmpdir, i, self.chain)  # Overwrite port/rpcport in bitcoin.conf
+            append_config(to_dir, self.chain_config)
+
+    def _chain_cache_key(self):
+        key = hashlib.sha256(self._binary_digest(self.options.bitcoind))
+        key.update(json.dumps([CHAIN_CACHE_VERSION, MAX_NODES, self.chain, DATADIR_CONFIG, self.chain_config]).encode())
+        return key.hexdigest()[:16]
+
+    def _binary_digest(self, path):
+        """sha256 of a file, remembered in cachedir for as long as its size and mtime don't change."""
+        st = os.stat(path)
+        stamp = "%s:%d:%d" % (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        memo_dir = os.path.join(self.options.cachedir, "binaries")
+        memo = os.path.join(memo_dir, hashlib.sha256(stamp.encode()).hexdigest()[:16])
+        if os.path.isfile(memo):
+            with open(memo, 'r', encoding='utf8') as f:
+                return bytes.fromhex(f.read())
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        os.makedirs(memo_dir, exist_ok=True)
+        with open(memo + ".%d" % os.getpid(), 'w', encoding='utf8') as f:
+            f.write(digest.hexdigest())
+        os.replace(memo + ".%d" % os.getpid(), memo)
+        return digest.digest()
+
+    def _create_chain_cache(self, cache_dir):
+        self.log.debug("Creating cached datadirs in %s" % cache_dir)
+
+        # Build the cache in a scratch directory and move it into place when
+        # done, so concurrent tests never see a partial one
+        os.makedirs(self.options.cachedir, exist_ok=True)
+        build_dir = tempfile.mkdtemp(prefix="build.", dir=self.options.cachedir)
+
+        # Create cache directories, run bitcoinds:
+        for i in range(MAX_NODES):
+            datadir = initialize_datadir(build_dir, i, self.chain)
+            append_config(datadir, self.chain_config)
+            args = [self.options.bitcoind, "-datadir=" + datadir, '-disablewallet']
+            if i > 0:
+                args.append("-connect=127.0.0.1:" + str(p2p_port(0)))
+            self.nodes.append(TestNode(i, datadir, self.chain, extra_conf=["bind=127.0.0.1"], extra_args=[], rpchost=None, timewait=self.rpc_timewait, bitcoind=self.options.bitcoind, bitcoin_cli=self.options.bitcoincli, mocktime=self.mocktime, coverage_dir=None))
+            self.nodes[i].args = args
+            self.nodes[i].start()
+
+        # Wait for RPC connections to be ready
+        for node in self.nodes:
+            node.wait_for_rpc_connection()
+
+        # Create a 200-block-long chain; each of the 4 first nodes
+        # gets 25 mature blocks and 25 immature.
+        # Note: To preserve compatibility with older versions of
+        # initialize_chain, only 4 nodes will generate coins.
+        #
+        # blocks are created with timestamps 10 minutes apart
+        # starting from 2010 minutes in the past
+        self.enable_mocktime()
+        block_time = self.mocktime - (201 * 10 * 60)
+        for i in range(2):
+            for peer in range(4):
+                # Only the miner's clock sets the block times, the other nodes
+                # just mustn't see its blocks as being from the future
+                set_node_times(self.nodes, block_time + 24 * 10 * 60)
+                for j in range(25):
+                    self.nodes[peer].setmocktime(block_time)
+                    self.nodes[peer].generatetoaddress(1, self.nodes[peer].get_deterministic_priv_key().address)
+                    block_time += 10 * 60
+                # Must sync before next peer starts generating blocks
+                sync_blocks(self.nodes)
+
+        # Shut them down, and clean up cache directories:
+        self.stop_nodes()
+        self.nodes = []
+        self.disable_mocktime()
+
+        def cache_path(n, *paths):
+            return os.path.join(get_datadir_path(build_dir, n), self.chain, *paths)
+
+        for i in range(MAX_NODES):
+            os.rmdir(cache_path(i, 'wallets'))  # Remove empty wallets dir
+            for entry in os.listdir(cache_path(i)):
+                if entry not in ['chainstate', 'blocks']:
+                    os.remove(cache_path(i, entry))
+
+        try:
+            os.rename(build_dir, cache_dir)
+        except OSError:
+            # Another test created the same cache meanwhile
+            shutil.rmtree(build_dir)
 
     def _initialize_chain_clean(self):
         """Initialize empty blockchain for use by the test.
@@ -502,7 +581,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         Create an empty blockchain and num_nodes wallets.
         Useful if a test case wants complete control over initialization."""
         for i in range(self.num_nodes):
-            initialize_datadir(self.options.tmpdir, i, self.chain)
+            datadir = initialize_datadir(self.options.tmpdir, i, self.chain)
+            append_config(datadir, self.chain_config)
 
     def skip_if_no_py3_zmq(self):
         """Attempt to import the zmq package and skip the test if the import fails."""
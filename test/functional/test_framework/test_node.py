@@ -15,6 +15,7 @@ import os
 import re
 import subprocess
 import tempfile
+import threading
 import time
 import urllib.parse
 import collections
@@ -23,9 +24,9 @@ from .authproxy import JSONRPCException
 from .util import (
     append_config,
     delete_cookie_file,
+    get_async_rpc_proxy,
     get_rpc_proxy,
     rpc_url,
-    wait_until,
     p2p_port,
 )
 
@@ -93,8 +94,11 @@ class TestNode():
 
         self.running = False
         self.process = None
+        # Thread blocked in waitpid() on the process, which exits with it
+        self.reaper = None
         self.rpc_connected = False
         self.rpc = None
+        self.async_rpc = None
         self.url = None
         self.log = logging.getLogger('TestFramework.node%d' % i)
         self.cleanup_on_exit = True # Whether to kill the node when this object goes away
@@ -199,24 +203,33 @@ class TestNode():
         subp_env = dict(os.environ, LIBC_FATAL_STDERR_="1")
 
         self.process = subprocess.Popen(self.args + extra_args, env=subp_env, stdout=stdout, stderr=stderr, **kwargs)
+        self.reaper = threading.Thread(target=self.process.wait, name="reaper%d" % self.index, daemon=True)
+        self.reaper.start()
 
         self.running = True
         self.log.debug("bitcoind started, waiting for RPC to come up")
 
     def wait_for_rpc_connection(self):
         """Sets up an RPC connection to the bitcoind process. Returns False if unable to connect."""
-        # Poll at a rate of four times per second
-        poll_per_s = 4
-        for _ in range(poll_per_s * self.rpc_timeout):
-            if self.process.poll() is not None:
+        # Retry with a growing delay, so that a node which comes up quickly
+        # is noticed quickly, and return as soon as the process exits.
+        delay = 0.01
+        time_end = time.time() + self.rpc_timeout
+        rpc = None
+        while time.time() < time_end:
+            if not self.reaper.is_alive():
                 raise FailedToStartError(self._node_msg(
                     'bitcoind exited with status {} during initialization'.format(self.process.returncode)))
             try:
-                self.rpc = get_rpc_proxy(rpc_url(self.datadir, self.index, self.chain, self.rpchost), self.index, timeout=self.rpc_timeout, coveragedir=self.coverage_dir)
-                self.rpc.getblockcount()
+                if rpc is None:
+                    # The cookie file only appears once the RPC server is listening
+                    rpc = get_rpc_proxy(rpc_url(self.datadir, self.index, self.chain, self.rpchost), self.index, timeout=self.rpc_timeout, coveragedir=self.coverage_dir)
+                rpc.getblockcount()
                 # If the call to getblockcount() succeeds then the RPC connection is up
+                self.rpc = rpc
                 self.rpc_connected = True
                 self.url = self.rpc.url
+                self.async_rpc = get_async_rpc_proxy(self.url, self.index, timeout=self.rpc_timeout, coveragedir=self.coverage_dir)
                 self.log.debug("RPC successfully started")
                 return
             except IOError as e:
@@ -230,7 +243,8 @@ class TestNode():
             except ValueError as e:  # cookie file not found and no rpcuser or rpcassword. bitcoind still starting
                 if "No RPC credentials" not in str(e):
                     raise
-            time.sleep(1.0 / poll_per_s)
+            self.reaper.join(delay)
+            delay = min(delay * 1.5, 0.25)
         self._raise_assertion_error("Unable to connect to bitcoind")
 
     def generate(self, nblocks, maxtries=1000000):
@@ -282,13 +296,18 @@ class TestNode():
             "Node returned non-zero exit code (%d) when stopping" % return_code)
         self.running = False
         self.process = None
+        self.reaper = None
         self.rpc_connected = False
         self.rpc = None
+        self.async_rpc = None
         self.log.debug("Node stopped")
         return True
 
     def wait_until_stopped(self, timeout=BITCOIND_PROC_WAIT_TIMEOUT):
-        wait_until(self.is_node_stopped, timeout=timeout)
+        if self.running:
+            self.reaper.join(timeout)
+        if not self.is_node_stopped():
+            self._raise_assertion_error("Node did not stop within %d seconds" % timeout)
 
     @contextlib.contextmanager
     def assert_debug_log(self, expected_msgs):
@@ -349,6 +368,7 @@ class TestNode():
                 self.log.debug('bitcoind failed to start: %s', e)
                 self.running = False
                 self.process = None
+                self.reaper = None
                 # Check stderr for expected message
                 if expected_msg is not None:
                     log_stderr.seek(0)
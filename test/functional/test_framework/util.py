@@ -4,6 +4,7 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Helpful routines for regression testing."""
 
+import asyncio
 from base64 import b64encode
 from binascii import hexlify, unhexlify
 from decimal import Decimal, ROUND_DOWN
@@ -14,11 +15,15 @@ import logging
 import os
 import random
 import re
+import shutil
 from subprocess import CalledProcessError
+import sys
+import threading
 import time
 
 from . import coverage
-from .authproxy import AuthServiceProxy, JSONRPCException
+from .authproxy import AsyncAuthServiceProxy, AuthServiceProxy, JSONRPCException
+from .fastmerkle import compute_fast_merkle_root
 from io import BytesIO
 
 logger = logging.getLogger("TestFramework.utils")
@@ -28,12 +33,17 @@ BITCOIN_ASSET_BYTES = bytearray.fromhex(BITCOIN_ASSET)
 BITCOIN_ASSET_BYTES.reverse()
 BITCOIN_ASSET_OUT = b"\x01"+BITCOIN_ASSET_BYTES
 
-# This variable should be set to the node being used for CalcFastMerkleRoot calls
+# Fast merkle roots are computed locally. If fastmerkle_crosscheck is set,
+# every result is also checked against node_fastmerkle's calcfastmerkleroot RPC.
 node_fastmerkle = None
+fastmerkle_crosscheck = False
 
 def calcfastmerkleroot(leaves):
-    global node_fastmerkle
-    return node_fastmerkle.calcfastmerkleroot(leaves)
+    """Compute the Elements fast merkle root of a list of hex uint256 leaves."""
+    root = bytes_to_hex_str(compute_fast_merkle_root([hex_str_to_bytes(leaf)[::-1] for leaf in leaves])[::-1])
+    if fastmerkle_crosscheck and node_fastmerkle is not None:
+        assert_equal(root, node_fastmerkle.calcfastmerkleroot(leaves))
+    return root
 
 # Assert functions
 ##################
@@ -215,21 +225,39 @@ def satoshi_round(amount):
     return Decimal(amount).quantize(Decimal('0.00000001'), rounding=ROUND_DOWN)
 
 def wait_until(predicate, *, attempts=float('inf'), timeout=float('inf'), lock=None):
+    """Wait until predicate() is true.
+
+    If lock is a threading.Condition (such as mininode_lock), predicate is
+    evaluated with it held and re-evaluated as soon as the condition is
+    notified. Otherwise predicate is polled, with the lock held if given.
+    Either way it is also re-evaluated at intervals growing from 1ms to 50ms,
+    for state that changes without notification."""
     if attempts == float('inf') and timeout == float('inf'):
         timeout = 60
     attempt = 0
     time_end = time.time() + timeout
+    delay = 0.001
 
-    while attempt < attempts and time.time() < time_end:
-        if lock:
-            with lock:
+    if isinstance(lock, threading.Condition):
+        with lock:
+            while attempt < attempts and time.time() < time_end:
                 if predicate():
                     return
-        else:
-            if predicate():
-                return
-        attempt += 1
-        time.sleep(0.05)
+                attempt += 1
+                if not lock.wait(min(delay, max(time_end - time.time(), 0))):
+                    delay = min(delay * 2, 0.05)
+    else:
+        while attempt < attempts and time.time() < time_end:
+            if lock:
+                with lock:
+                    if predicate():
+                        return
+            else:
+                if predicate():
+                    return
+            attempt += 1
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
 
     # Print the cause of the timeout
     predicate_source = inspect.getsourcelines(predicate)
@@ -279,6 +307,22 @@ def get_rpc_proxy(url, node_number, timeout=None, coveragedir=None):
 
     return coverage.AuthServiceProxyWrapper(proxy, coverage_logfile)
 
+def get_async_rpc_proxy(url, node_number, timeout=None, coveragedir=None):
+    """
+    Same as get_rpc_proxy, returning an AsyncAuthServiceProxy whose calls
+    have to be awaited.
+    """
+    proxy_kwargs = {}
+    if timeout is not None:
+        proxy_kwargs['timeout'] = timeout
+
+    proxy = AsyncAuthServiceProxy(url, **proxy_kwargs)
+
+    coverage_logfile = coverage.get_filename(
+        coveragedir, node_number) if coveragedir else None
+
+    return coverage.AsyncAuthServiceProxyWrapper(proxy, coverage_logfile)
+
 def p2p_port(n):
     assert(n <= MAX_NODES)
     return PORT_MIN + n + (MAX_NODES * PortSeed.n) % (PORT_RANGE - 1 - MAX_NODES)
@@ -286,6 +330,10 @@ def p2p_port(n):
 def rpc_port(n):
     return PORT_MIN + PORT_RANGE + n + (MAX_NODES * PortSeed.n) % (PORT_RANGE - 1 - MAX_NODES)
 
+def zmq_port(n):
+    # Past the p2p and rpc ranges, and the one feature_proxy.py uses after them
+    return PORT_MIN + 3 * PORT_RANGE + n + (MAX_NODES * PortSeed.n) % (PORT_RANGE - 1 - MAX_NODES)
+
 def rpc_url(datadir, i, chain, rpchost=None):
     rpc_u, rpc_p = get_auth_cookie(datadir, chain)
     host = '127.0.0.1'
@@ -304,6 +352,30 @@ def rpc_url(datadir, i, chain, rpchost=None):
 def get_datadir_path(dirname, n):
     return os.path.join(dirname, "node" + str(n))
 
+# Options initialize_datadir() writes for every node, after its ports
+DATADIR_CONFIG = [
+    "server=1",
+    "keypool=1",
+    "discover=0",
+    "listenonion=0",
+    "printtoconsole=0",
+    # Elements:
+    "validatepegin=0",
+    "con_parent_pegged_asset=" + BITCOIN_ASSET,
+    "con_blocksubsidy=5000000000",
+    "con_connect_coinbase=0",
+    "anyonecanspendaremine=0",
+    "walletrbf=0", # Default is 1 in Elements
+    "con_bip34height=100000000",
+    "con_bip65height=1351",
+    "con_bip66height=1251",
+    "con_csv_deploy_start=0", # Enhance tests if removing this line
+    "blindedaddresses=0", # Set to minimize broken tests in favor of custom
+    #"pubkeyprefix=111",
+    #"scriptprefix=196",
+    #"bech32_hrp=bcrt",
+]
+
 def initialize_datadir(dirname, n, chain):
     datadir = get_datadir_path(dirname, n)
     if not os.path.isdir(datadir):
@@ -313,26 +385,8 @@ def initialize_datadir(dirname, n, chain):
         f.write("[%s]\n" % chain)
         f.write("port=" + str(p2p_port(n)) + "\n")
         f.write("rpcport=" + str(rpc_port(n)) + "\n")
-        f.write("server=1\n")
-        f.write("keypool=1\n")
-        f.write("discover=0\n")
-        f.write("listenonion=0\n")
-        f.write("printtoconsole=0\n")
-        # Elements:
-        f.write("validatepegin=0\n")
-        f.write("con_parent_pegged_asset=" + BITCOIN_ASSET + "\n")
-        f.write("con_blocksubsidy=5000000000\n")
-        f.write("con_connect_coinbase=0\n")
-        f.write("anyonecanspendaremine=0\n")
-        f.write("walletrbf=0\n") # Default is 1 in Elements
-        f.write("con_bip34height=100000000\n")
-        f.write("con_bip65height=1351\n")
-        f.write("con_bip66height=1251\n")
-        f.write("con_csv_deploy_start=0\n") # Enhance tests if removing this line
-        f.write("blindedaddresses=0\n") # Set to minimize broken tests in favor of custom
-        #f.write("pubkeyprefix=111\n")
-        #f.write("scriptprefix=196\n")
-        #f.write("bech32_hrp=bcrt\n")
+        for option in DATADIR_CONFIG:
+            f.write(option + "\n")
         os.makedirs(os.path.join(datadir, 'stderr'), exist_ok=True)
         os.makedirs(os.path.join(datadir, 'stdout'), exist_ok=True)
     return datadir
@@ -342,6 +396,37 @@ def append_config(datadir, options):
         for option in options:
             f.write(option + "\n")
 
+def clone_datadir(from_dir, to_dir):
+    """Copy a cached datadir, sharing storage with it where that is safe.
+
+    LevelDB tables (*.ldb) are never modified once written, so they are
+    hardlinked. Everything else, including the block and undo files that
+    get appended to, is reflinked where the filesystem supports it and
+    copied otherwise."""
+    shutil.copytree(from_dir, to_dir, copy_function=_clone_file)
+
+# Linux FICLONE ioctl, cleared after the first failure
+_FICLONE = 0x40049409 if sys.platform.startswith("linux") else None
+
+def _clone_file(src, dst):
+    global _FICLONE
+    if src.endswith(".ldb"):
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+    if _FICLONE is not None:
+        import fcntl
+        try:
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError:
+            _FICLONE = None
+    return shutil.copy2(src, dst)
+
 def get_auth_cookie(datadir, chain):
     user = None
     password = None
@@ -403,6 +488,26 @@ def connect_nodes_bi(nodes, a, b):
     connect_nodes(nodes[a], b)
     connect_nodes(nodes[b], a)
 
+# Set by the test framework to a notifications.SyncNotifier when nodes send
+# block and transaction notifications, to wake the sync helpers up early.
+sync_notifier = None
+
+def _sync_wait(wait):
+    if sync_notifier is None:
+        time.sleep(wait)
+    else:
+        sync_notifier.wait(wait)
+
+async def _sync_wait_async(wait):
+    if sync_notifier is None:
+        await asyncio.sleep(wait)
+    else:
+        await asyncio.get_event_loop().run_in_executor(None, sync_notifier.wait, wait)
+
+def mempool_digest(mempoolinfo):
+    """Cheap summary of a mempool, equal for nodes with the same transactions."""
+    return (mempoolinfo['size'], mempoolinfo['bytes'])
+
 def sync_blocks(rpc_connections, *, wait=1, timeout=60):
     """
     Wait until everybody has the same tip.
@@ -410,29 +515,70 @@ def sync_blocks(rpc_connections, *, wait=1, timeout=60):
     sync_blocks needs to be called with an rpc_connections set that has least
     one node already synced to the latest, stable tip, otherwise there's a
     chance it might return before all nodes are stably synced.
+
+    Between polls, waits for up to `wait` seconds, or until a node notifies
+    a new block if sync_notifier is set.
     """
     stop_time = time.time() + timeout
     while time.time() <= stop_time:
         best_hash = [x.getbestblockhash() for x in rpc_connections]
         if best_hash.count(best_hash[0]) == len(rpc_connections):
             return
-        time.sleep(wait)
+        _sync_wait(wait)
     raise AssertionError("Block sync timed out:{}".format("".join("\n  {!r}".format(b) for b in best_hash)))
 
 def sync_mempools(rpc_connections, *, wait=1, timeout=60, flush_scheduler=True):
     """
     Wait until everybody has the same transactions in their memory
     pools
+
+    The full mempools are only fetched once their digests match.
     """
     stop_time = time.time() + timeout
     while time.time() <= stop_time:
-        pool = [set(r.getrawmempool()) for r in rpc_connections]
-        if pool.count(pool[0]) == len(rpc_connections):
-            if flush_scheduler:
-                for r in rpc_connections:
-                    r.syncwithvalidationinterfacequeue()
+        digest = [mempool_digest(r.getmempoolinfo()) for r in rpc_connections]
+        if digest.count(digest[0]) == len(rpc_connections):
+            pool = [set(r.getrawmempool()) for r in rpc_connections]
+            if pool.count(pool[0]) == len(rpc_connections):
+                if flush_scheduler:
+                    for r in rpc_connections:
+                        r.syncwithvalidationinterfacequeue()
+                return
+        _sync_wait(wait)
+    pool = [set(r.getrawmempool()) for r in rpc_connections]
+    raise AssertionError("Mempool sync timed out:{}".format("".join("\n  {!r}".format(m) for m in pool)))
+
+async def sync_blocks_async(rpc_connections, *, wait=1, timeout=60):
+    """
+    Same as sync_blocks, for AsyncAuthServiceProxy connections.
+
+    All nodes are queried concurrently on each round.
+    """
+    stop_time = time.time() + timeout
+    while time.time() <= stop_time:
+        best_hash = await asyncio.gather(*(x.getbestblockhash() for x in rpc_connections))
+        if best_hash.count(best_hash[0]) == len(rpc_connections):
             return
-        time.sleep(wait)
+        await _sync_wait_async(wait)
+    raise AssertionError("Block sync timed out:{}".format("".join("\n  {!r}".format(b) for b in best_hash)))
+
+async def sync_mempools_async(rpc_connections, *, wait=1, timeout=60, flush_scheduler=True):
+    """
+    Same as sync_mempools, for AsyncAuthServiceProxy connections.
+
+    All nodes are queried concurrently on each round.
+    """
+    stop_time = time.time() + timeout
+    while time.time() <= stop_time:
+        digest = [mempool_digest(i) for i in await asyncio.gather(*(r.getmempoolinfo() for r in rpc_connections))]
+        if digest.count(digest[0]) == len(rpc_connections):
+            pool = [set(m) for m in await asyncio.gather(*(r.getrawmempool() for r in rpc_connections))]
+            if pool.count(pool[0]) == len(rpc_connections):
+                if flush_scheduler:
+                    await asyncio.gather(*(r.syncwithvalidationinterfacequeue() for r in rpc_connections))
+                return
+        await _sync_wait_async(wait)
+    pool = [set(m) for m in await asyncio.gather(*(r.getrawmempool() for r in rpc_connections))]
     raise AssertionError("Mempool sync timed out:{}".format("".join("\n  {!r}".format(m) for m in pool)))
 
 # Transaction/Block functions
@@ -504,32 +650,26 @@ def random_transaction(nodes, amount, min_fee, fee_increment, fee_variants):
 
 # Helper to create at least "count" utxos
 # Pass in a fee that is sufficient for relay and mining new transactions.
+# It is paid for every new utxo, which are split off the wallet's balance
+# with a few wide transactions, see fanout.UTXOFanout.
 def create_confirmed_utxos(fee, node, count):
+    # fanout imports messages, which imports this module
+    from .fanout import UTXOFanout
+
     to_generate = int(0.5 * count) + 101
     while to_generate > 0:
         node.generate(min(25, to_generate))
         to_generate -= 25
     utxos = node.listunspent()
-    iterations = count - len(utxos)
-    addr1 = node.getnewaddress()
-    addr2 = node.getnewaddress()
-    if iterations <= 0:
+    if len(utxos) >= count:
         return utxos
-    for i in range(iterations):
-        t = utxos.pop()
-        inputs = []
-        inputs.append({"txid": t["txid"], "vout": t["vout"]})
-        outputs = {}
-        send_value = t['amount'] - fee
-        outputs[addr1] = satoshi_round(send_value / 2)
-        outputs[addr2] = satoshi_round(send_value / 2)
-        outputs["fee"] = fee
-        raw_tx = node.createrawtransaction(inputs, outputs)
-        signed_tx = node.signrawtransactionwithwallet(raw_tx)["hex"]
-        node.sendrawtransaction(signed_tx)
-
-    while (node.getmempoolinfo()['size'] > 0):
-        node.generate(1)
+    fanout = UTXOFanout(node)
+    fanout.import_key()
+    # Split up the whole balance, keeping back the fees of the splits and a
+    # margin for the fee of the funding transaction
+    balance = node.getbalance()["bitcoin"]
+    amount = satoshi_round((balance - Decimal("0.01")) / count - 2 * fee)
+    fanout.fan_out(count, amount, fee)
 
     utxos = node.listunspent()
     assert(len(utxos) >= count)
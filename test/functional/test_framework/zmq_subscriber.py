@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019 The Elements developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Streaming subscriber to the ZMQ notifications of a node.
+
+ZMQSubscriber receives notifications on a background task into a bounded
+queue and hands them out through an async iterator:
+
+    async with ZMQSubscriber("tcp://127.0.0.1:28332", [b"rawblock"]) as sub:
+        async for notification in sub:
+            block = notification.decode()
+
+rawtx and rawblock bodies decode to CTransaction and CBlock. Notifications
+keep a buffer of the received ZMQ frame rather than a copy of it, and
+decoding copies it once, into the stream it is deserialized from. Elements
+block headers are variable-length (they
+carry the signblock proof), so the header cannot be cut off at a fixed size:
+CBlock.hash is the hash of the header as the node computes it.
+
+The sequence number of each topic is checked for gaps, which is how the
+publisher dropping messages (once its high water mark is reached, because the
+subscriber fell behind) shows up. SubscriberStats counts the messages, bytes
+and losses per topic, and how long notifications waited in the queue.
+
+Notifications can also be parsed from frames received on a blocking socket
+with Notification.from_frames, tracking the sequence with SubscriberStats."""
+
+import asyncio
+from collections import Counter, namedtuple
+from io import BytesIO
+import struct
+import time
+import unittest
+
+from .messages import CBlock, CTransaction
+from .util import bytes_to_hex_str
+
+TOPICS = (b"hashblock", b"hashtx", b"rawblock", b"rawtx")
+
+class Notification(namedtuple("Notification", ["topic", "body", "sequence", "received"])):
+    """A notification, with the time it was received at.
+
+    body is a buffer of the ZMQ frame, it is not copied."""
+    __slots__ = ()
+
+    @classmethod
+    def from_frames(cls, frames, received=None):
+        """Notification from the frames of a multipart message, which may be
+        bytes or zmq.Frame objects."""
+        topic, body, sequence = [getattr(frame, "buffer", frame) for frame in frames]
+        return cls(bytes(topic), body, struct.unpack("<I", sequence)[0], time.time() if received is None else received)
+
+    def decode(self):
+        """The transaction or block of a raw notification, the hex hash of a
+        hash notification. Hashes are computed, including those of the
+        transactions of a block."""
+        if self.topic == b"rawtx":
+            obj = CTransaction()
+        elif self.topic == b"rawblock":
+            obj = CBlock()
+        else:
+            return bytes_to_hex_str(self.body)
+        obj.deserialize(BytesIO(self.body))
+        obj.rehash()
+        if self.topic == b"rawblock":
+            for tx in obj.vtx:
+                tx.rehash()
+        return obj
+
+class SubscriberStats():
+    """Counters of a subscriber, per topic."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.messages = Counter()
+        self.bytes = Counter()
+        # Messages missing from the sequence
+        self.lost = Counter()
+        # Next expected sequence number
+        self.next_sequence = {}
+        # Seconds the last notification, and the slowest, spent in the queue
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.max_queue_size = 0
+
+    def add(self, notification):
+        """Count a received notification. Returns the number of messages of
+        its topic lost just before it."""
+        topic = notification.topic
+        self.messages[topic] += 1
+        self.bytes[topic] += len(notification.body)
+        lost = 0
+        if topic in self.next_sequence:
+            lost = (notification.sequence - self.next_sequence[topic]) % (1 << 32)
+            self.lost[topic] += lost
+        self.next_sequence[topic] = (notification.sequence + 1) % (1 << 32)
+        return lost
+
+    def consumed(self, notification, queue_size):
+        self.lag = time.time() - notification.received
+        self.max_lag = max(self.max_lag, self.lag)
+        self.max_queue_size = max(self.max_queue_size, queue_size)
+
+    def throughput(self):
+        """Messages per second, per topic, since the subscriber started."""
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {topic: count / elapsed for topic, count in self.messages.items()}
+
+class ZMQSubscriber():
+    """Async iterator over the notifications of topics published at address.
+
+    Up to queue_size notifications are buffered. While the queue is full,
+    messages are left to queue up in ZMQ, and then dropped by the publisher."""
+
+    def __init__(self, address, topics=TOPICS, *, queue_size=1000, context=None):
+        import zmq
+        import zmq.asyncio
+        self.address = address
+        self.topics = topics
+        self.stats = SubscriberStats()
+        self._own_context = context is None
+        self._context = zmq.asyncio.Context() if context is None else context
+        self._socket = self._context.socket(zmq.SUB)
+        for topic in topics:
+            self._socket.setsockopt(zmq.SUBSCRIBE, topic)
+        self._socket.connect(address)
+        self._queue_size = queue_size
+        self._queue = None
+        self._receiver = None
+
+    def start(self):
+        """Start receiving, on the running event loop."""
+        if self._receiver is None:
+            self._queue = asyncio.Queue(self._queue_size)
+            self._receiver = asyncio.ensure_future(self._receive())
+
+    async def _receive(self):
+        while True:
+            frames = await self._socket.recv_multipart(copy=False)
+            notification = Notification.from_frames(frames)
+            self.stats.add(notification)
+            await self._queue.put(notification)
+
+    def close(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+        self._socket.close(linger=0)
+        if self._own_context:
+            self._context.term()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def __aiter__(self):
+        self.start()
+        return self
+
+    async def __anext__(self):
+        notification = await self._queue.get()
+        self.stats.consumed(notification, self._queue.qsize() + 1)
+        return notification
+
+    async def receive(self, timeout=None):
+        """The next notification, waiting at most timeout seconds."""
+        self.start()
+        return await asyncio.wait_for(self.__anext__(), timeout)
+
+
+class TestFrameworkZMQSubscriber(unittest.TestCase):
+    def test_stats(self):
+        stats = SubscriberStats()
+        frames = [(b"hashtx", b"\x01" * 32, 0), (b"hashtx", b"\x02" * 32, 1), (b"rawtx", b"\x00" * 10, 7),
+                  (b"hashtx", b"\x03" * 32, 4), (b"hashtx", b"\x04" * 32, 0xffffffff), (b"hashtx", b"\x05" * 32, 0)]
+        lost = [stats.add(Notification.from_frames([topic, body, struct.pack("<I", sequence)], received=0))
+                for topic, body, sequence in frames]
+        # The first message of a topic sets its sequence, which wraps around
+        self.assertEqual(lost, [0, 0, 0, 2, 0xffffffff - 5, 0])
+        self.assertEqual(stats.lost, Counter({b"hashtx": 0xffffffff - 3}))
+        self.assertEqual(stats.messages, Counter({b"hashtx": 5, b"rawtx": 1}))
+        self.assertEqual(stats.bytes, Counter({b"hashtx": 160, b"rawtx": 10}))
+        self.assertEqual(set(stats.throughput()), {b"hashtx", b"rawtx"})
+
+    def test_decode(self):
+        from .blocktools import create_block, create_coinbase
+        block = create_block(1, create_coinbase(1), 1)
+        block.solve()
+        notification = Notification.from_frames([b"rawblock", memoryview(block.serialize()), struct.pack("<I", 0)])
+        self.assertEqual(notification.decode().hash, block.hash)
+        self.assertEqual(notification.decode().vtx[0].hash, block.vtx[0].hash)
+        self.assertEqual(Notification(b"hashblock", bytes(range(32)), 0, 0).decode(), bytes(range(32)).hex())
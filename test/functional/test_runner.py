@@ -18,7 +18,11 @@ import argparse
 from collections import deque
 import configparser
 import datetime
+import json
+import multiprocessing
 import os
+import queue
+import threading
 import time
 import shutil
 import signal
@@ -27,6 +31,7 @@ import subprocess
 import tempfile
 import re
 import logging
+import unittest
 
 # Formatting. Default colors to empty strings.
 BOLD, GREEN, RED, GREY = ("", ""), ("", ""), ("", ""), ("", "")
@@ -68,6 +73,19 @@ if os.name != 'nt' or sys.getwindowsversion() >= (10, 0, 14393):
 TEST_EXIT_PASSED = 0
 TEST_EXIT_SKIPPED = 77
 
+# Test framework modules with unit tests, run before the functional tests
+TEST_FRAMEWORK_MODULES = [
+    "authproxy",
+    "key",
+    "liquid_addr",
+    "localrpc",
+    "messages",
+    "secp256k1",
+    "segwit_addr",
+    "siphash",
+    "zmq_subscriber",
+]
+
 BASE_SCRIPTS = [
     # Scripts that are run by the travis build process.
     # vv First elements tests vv
@@ -79,6 +97,7 @@ BASE_SCRIPTS = [
     'feature_pak.py',
     'feature_blocksign.py',
     'rpc_calcfastmerkleroot.py',
+    'rpc_localrpc.py',
     'feature_txwitness.py',
     'rpc_tweakfedpeg.py',
     'feature_issuance.py',
@@ -242,11 +261,12 @@ def main():
     parser.add_argument('--extended', action='store_true', help='run the extended test suite in addition to the basic tests')
     parser.add_argument('--force', '-f', action='store_true', help='run tests even on platforms where they are disabled by default (e.g. windows).')
     parser.add_argument('--help', '-h', '-?', action='store_true', help='print help text and exit')
-    parser.add_argument('--jobs', '-j', type=int, default=4, help='how many test scripts to run in parallel. Default=4.')
+    parser.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count(), help='how many test scripts to run in parallel. Default=number of CPUs.')
     parser.add_argument('--keepcache', '-k', action='store_true', help='the default behavior is to flush the cache directory on startup. --keepcache retains the cache from the previous testrun.')
     parser.add_argument('--quiet', '-q', action='store_true', help='only print dots, results summary and failure logs')
     parser.add_argument('--tmpdirprefix', '-t', default=tempfile.gettempdir(), help="Root directory for datadirs")
     parser.add_argument('--failfast', action='store_true', help='stop execution after the first test failure')
+    parser.add_argument('--timingfile', help='file to keep the duration of each test in, used to start the longest tests first. Default=<builddir>/test/timings.json')
     args, unknown_args = parser.parse_known_args()
 
     # args to be passed on always start with two dashes; tests are the remaining unknown args
@@ -345,9 +365,10 @@ def main():
         combined_logs_len=args.combinedlogslen,
         failfast=args.failfast,
         runs_ci=args.ci,
+        timing_file=args.timingfile or "%s/test/timings.json" % config["environment"]["BUILDDIR"],
     )
 
-def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=False, args=None, combined_logs_len=0, failfast=False, runs_ci):
+def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=False, args=None, combined_logs_len=0, failfast=False, runs_ci, timing_file=None):
     args = args or []
 
     # Warn if bitcoind is already running (unix only)
@@ -373,6 +394,16 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
     else:
         coverage = None
 
+    # Test Framework Tests
+    print("Running Unit Tests for Test Framework Modules")
+    test_framework_tests = unittest.TestSuite()
+    for module in TEST_FRAMEWORK_MODULES:
+        test_framework_tests.addTest(unittest.TestLoader().loadTestsFromName("test_framework.{}".format(module)))
+    result = unittest.TextTestRunner(verbosity=1, failfast=True).run(test_framework_tests)
+    if not result.wasSuccessful():
+        logging.debug("Early exiting after failure in TestFramework unit tests")
+        sys.exit(False)
+
     if len(test_list) > 1 and jobs > 1:
         # Populate cache
         try:
@@ -381,6 +412,13 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
             sys.stdout.buffer.write(e.output)
             raise
 
+    # Start the longest running tests first, so that they don't end up
+    # running alone at the end. Tests without a recorded duration go first,
+    # in list order.
+    timings = load_timings(timing_file)
+    test_list = sorted(test_list, key=lambda test: -timings.get(test, float('inf')))
+    new_timings = {}
+
     #Run Tests
     job_queue = TestHandler(
         num_tests_parallel=jobs,
@@ -398,6 +436,8 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
     for i in range(test_count):
         test_result, testdir, stdout, stderr = job_queue.get_next()
         test_results.append(test_result)
+        if test_result.status != "Failed":
+            new_timings[test_result.name] = test_result.time
         done_str = "{}/{} - {}{}{}".format(i + 1, test_count, BOLD[1], test_result.name, BOLD[0])
         if test_result.status == "Passed":
             logging.debug("%s passed, Duration: %s s" % (done_str, test_result.time))
@@ -425,6 +465,8 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
 
     print_results(test_results, max_len_name, (int(time.time() - start_time)))
 
+    save_timings(timing_file, new_timings)
+
     if coverage:
         coverage.report_rpc_coverage()
 
@@ -443,6 +485,30 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
 
     sys.exit(not all_passed)
 
+def load_timings(timing_file):
+    """Read the recorded test durations, in seconds by test name."""
+    if not timing_file:
+        return {}
+    try:
+        with open(timing_file, encoding="utf8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_timings(timing_file, new_timings):
+    """Merge the durations measured in this run into the timing file."""
+    if not timing_file or not new_timings:
+        return
+    timings = load_timings(timing_file)
+    timings.update(new_timings)
+    tmp_file = "%s.%d.tmp" % (timing_file, os.getpid())
+    try:
+        with open(tmp_file, "w", encoding="utf8") as f:
+            json.dump(timings, f, indent=0, sort_keys=True)
+        os.replace(tmp_file, timing_file)
+    except OSError as e:
+        logging.debug("Could not save test timings to %s: %s" % (timing_file, e))
+
 def print_results(test_results, max_len_name, runtime):
     results = "\n" + BOLD[1] + "%s | %s | %s\n\n" % ("TEST".ljust(max_len_name), "STATUS   ", "DURATION") + BOLD[0]
 
@@ -480,6 +546,12 @@ class TestHandler:
         self.flags = flags
         self.num_running = 0
         self.jobs = []
+        # Jobs whose process has exited, queued by one waiter thread per job
+        self.finished = queue.Queue()
+
+    def _wait_for_exit(self, job):
+        job[2].wait()
+        self.finished.put(job)
 
     def get_next(self):
         while self.num_running < self.num_jobs and self.test_list:
@@ -493,44 +565,48 @@ class TestHandler:
             test_argv = test.split()
             testdir = "{}/{}_{}".format(self.tmpdir, re.sub(".py$", "", test_argv[0]), portseed)
             tmpdir_arg = ["--tmpdir={}".format(testdir)]
-            self.jobs.append((test,
-                              time.time(),
-                              subprocess.Popen([sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg,
-                                               universal_newlines=True,
-                                               stdout=log_stdout,
-                                               stderr=log_stderr),
-                              testdir,
-                              log_stdout,
-                              log_stderr))
+            job = (test,
+                   time.time(),
+                   subprocess.Popen([sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg,
+                                    universal_newlines=True,
+                                    stdout=log_stdout,
+                                    stderr=log_stderr),
+                   testdir,
+                   log_stdout,
+                   log_stderr)
+            self.jobs.append(job)
+            threading.Thread(target=self._wait_for_exit, args=(job,), daemon=True).start()
         if not self.jobs:
             raise IndexError('pop from empty list')
         dot_count = 0
         while True:
-            # Return first proc that finishes
-            time.sleep(.5)
-            for job in self.jobs:
-                (name, start_time, proc, testdir, log_out, log_err) = job
+            for (name, start_time, proc, testdir, log_out, log_err) in self.jobs:
                 if int(time.time() - start_time) > self.timeout_duration:
                     # In travis, timeout individual tests (to stop tests hanging and not providing useful output).
                     proc.send_signal(signal.SIGINT)
-                if proc.poll() is not None:
-                    log_out.seek(0), log_err.seek(0)
-                    [stdout, stderr] = [log_file.read().decode('utf-8') for log_file in (log_out, log_err)]
-                    log_out.close(), log_err.close()
-                    if proc.returncode == TEST_EXIT_PASSED and stderr == "":
-                        status = "Passed"
-                    elif proc.returncode == TEST_EXIT_SKIPPED:
-                        status = "Skipped"
-                    else:
-                        status = "Failed"
-                    self.num_running -= 1
-                    self.jobs.remove(job)
-                    clearline = '\r' + (' ' * dot_count) + '\r'
-                    print(clearline, end='', flush=True)
-                    dot_count = 0
-                    return TestResult(name, status, int(time.time() - start_time)), testdir, stdout, stderr
-            print('.', end='', flush=True)
-            dot_count += 1
+            # Return first proc that finishes
+            try:
+                job = self.finished.get(timeout=.5)
+            except queue.Empty:
+                print('.', end='', flush=True)
+                dot_count += 1
+                continue
+            (name, start_time, proc, testdir, log_out, log_err) = job
+            log_out.seek(0), log_err.seek(0)
+            [stdout, stderr] = [log_file.read().decode('utf-8') for log_file in (log_out, log_err)]
+            log_out.close(), log_err.close()
+            if proc.returncode == TEST_EXIT_PASSED and stderr == "":
+                status = "Passed"
+            elif proc.returncode == TEST_EXIT_SKIPPED:
+                status = "Skipped"
+            else:
+                status = "Failed"
+            self.num_running -= 1
+            self.jobs.remove(job)
+            clearline = '\r' + (' ' * dot_count) + '\r'
+            print(clearline, end='', flush=True)
+            dot_count = 0
+            return TestResult(name, status, int(time.time() - start_time)), testdir, stdout, stderr
 
     def kill_and_join(self):
         """Send SIGKILL to all jobs and block until all have ended."""
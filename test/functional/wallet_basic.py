@@ -23,6 +23,7 @@ class WalletTest(BitcoinTestFramework):
     def set_test_params(self):
         self.num_nodes = 4
         self.setup_clean_chain = True
+        self.sync_notifications = True
 
     def skip_test_if_missing_module(self):
         self.skip_if_no_wallet()